@@ -0,0 +1,331 @@
+"""
+消息编解码
+
+安装了orjson时使用orjson解析和生成JSON，否则回退到标准库json。
+直接从MQTT负载的bytes/memoryview解码，不再先decode成str再解析。
+按主题注册负载结构校验，device/+/data的遥测数据在解码时完成字段类型检查，
+处理函数拿到的数据不需要再做类型判断。
+
+遥测数据还支持紧凑的二进制格式：设备把字段字典(TelemetrySchema)以保留消息发布到
+device/{device_id}/schema，服务端记录后回复确认，设备收到确认后才改用二进制发送，
+否则继续发送JSON。二进制负载以BINARY_MAGIC开头，解码结果与JSON负载相同。
+"""
+import json
+import struct
+import zlib
+from topic_router import TopicRouter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 当前使用的JSON后端
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+class CodecError(ValueError):
+    """负载无法解码或不符合结构要求"""
+
+def decode_json(payload):
+    """
+    解析JSON负载
+    :param payload: bytes、bytearray、memoryview或str
+    :return: 解析后的对象
+    :raises CodecError: 负载不是合法的UTF-8 JSON
+    """
+    try:
+        if orjson is not None:
+            return orjson.loads(payload)
+        # 标准库json不接受memoryview
+        if isinstance(payload, memoryview):
+            payload = payload.tobytes()
+        return json.loads(payload)
+    except (ValueError, TypeError) as e:
+        raise CodecError(f"无法解析JSON数据: {str(e)}") from e
+
+def encode_json(obj):
+    """
+    把对象序列化为UTF-8编码的JSON
+    :param obj: 要序列化的对象
+    :return: bytes
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            # orjson不支持的类型交给标准库处理
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+# 按精确类型检查，bool虽然是int的子类但不算数值
+_NUMBER = frozenset((int, float))
+_STR = frozenset((str,))
+
+# device/+/data 负载中已知字段的类型，未列出的字段允许任意JSON标量或对象
+TELEMETRY_FIELD_TYPES = {
+    "device_id": _STR,
+    "device_type": _STR,
+    "location": _STR,
+    "timestamp": _NUMBER | _STR,
+    "temperature": _NUMBER,
+    "humidity": _NUMBER,
+    "cpu_usage": _NUMBER,
+    "cpu_freq": _NUMBER,
+    "cpu_load": _NUMBER,
+    "cpu_temperature": _NUMBER,
+    "memory_total": _NUMBER,
+    "memory_used": _NUMBER,
+    "memory_percent": _NUMBER,
+    "disk_total": _NUMBER,
+    "disk_used": _NUMBER,
+    "disk_percent": _NUMBER,
+    "net_bytes_sent": _NUMBER,
+    "net_bytes_recv": _NUMBER,
+    "boot_time": _NUMBER,
+    "uptime_seconds": _NUMBER
+}
+
+def validate_telemetry(data, device_id=None):
+    """
+    校验device/+/data的遥测负载
+    负载中没有device_id时使用主题中的设备ID
+    :param data: 解码后的负载
+    :param device_id: 从主题中解析的设备ID
+    :return: 校验后的数据字典
+    :raises CodecError: 负载不是对象或已知字段类型不符
+    """
+    if not isinstance(data, dict):
+        raise CodecError(f"遥测数据必须是JSON对象，实际为: {type(data).__name__}")
+
+    field_types = TELEMETRY_FIELD_TYPES
+    for key, value in data.items():
+        expected = field_types.get(key)
+        if expected is not None and value is not None and type(value) not in expected:
+            raise CodecError(f"遥测字段 {key} 类型错误: {type(value).__name__}")
+
+    if "device_id" not in data and device_id:
+        data["device_id"] = device_id
+    return data
+
+# 二进制遥测格式
+# 头部: 魔数(1字节) 格式版本(1字节) 字段字典ID(2字节) 字段存在位图(8字节)，小端序
+# 之后按字段字典顺序排列存在的字段值：
+#   d - float64  q - int64  ? - bool  s - uint16长度前缀的UTF-8字符串
+BINARY_MAGIC = 0xB7
+BINARY_FORMAT_VERSION = 1
+_BINARY_HEADER = struct.Struct("<BBHQ")
+_STR_LENGTH = struct.Struct("<H")
+_VALUE_STRUCTS = {code: struct.Struct("<" + code) for code in ("d", "q", "?")}
+
+# 二进制格式最多支持的字段数（位图宽度）
+MAX_BINARY_FIELDS = 64
+
+def _type_code(value):
+    """获取值在二进制格式中的类型代码，不支持的类型返回None"""
+    value_type = type(value)
+    if value_type is bool:
+        return "?"
+    if value_type is int:
+        return "q"
+    if value_type is float:
+        return "d"
+    if value_type is str:
+        return "s"
+    return None
+
+class TelemetrySchema:
+    """二进制遥测的字段字典，ID由字段名和类型计算，相同字段得到相同ID"""
+
+    def __init__(self, fields):
+        """
+        :param fields: [(字段名, 类型代码)]
+        """
+        if len(fields) > MAX_BINARY_FIELDS:
+            raise CodecError(f"字段数超过二进制格式上限: {len(fields)} > {MAX_BINARY_FIELDS}")
+        for name, code in fields:
+            if code not in ("d", "q", "?", "s"):
+                raise CodecError(f"字段 {name} 的类型代码无效: {code}")
+        self.fields = [(name, code) for name, code in fields]
+        self.names = {name for name, _ in self.fields}
+        signature = ",".join(f"{name}:{code}" for name, code in self.fields)
+        self.schema_id = zlib.crc32(signature.encode("utf-8")) & 0xFFFF
+
+    @classmethod
+    def from_data(cls, data, exclude=("device_id",)):
+        """
+        根据一条遥测数据生成字段字典，不支持的值类型（嵌套对象、列表等）不纳入
+        :param data: 遥测数据字典
+        :param exclude: 不编码的字段，device_id由主题携带
+        """
+        fields = []
+        for name, value in data.items():
+            if name in exclude or value is None:
+                continue
+            code = _type_code(value)
+            if code is not None:
+                fields.append((name, code))
+        return cls(fields)
+
+    @classmethod
+    def from_dict(cls, schema):
+        """
+        从schema主题的负载创建字段字典
+        :param schema: {"schema_id": ..., "format": ..., "fields": [[名称, 类型代码], ...]}
+        """
+        if not isinstance(schema, dict) or not isinstance(schema.get("fields"), list):
+            raise CodecError("字段字典格式无效")
+        if schema.get("format") != BINARY_FORMAT_VERSION:
+            raise CodecError(f"不支持的二进制格式版本: {schema.get('format')}")
+        instance = cls([tuple(field) for field in schema["fields"]])
+        if schema.get("schema_id") != instance.schema_id:
+            raise CodecError(f"字段字典ID不匹配: {schema.get('schema_id')} != {instance.schema_id}")
+        return instance
+
+    def to_dict(self):
+        """转换为发布到schema主题的负载"""
+        return {
+            "schema_id": self.schema_id,
+            "format": BINARY_FORMAT_VERSION,
+            "encoding": "struct",
+            "fields": [[name, code] for name, code in self.fields]
+        }
+
+    def covers(self, data, exclude=("device_id",)):
+        """数据中可编码的字段是否都在字段字典中且类型一致"""
+        types = dict(self.fields)
+        for name, value in data.items():
+            if name in exclude or value is None:
+                continue
+            code = _type_code(value)
+            if code is not None and types.get(name) != code:
+                return False
+        return True
+
+    def encode(self, data):
+        """
+        把遥测数据编码为二进制负载，不在字段字典中的字段会被忽略
+        :param data: 遥测数据字典
+        :return: bytes
+        """
+        bitmap = 0
+        parts = []
+        for index, (name, code) in enumerate(self.fields):
+            value = data.get(name)
+            if value is None:
+                continue
+            bitmap |= 1 << index
+            if code == "s":
+                encoded = value.encode("utf-8")
+                parts.append(_STR_LENGTH.pack(len(encoded)))
+                parts.append(encoded)
+            else:
+                parts.append(_VALUE_STRUCTS[code].pack(value))
+        header = _BINARY_HEADER.pack(BINARY_MAGIC, BINARY_FORMAT_VERSION, self.schema_id, bitmap)
+        return header + b"".join(parts)
+
+    def decode(self, payload):
+        """
+        把二进制负载解码为遥测数据字典
+        :param payload: bytes或memoryview
+        :return: 数据字典
+        :raises CodecError: 负载长度或内容与字段字典不符
+        """
+        try:
+            _, _, _, bitmap = _BINARY_HEADER.unpack_from(payload, 0)
+            offset = _BINARY_HEADER.size
+            data = {}
+            for index, (name, code) in enumerate(self.fields):
+                if not bitmap >> index & 1:
+                    continue
+                if code == "s":
+                    (length,) = _STR_LENGTH.unpack_from(payload, offset)
+                    offset += _STR_LENGTH.size
+                    data[name] = bytes(payload[offset:offset + length]).decode("utf-8")
+                    offset += length
+                else:
+                    value_struct = _VALUE_STRUCTS[code]
+                    (data[name],) = value_struct.unpack_from(payload, offset)
+                    offset += value_struct.size
+        except (struct.error, UnicodeDecodeError) as e:
+            raise CodecError(f"二进制遥测数据无效: {str(e)}") from e
+        if offset != len(payload):
+            raise CodecError(f"二进制遥测数据长度不符: {len(payload)}，应为{offset}")
+        return data
+
+def is_binary_payload(payload):
+    """负载是否为二进制遥测格式（JSON负载不可能以该字节开头）"""
+    return len(payload) > 0 and payload[0] == BINARY_MAGIC
+
+class MessageCodec:
+    """按主题解码并校验消息负载"""
+
+    def __init__(self):
+        self.schemas = TopicRouter()
+        # 设备上报的二进制字段字典：(设备ID, 字段字典ID) -> TelemetrySchema
+        self.binary_schemas = {}
+
+    def register_schema(self, pattern, validator):
+        """
+        注册主题的负载校验函数
+        :param pattern: 主题过滤器，{name}参数会作为关键字参数传给校验函数
+        :param validator: 校验函数，签名为 validator(data, **params)，返回校验后的数据
+        """
+        self.schemas.add(pattern, validator)
+
+    def learn_schema(self, schema, device_id=None):
+        """
+        记录设备发布的二进制字段字典，作为device/{device_id}/schema主题的校验函数注册
+        :param schema: 字段字典负载
+        :param device_id: 从主题中解析的设备ID
+        :return: 字段字典负载，附带device_id
+        :raises CodecError: 字段字典无效
+        """
+        telemetry_schema = TelemetrySchema.from_dict(schema)
+        self.binary_schemas[(device_id, telemetry_schema.schema_id)] = telemetry_schema
+        schema["device_id"] = device_id
+        return schema
+
+    def decode(self, topic, payload):
+        """
+        解码消息负载，主题注册了结构校验时同时完成校验
+        :param topic: 消息主题
+        :param payload: 消息负载，JSON或二进制遥测格式
+        :return: 解码后的数据
+        :raises CodecError: 解码或校验失败
+        """
+        validator, params = self.schemas.first(topic)
+        if is_binary_payload(payload):
+            data = self._decode_binary(payload, params)
+        else:
+            data = decode_json(payload)
+        if validator is not None:
+            data = validator(data, **params)
+        return data
+
+    def _decode_binary(self, payload, params):
+        """按设备的字段字典解码二进制负载"""
+        device_id = params.get("device_id") if params else None
+        if len(payload) < _BINARY_HEADER.size:
+            raise CodecError("二进制遥测数据长度不足")
+        _, version, schema_id, _ = _BINARY_HEADER.unpack_from(payload, 0)
+        if version != BINARY_FORMAT_VERSION:
+            raise CodecError(f"不支持的二进制格式版本: {version}")
+        telemetry_schema = self.binary_schemas.get((device_id, schema_id))
+        if telemetry_schema is None:
+            raise CodecError(f"设备 {device_id} 的字段字典 {schema_id} 未知")
+        return telemetry_schema.decode(payload)
+
+# 默认编解码器，已注册遥测数据的结构校验
+default_codec = MessageCodec()
+default_codec.register_schema("device/{device_id}/data", validate_telemetry)
+default_codec.register_schema("device/{device_id}/schema", default_codec.learn_schema)
+
+def decode_message(topic, payload):
+    """
+    使用默认编解码器解码消息负载
+    :param topic: 消息主题
+    :param payload: 消息负载
+    :return: 解码后的数据
+    :raises CodecError: 解码或校验失败
+    """
+    return default_codec.decode(topic, payload)
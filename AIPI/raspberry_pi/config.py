@@ -22,10 +22,13 @@ MQTT_CONFIG = {
     "keep_alive": int(os.getenv("MQTT_KEEP_ALIVE", "60")),
     "subscribe_topics": [
         f"device/{os.getenv('DEVICE_ID', 'raspberry_pi')}/command",  # 命令主题
+        f"device/{os.getenv('DEVICE_ID', 'raspberry_pi')}/schema/ack",  # 服务端确认二进制字段字典
+        f"device/{os.getenv('DEVICE_ID', 'raspberry_pi')}/keyframe",    # 服务端请求发送关键帧
         "device/control/#"                                           # 控制主题
     ],
     "publish_topics": {
         "device_data": f"device/{os.getenv('DEVICE_ID', 'raspberry_pi')}/data",
+        "device_schema": f"device/{os.getenv('DEVICE_ID', 'raspberry_pi')}/schema",  # 二进制遥测字段字典（保留消息）
         "device_status": f"device/{os.getenv('DEVICE_ID', 'raspberry_pi')}/status",
         "command_result": f"device/{os.getenv('DEVICE_ID', 'raspberry_pi')}/result"
     }
@@ -310,7 +313,12 @@ DATA_COLLECTION_CONFIG = {
     "collect_memory": os.getenv("COLLECT_MEMORY", "True").lower() == "true",
     "collect_disk": os.getenv("COLLECT_DISK", "True").lower() == "true",
     "collect_network": os.getenv("COLLECT_NETWORK", "True").lower() == "true",
-    "collect_temperature": os.getenv("COLLECT_TEMPERATURE", "True").lower() == "true"
+    "collect_temperature": os.getenv("COLLECT_TEMPERATURE", "True").lower() == "true",
+    # 遥测编码：binary - 服务端确认字段字典后发送二进制，确认前和不支持的服务端使用JSON；json - 始终使用JSON
+    "encoding": os.getenv("TELEMETRY_ENCODING", "binary").lower(),
+    # 增量帧：服务端在字段字典确认中声明支持后，只发送变化的字段，每隔keyframe_interval帧发送一次完整关键帧
+    "delta_enabled": os.getenv("TELEMETRY_DELTA", "True").lower() == "true",
+    "keyframe_interval": int(os.getenv("TELEMETRY_KEYFRAME_INTERVAL", "10"))
 }
 
 # 设备ID - 用于标识当前树莓派
@@ -1,5 +1,4 @@
 import paho.mqtt.client as mqtt
-import json
 import time
 import logging
 import threading
@@ -9,6 +8,9 @@ import platform
 
 # 使用本地配置
 from config import MQTT_CONFIG, LOG_CONFIG, DEVICE_ID, DATA_COLLECTION_CONFIG
+from topic_router import TopicRouter
+from codec import decode_json, encode_json, CodecError, TelemetrySchema
+from telemetry_delta import DeltaEncoder
 
 # 配置日志
 logging.basicConfig(
@@ -33,6 +35,21 @@ class MQTTClient:
         # 存储当前正在执行的命令
         self.active_commands = {}
         
+        # 消息路由：处理函数的参数为 (topic, data)
+        self.router = TopicRouter()
+        self.router.add("device/+/command", lambda topic, data: self.handle_command(data))
+        self.router.add("device/control/#", self.handle_device_control)
+        self.router.add("device/+/schema/ack", self.handle_schema_ack)
+        self.router.add("device/+/keyframe", lambda topic, data: self.delta_encoder.request_keyframe())
+        
+        # 二进制遥测：当前字段字典、服务端已确认的字段字典ID和服务端支持的特性
+        self.telemetry_schema = None
+        self.acked_schema_id = None
+        self.server_features = set()
+        
+        # 增量帧编码
+        self.delta_encoder = DeltaEncoder(DATA_COLLECTION_CONFIG["keyframe_interval"])
+        
         # 数据收集线程
         self.data_collection_thread = None
         self.stop_collection = False
@@ -66,6 +83,14 @@ class MQTTClient:
             # 发布设备上线状态
             self.publish_device_status("online")
             
+            # 新会话从关键帧开始
+            self.delta_encoder.request_keyframe()
+            
+            # 代理服务器可能丢失了保留的字段字典，重新发布并等待服务端确认
+            if self.telemetry_schema is not None:
+                self.acked_schema_id = None
+                self.publish_telemetry_schema()
+            
             # 启动数据收集线程
             self.start_data_collection()
         else:
@@ -75,23 +100,18 @@ class MQTTClient:
         """消息接收回调函数"""
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
-            logger.debug(f"收到消息，主题: {topic}，内容: {payload}")
+            logger.debug("收到消息，主题: %s，内容: %s", topic, msg.payload)
             
-            # 解析JSON数据
+            # 直接从bytes解析JSON数据
             try:
-                data = json.loads(payload)
+                data = decode_json(msg.payload)
                 
-                # 处理命令
-                if topic.endswith("/command"):
-                    self.handle_command(data)
-                    
-                # 处理设备控制
-                elif "device/control" in topic:
-                    self.handle_device_control(topic, data)
+                # 按主题分发到命令或设备控制处理函数
+                if not self.router.dispatch(topic, topic, data):
+                    logger.debug(f"没有匹配的处理函数，主题: {topic}")
                     
-            except json.JSONDecodeError:
-                logger.warning(f"无法解析JSON数据: {payload}")
+            except CodecError as e:
+                logger.warning(f"消息解码失败，主题: {topic}，{str(e)}")
                 
         except Exception as e:
             logger.error(f"处理消息时出错: {str(e)}")
@@ -109,13 +129,13 @@ class MQTTClient:
             # 停止数据收集
             self.stop_collection = True
             
-    def publish(self, topic, message):
+    def publish(self, topic, message, qos=0, retain=False):
         """发布消息到指定主题"""
         try:
             if isinstance(message, dict):
-                message = json.dumps(message, ensure_ascii=False)
+                message = encode_json(message)
                 
-            result = self.client.publish(topic, message)
+            result = self.client.publish(topic, message, qos=qos, retain=retain)
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
                 logger.debug(f"消息发布成功 - 主题: {topic}")
                 return True
@@ -148,14 +168,66 @@ class MQTTClient:
             data["device_id"] = DEVICE_ID
             data["timestamp"] = time.time()
             
+            # 服务端支持时改为发送增量帧，字段字典仍按完整数据生成
+            frame = data
+            if DATA_COLLECTION_CONFIG["delta_enabled"] and "delta" in self.server_features:
+                frame = self.delta_encoder.encode(data)
+                data.update(frame)
+            
             return self.publish(
                 MQTT_CONFIG["publish_topics"]["device_data"], 
-                data
+                self.encode_device_data(frame, schema_source=data)
             )
         except Exception as e:
             logger.error(f"发布设备数据时出错: {str(e)}")
             return False
             
+    def encode_device_data(self, data, schema_source=None):
+        """
+        按协商结果编码设备数据
+        字段变化时生成新的字段字典并发布，服务端确认前使用JSON
+        :param data: 设备数据字典
+        :param schema_source: 生成字段字典使用的完整数据，默认为data
+        :return: 二进制负载，或交给publish序列化为JSON的字典
+        """
+        if DATA_COLLECTION_CONFIG["encoding"] != "binary":
+            return data
+            
+        schema_source = schema_source or data
+        try:
+            if self.telemetry_schema is None or not self.telemetry_schema.covers(schema_source):
+                self.telemetry_schema = TelemetrySchema.from_data(schema_source)
+                self.acked_schema_id = None
+                self.publish_telemetry_schema()
+        except CodecError as e:
+            logger.warning(f"无法生成二进制字段字典，使用JSON发送: {str(e)}")
+            self.telemetry_schema = None
+            return data
+            
+        if self.acked_schema_id == self.telemetry_schema.schema_id:
+            return self.telemetry_schema.encode(data)
+        return data
+        
+    def publish_telemetry_schema(self):
+        """以保留消息发布二进制遥测字段字典"""
+        schema = self.telemetry_schema.to_dict()
+        logger.info(f"发布二进制字段字典 {schema['schema_id']}，字段数: {len(schema['fields'])}")
+        return self.publish(
+            MQTT_CONFIG["publish_topics"]["device_schema"],
+            schema,
+            qos=1,
+            retain=True
+        )
+        
+    def handle_schema_ack(self, topic, data):
+        """服务端确认字段字典后改用二进制发送"""
+        schema_id = data.get("schema_id")
+        if self.telemetry_schema is not None and schema_id == self.telemetry_schema.schema_id:
+            if self.acked_schema_id != schema_id:
+                logger.info(f"服务端已确认字段字典 {schema_id}，改用二进制发送遥测数据")
+            self.acked_schema_id = schema_id
+            self.server_features = set(data.get("features", []))
+            
     def publish_command_result(self, command_id, success, output="", error=""):
         """发布命令执行结果"""
         result = {
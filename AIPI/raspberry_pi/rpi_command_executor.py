@@ -8,6 +8,7 @@ import subprocess
 from datetime import datetime
 import paho.mqtt.client as mqtt
 import platform
+from codec import decode_json, CodecError
 
 # 配置日志
 logging.basicConfig(
@@ -100,12 +101,11 @@ class CommandExecutor:
         """消息回调函数"""
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
-            logger.debug(f"收到消息: {topic} => {payload}")
+            logger.debug("收到消息: %s => %s", topic, msg.payload)
             
             # 处理命令主题消息
             if topic == f"device/{self.device_id}/command":
-                self.handle_command(payload)
+                self.handle_command(msg.payload)
                 
         except Exception as e:
             logger.error(f"处理消息时出错: {e}")
@@ -113,8 +113,8 @@ class CommandExecutor:
     def handle_command(self, payload):
         """处理命令消息"""
         try:
-            # 解析命令消息
-            data = json.loads(payload)
+            # 解析命令消息，payload可以是bytes或str
+            data = decode_json(payload)
             command_id = data.get('command_id', str(int(time.time())))
             command = data.get('command')
             timeout = data.get('timeout', 60)
@@ -132,7 +132,7 @@ class CommandExecutor:
             # 发布执行结果
             self.publish_result(command_id, result['success'], result['output'], result.get('error'))
                 
-        except json.JSONDecodeError:
+        except CodecError:
             logger.warning(f"无法解析命令消息为JSON: {payload}")
             self.publish_result('unknown', False, "无法解析命令消息为JSON")
         except Exception as e:
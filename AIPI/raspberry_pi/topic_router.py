@@ -0,0 +1,181 @@
+"""
+MQTT主题路由器
+
+把带通配符的主题过滤器编译成按层级的前缀树，收到消息时沿主题层级查找一次即可得到
+所有匹配的处理器，匹配耗时只与主题层数有关，与注册的过滤器数量无关。
+过滤器中的 {name} 表示单层通配符(+)并把该层的值作为参数name返回，
+例如 device/{device_id}/data 匹配 device/rpi_01/data 时得到 {"device_id": "rpi_01"}。
+设备主题的数量有限，匹配结果按主题缓存，重复出现的主题只需一次字典查找。
+"""
+
+class _Node:
+    """前缀树节点"""
+    __slots__ = ("children", "plus", "hash_routes", "routes")
+
+    def __init__(self):
+        self.children = {}       # 普通层级 -> 子节点
+        self.plus = None         # 单层通配符(+)子节点
+        self.hash_routes = []    # 以多层通配符(#)结尾、挂在本节点的路由
+        self.routes = []         # 在本节点结束的路由
+
+class _Route:
+    """一条已注册的路由"""
+    __slots__ = ("order", "topic_filter", "handler", "names")
+
+    def __init__(self, order, topic_filter, handler, names):
+        self.order = order
+        self.topic_filter = topic_filter
+        self.handler = handler
+        self.names = names       # 每个单层通配符对应的参数名，未命名为None
+
+def compile_filter(pattern):
+    """
+    把带命名参数的过滤器转换为MQTT订阅过滤器
+    :param pattern: 例如 device/{device_id}/data
+    :return: (MQTT过滤器, 参数名列表)，例如 ("device/+/data", ["device_id"])
+    """
+    levels = []
+    names = []
+    parts = pattern.split("/")
+    for i, level in enumerate(parts):
+        if level.startswith("{") and level.endswith("}"):
+            names.append(level[1:-1])
+            levels.append("+")
+        elif level == "+":
+            names.append(None)
+            levels.append(level)
+        elif level == "#":
+            if i != len(parts) - 1:
+                raise ValueError(f"多层通配符#只能出现在过滤器末尾: {pattern}")
+            levels.append(level)
+        elif "+" in level or "#" in level or "{" in level or "}" in level:
+            raise ValueError(f"无效的主题过滤器层级: {level}（过滤器: {pattern}）")
+        else:
+            levels.append(level)
+    return "/".join(levels), names
+
+class TopicRouter:
+    """按主题过滤器注册处理器，并按主题查找匹配的处理器和参数"""
+
+    def __init__(self, cache_size=10000):
+        """
+        :param cache_size: 匹配结果缓存的主题数上限，0表示不缓存
+        """
+        self._root = _Node()
+        self._routes = []
+        self._cache = {}
+        self.cache_size = cache_size
+
+    def add(self, pattern, handler):
+        """
+        注册路由
+        :param pattern: 主题过滤器，支持 +、# 和 {name} 命名单层通配符
+        :param handler: 处理器，可以是函数或任意对象
+        :return: 对应的MQTT订阅过滤器
+        """
+        topic_filter, names = compile_filter(pattern)
+        route = _Route(len(self._routes), topic_filter, handler, names)
+
+        node = self._root
+        levels = topic_filter.split("/")
+        for level in levels:
+            if level == "#":
+                node.hash_routes.append(route)
+                break
+            if level == "+":
+                if node.plus is None:
+                    node.plus = _Node()
+                node = node.plus
+            else:
+                child = node.children.get(level)
+                if child is None:
+                    child = node.children[level] = _Node()
+                node = child
+        else:
+            node.routes.append(route)
+
+        self._routes.append(route)
+        self._cache.clear()
+        return topic_filter
+
+    def route(self, pattern):
+        """
+        装饰器形式的add
+        :param pattern: 主题过滤器
+        """
+        def decorator(handler):
+            self.add(pattern, handler)
+            return handler
+        return decorator
+
+    def filters(self):
+        """获取所有已注册路由的MQTT订阅过滤器（去重，保持注册顺序）"""
+        return list(dict.fromkeys(route.topic_filter for route in self._routes))
+
+    def match(self, topic):
+        """
+        查找与主题匹配的所有路由
+        :param topic: 消息主题（不含通配符）
+        :return: [(处理器, 参数字典)]，按注册顺序排列；结果可能被缓存共享，调用方不要修改
+        """
+        matches = self._cache.get(topic)
+        if matches is not None:
+            return matches
+
+        levels = topic.split("/")
+        found = []
+        self._walk(self._root, levels, 0, [], found)
+        if len(found) > 1:
+            found.sort(key=lambda item: item[0].order)
+        matches = [(route.handler, self._params(route, values)) for route, values in found]
+
+        if self.cache_size:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[topic] = matches
+        return matches
+
+    def first(self, topic):
+        """
+        查找第一个匹配的路由
+        :param topic: 消息主题
+        :return: (处理器, 参数字典)，没有匹配时返回(None, None)
+        """
+        matches = self.match(topic)
+        return matches[0] if matches else (None, None)
+
+    def dispatch(self, topic, *args, **kwargs):
+        """
+        调用所有匹配的处理器，主题参数以关键字参数传入
+        :param topic: 消息主题
+        :return: 调用的处理器数量
+        """
+        matches = self.match(topic)
+        for handler, params in matches:
+            handler(*args, **params, **kwargs)
+        return len(matches)
+
+    def _walk(self, node, levels, depth, values, found):
+        # 多层通配符匹配剩余的所有层级（包括零层）；$开头的主题不匹配首层通配符
+        wildcard_allowed = depth > 0 or not levels[0].startswith("$")
+        if node.hash_routes and wildcard_allowed:
+            for route in node.hash_routes:
+                found.append((route, values))
+
+        if depth == len(levels):
+            for route in node.routes:
+                found.append((route, values))
+            return
+
+        level = levels[depth]
+        child = node.children.get(level)
+        if child is not None:
+            self._walk(child, levels, depth + 1, values, found)
+        if node.plus is not None and wildcard_allowed:
+            self._walk(node.plus, levels, depth + 1, values + [level], found)
+
+    @staticmethod
+    def _params(route, values):
+        if not route.names:
+            return {}
+        return {name: value for name, value in zip(route.names, values) if name}
@@ -5,7 +5,7 @@ import argparse
 import schedule
 from datetime import datetime
 from config import LOG_CONFIG, ALERT_CONFIG
-from influx_writer import query_latest_data
+from influx_writer import query_latest_data, query_latest_data_batch
 from alert_manager import check_and_send_alert
 from influx_writer import write_event_to_influxdb
 
@@ -25,8 +25,21 @@ def check_device(device_id):
     """
     try:
         # 从InfluxDB获取最新数据
-        latest_data = query_latest_data(device_id, time_range="10m")
-        
+        latest_data = query_latest_data(device_id, time_range=ALERT_CONFIG.get("data_time_range", "10m"))
+    except Exception as e:
+        logger.error(f"检查设备 {device_id} 时出错: {str(e)}")
+        return False
+    
+    return evaluate_device(device_id, latest_data)
+
+def evaluate_device(device_id, latest_data):
+    """
+    根据设备最新数据检查告警规则，没有数据时检查是否发生通信故障
+    :param device_id: 设备ID
+    :param latest_data: 设备最新数据，没有数据时为None
+    :return: 是否发送了告警
+    """
+    try:
         if not latest_data:
             logger.warning(f"未找到设备 {device_id} 的最新数据")
             
@@ -108,14 +121,51 @@ def check_all_devices():
     for device_id in ALERT_CONFIG.get("additional_devices", []):
         device_ids.add(device_id)
         
-    logger.info(f"开始检查 {len(device_ids)} 个设备")
+    if not ALERT_CONFIG.get("batch_query", True):
+        logger.info(f"开始检查 {len(device_ids)} 个设备")
+        alert_count = 0
+        for device_id in device_ids:
+            if check_device(device_id):
+                alert_count += 1
+        logger.info(f"设备检查完成，触发了 {alert_count} 个告警")
+        return alert_count
+        
+    return check_devices_batch(device_ids, ALERT_CONFIG.get("check_reporting_devices", False))
+
+def check_devices_batch(device_ids, include_reporting=False):
+    """
+    批量查询设备最新数据并逐个检查，查询结果边返回边检查
+    :param device_ids: 需要检查的设备ID集合
+    :param include_reporting: 是否同时检查时间范围内上报过数据的所有设备
+    :return: 触发的告警数
+    """
+    started_at = time.time()
+    logger.info(f"开始批量检查设备，配置的设备数: {len(device_ids)}"
+                f"{'，并检查所有上报数据的设备' if include_reporting else ''}")
+    
+    results = query_latest_data_batch(
+        None if include_reporting else list(device_ids),
+        time_range=ALERT_CONFIG.get("data_time_range", "10m"),
+        shard_size=ALERT_CONFIG.get("batch_shard_size", 500),
+        max_workers=ALERT_CONFIG.get("batch_query_workers", 4)
+    )
     
     alert_count = 0
-    for device_id in device_ids:
-        if check_device(device_id):
+    checked = set()
+    for device_id, latest_data in results:
+        checked.add(device_id)
+        if evaluate_device(device_id, latest_data):
             alert_count += 1
-            
-    logger.info(f"设备检查完成，触发了 {alert_count} 个告警")
+    
+    # 没有返回数据的设备检查是否发生通信故障
+    for device_id in device_ids:
+        if device_id not in checked:
+            checked.add(device_id)
+            if evaluate_device(device_id, None):
+                alert_count += 1
+    
+    logger.info(f"设备检查完成，共检查 {len(checked)} 个设备，触发了 {alert_count} 个告警，"
+                f"耗时 {time.time() - started_at:.2f} 秒")
     return alert_count
 
 def run_scheduled_checks():
@@ -1,12 +1,17 @@
+import asyncio
 import logging
 import time
 import json
+import os
 import smtplib
+import sqlite3
+import threading
 import requests
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from config import ALERT_CONFIG, LOG_CONFIG
-from influx_writer import write_event_to_influxdb
+from influx_writer import write_event_to_influxdb, write_event_to_influxdb_async
+from alert_rules import device_type_of, get_rule_engine
 
 # 配置日志
 logging.basicConfig(
@@ -21,6 +26,85 @@ alert_history = {}
 # 告警冷却时间（秒）
 ALERT_COOLDOWN = ALERT_CONFIG.get("cooldown_seconds", 300)  # 默认5分钟
 
+class SharedAlertCooldown:
+    """
+    多个接入进程共用的告警冷却记录，保存在SQLite文件中
+    共享订阅把同一设备的消息分给不同进程，进程内的alert_history无法阻止其他进程重复告警；
+    这里用一条带条件的UPSERT原子地占用冷却期，同一告警在冷却期内只有一个进程发送
+    """
+
+    def __init__(self, path, cooldown):
+        """
+        :param path: SQLite数据库文件路径
+        :param cooldown: 冷却时间（秒）
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA busy_timeout=5000")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS alert_cooldown (alert_key TEXT PRIMARY KEY, time REAL NOT NULL)"
+        )
+
+    def claim(self, alert_key, current_time):
+        """
+        占用告警的冷却期
+        :param alert_key: 告警键（设备ID_规则名）
+        :param current_time: 当前时间戳（秒）
+        :return: 不在冷却期内并已记录本次告警时返回True
+        :raises sqlite3.Error: 数据库访问失败
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO alert_cooldown (alert_key, time) VALUES (?, ?) "
+                "ON CONFLICT (alert_key) DO UPDATE SET time = excluded.time "
+                "WHERE excluded.time - alert_cooldown.time >= ?",
+                (alert_key, current_time, self.cooldown)
+            )
+            return cursor.rowcount == 1
+
+# 多进程接入时使用的共享冷却记录，为None时使用进程内的alert_history
+shared_cooldown = None
+
+def use_shared_cooldown(path):
+    """
+    让本进程的告警冷却检查使用共享的冷却记录（多进程接入的每个工作进程启动时调用）
+    :param path: SQLite数据库文件路径
+    :return: SharedAlertCooldown，打开失败时返回None并继续使用进程内的记录
+    """
+    global shared_cooldown
+    try:
+        shared_cooldown = SharedAlertCooldown(path, ALERT_COOLDOWN)
+        logger.info(f"告警冷却记录使用共享数据库: {path}")
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"打开共享告警冷却记录失败，使用进程内记录: {str(e)}")
+        shared_cooldown = None
+    return shared_cooldown
+
+def claim_alert(alert_key, current_time):
+    """
+    检查告警是否在冷却期内，不在冷却期时记录本次告警
+    :param alert_key: 告警键（设备ID_规则名）
+    :param current_time: 当前时间戳（秒）
+    :return: 可以发送告警时返回True
+    """
+    if shared_cooldown is not None:
+        try:
+            return shared_cooldown.claim(alert_key, current_time)
+        except sqlite3.Error as e:
+            logger.error(f"访问共享告警冷却记录出错，使用进程内记录: {str(e)}")
+
+    last_alert_time = alert_history.get(alert_key)
+    if last_alert_time is not None and current_time - last_alert_time < ALERT_COOLDOWN:
+        return False
+    alert_history[alert_key] = current_time
+    return True
+
 def check_and_send_alert(device_id, data):
     """
     检查设备数据并在需要时发送告警
@@ -28,73 +112,147 @@ def check_and_send_alert(device_id, data):
     :param data: 设备数据
     :return: 是否发送了告警
     """
+    sent = False
     try:
-        # 获取设备特定的告警规则
-        device_rules = get_device_alert_rules(device_id)
-        if not device_rules:
-            return False
-            
-        # 检查每条规则
-        for rule in device_rules:
-            rule_name = rule.get("name", "未命名规则")
-            field = rule.get("field")
-            condition = rule.get("condition")
-            threshold = rule.get("threshold")
-            severity = rule.get("severity", "warning")
-            
-            # 检查数据中是否包含要监控的字段
-            if field not in data:
-                continue
-                
-            value = data[field]
-            alert_triggered = False
-            
-            # 检查条件
-            if condition == "greater_than" and float(value) > float(threshold):
-                alert_triggered = True
-                message = f"设备 {device_id} 的 {field} 值 ({value}) 超过阈值 {threshold}"
-            elif condition == "less_than" and float(value) < float(threshold):
-                alert_triggered = True
-                message = f"设备 {device_id} 的 {field} 值 ({value}) 低于阈值 {threshold}"
-            elif condition == "equals" and str(value) == str(threshold):
-                alert_triggered = True
-                message = f"设备 {device_id} 的 {field} 值等于 {threshold}"
-            elif condition == "not_equals" and str(value) != str(threshold):
-                alert_triggered = True
-                message = f"设备 {device_id} 的 {field} 值 ({value}) 不等于期望值 {threshold}"
-            
-            # 如果触发告警，发送通知
-            if alert_triggered:
-                # 检查是否在冷却期内
-                alert_key = f"{device_id}_{rule_name}"
-                current_time = time.time()
+        # 一次评估设备的所有规则，触发的规则各自按冷却时间发送通知
+        for rule, message in get_rule_engine().evaluate(device_id, data):
+            if trigger_alert(device_id, rule, message, data):
+                sent = True
                 
-                if alert_key in alert_history:
-                    last_alert_time = alert_history[alert_key]
-                    if current_time - last_alert_time < ALERT_COOLDOWN:
-                        logger.debug(f"告警 {alert_key} 在冷却期内，跳过")
-                        continue
-                
-                # 发送告警
-                send_alert(device_id, rule_name, message, severity, data)
-                
-                # 记录告警历史
-                alert_history[alert_key] = current_time
-                
-                # 记录事件到InfluxDB
-                write_event_to_influxdb(
-                    "alert", 
-                    device_id, 
-                    message,
-                    severity
-                )
+    except Exception as e:
+        logger.error(f"检查告警时出错: {str(e)}")
+        
+    return sent
+
+def evaluate_alerts(device_id, data):
+    """
+    评估设备数据，不发送通知
+    :param device_id: 设备ID
+    :param data: 设备数据
+    :return: 触发的规则和告警消息 [(rule, message), ...]
+    """
+    return get_rule_engine().evaluate(device_id, data)
+
+def evaluate_alerts_batch(records):
+    """
+    评估一批设备数据，不发送通知
+    :param records: [(device_id, data), ...]
+    :return: 触发的规则 [(批内序号, device_id, rule, message), ...]，按批内顺序排列
+    """
+    return get_rule_engine().evaluate_batch(records)
+
+def reload_alert_rules():
+    """
+    修改ALERT_CONFIG中的规则后重新编译
+    """
+    get_rule_engine().reload()
+
+def check_and_send_alerts_batch(records):
+    """
+    对一批设备数据做规则评估，批次较大时按字段做数组比较
+    :param records: [(device_id, data), ...]，同一设备的数据按时间顺序排列
+    :return: 发送的告警数量
+    """
+    try:
+        fired = evaluate_alerts_batch(records)
+    except Exception as e:
+        logger.error(f"批量检查告警时出错: {str(e)}")
+        return 0
+    
+    sent_count = 0
+    for index, device_id, rule, message in fired:
+        try:
+            if trigger_alert(device_id, rule, message, records[index][1]):
+                sent_count += 1
                 
-                return True
+        except Exception as e:
+            logger.error(f"发送设备 {device_id} 告警时出错: {str(e)}")
+            
+    return sent_count
+
+def trigger_alert(device_id, rule, message, data):
+    """
+    检查冷却期并发送告警
+    :param device_id: 设备ID
+    :param rule: 触发的告警规则
+    :param message: 告警消息
+    :param data: 设备数据
+    :return: 是否发送了告警（冷却期内返回False）
+    """
+    rule_name = rule.get("name", "未命名规则")
+    severity = rule.get("severity", "warning")
+    
+    # 检查是否在冷却期内，不在冷却期时先记录告警历史，其他进程不会重复发送
+    alert_key = f"{device_id}_{rule_name}"
+    current_time = time.time()
+    
+    if not claim_alert(alert_key, current_time):
+        logger.debug(f"告警 {alert_key} 在冷却期内，跳过")
+        return False
+    
+    # 发送告警
+    send_alert(device_id, rule_name, message, severity, data)
+    
+    # 记录事件到InfluxDB
+    write_event_to_influxdb(
+        "alert", 
+        device_id, 
+        message,
+        severity
+    )
+    
+    return True
+
+async def check_and_send_alert_async(device_id, data):
+    """
+    check_and_send_alert的异步版本，通知发送和事件写入以协程执行
+    :param device_id: 设备ID
+    :param data: 设备数据
+    :return: 是否发送了告警
+    """
+    sent = False
+    try:
+        for rule, message in get_rule_engine().evaluate(device_id, data):
+            if await trigger_alert_async(device_id, rule, message, data):
+                sent = True
                 
     except Exception as e:
         logger.error(f"检查告警时出错: {str(e)}")
         
-    return False
+    return sent
+
+async def trigger_alert_async(device_id, rule, message, data):
+    """
+    trigger_alert的异步版本
+    :param device_id: 设备ID
+    :param rule: 触发的告警规则
+    :param message: 告警消息
+    :param data: 设备数据
+    :return: 是否发送了告警（冷却期内返回False）
+    """
+    rule_name = rule.get("name", "未命名规则")
+    severity = rule.get("severity", "warning")
+    
+    # 检查是否在冷却期内，先记录告警历史，避免并发协程在发送期间重复告警
+    alert_key = f"{device_id}_{rule_name}"
+    current_time = time.time()
+    
+    if not claim_alert(alert_key, current_time):
+        logger.debug(f"告警 {alert_key} 在冷却期内，跳过")
+        return False
+    
+    # 发送告警
+    await send_alert_async(device_id, rule_name, message, severity, data)
+    
+    # 记录事件到InfluxDB
+    await write_event_to_influxdb_async(
+        "alert", 
+        device_id, 
+        message,
+        severity
+    )
+    
+    return True
 
 def get_device_alert_rules(device_id):
     """
@@ -107,13 +265,7 @@ def get_device_alert_rules(device_id):
         return ALERT_CONFIG["device_rules"][device_id]
     
     # 然后检查设备类型规则
-    device_type = None
-    if device_id.startswith("temp_"):
-        device_type = "temperature_sensor"
-    elif device_id.startswith("hum_"):
-        device_type = "humidity_sensor"
-    elif device_id.startswith("env_"):
-        device_type = "environmental_sensor"
+    device_type = device_type_of(device_id)
     
     if device_type and device_type in ALERT_CONFIG["type_rules"]:
         return ALERT_CONFIG["type_rules"][device_type]
@@ -131,16 +283,7 @@ def send_alert(device_id, rule_name, message, severity, data):
     :param data: 设备数据
     """
     # 构建告警信息
-    alert_info = {
-        "device_id": device_id,
-        "rule": rule_name,
-        "message": message,
-        "severity": severity,
-        "timestamp": time.time(),
-        "data": data
-    }
-    
-    alert_text = json.dumps(alert_info, indent=2, ensure_ascii=False)
+    alert_info = build_alert_info(device_id, rule_name, message, severity, data)
     logger.warning(f"触发告警: {message}")
     
     # 发送邮件告警
@@ -155,6 +298,45 @@ def send_alert(device_id, rule_name, message, severity, data):
     if ALERT_CONFIG.get("log_file", {}).get("enabled", False):
         log_alert_to_file(alert_info)
 
+async def send_alert_async(device_id, rule_name, message, severity, data):
+    """
+    send_alert的异步版本，各通知渠道并发发送
+    :param device_id: 设备ID
+    :param rule_name: 规则名称
+    :param message: 告警消息
+    :param severity: 严重性
+    :param data: 设备数据
+    """
+    alert_info = build_alert_info(device_id, rule_name, message, severity, data)
+    logger.warning(f"触发告警: {message}")
+    
+    tasks = []
+    
+    # smtplib没有异步接口，放到默认线程池中发送
+    if ALERT_CONFIG.get("email", {}).get("enabled", False):
+        tasks.append(asyncio.to_thread(send_email_alert, alert_info))
+    
+    if ALERT_CONFIG.get("telegram", {}).get("enabled", False):
+        tasks.append(send_telegram_alert_async(alert_info))
+    
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    # 记录到日志文件（本地追加写入，直接执行）
+    if ALERT_CONFIG.get("log_file", {}).get("enabled", False):
+        log_alert_to_file(alert_info)
+
+def build_alert_info(device_id, rule_name, message, severity, data):
+    """构建告警信息字典"""
+    return {
+        "device_id": device_id,
+        "rule": rule_name,
+        "message": message,
+        "severity": severity,
+        "timestamp": time.time(),
+        "data": data
+    }
+
 def send_email_alert(alert_info):
     """发送邮件告警"""
     try:
@@ -213,21 +395,7 @@ def send_telegram_alert(alert_info):
             
         bot_token = telegram_config["bot_token"]
         chat_ids = telegram_config["chat_ids"]
-        
-        # 消息格式化
-        message = f"""
-🚨 *设备告警通知*
-*设备ID:* {alert_info['device_id']}
-*规则:* {alert_info['rule']}
-*消息:* {alert_info['message']}
-*严重性:* {alert_info['severity']}
-*时间:* {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(alert_info['timestamp']))}
-
-*设备数据:*
-```
-{json.dumps(alert_info['data'], indent=2, ensure_ascii=False)}
-```
-        """
+        message = format_telegram_message(alert_info)
         
         # 发送到每个聊天ID
         for chat_id in chat_ids:
@@ -248,6 +416,56 @@ def send_telegram_alert(alert_info):
         logger.error(f"发送Telegram告警时出错: {str(e)}")
         return False
 
+async def send_telegram_alert_async(alert_info):
+    """异步发送Telegram告警，多个聊天ID并发发送"""
+    try:
+        import aiohttp
+        
+        telegram_config = ALERT_CONFIG.get("telegram", {})
+        if not telegram_config.get("enabled", False):
+            return False
+            
+        bot_token = telegram_config["bot_token"]
+        chat_ids = telegram_config["chat_ids"]
+        message = format_telegram_message(alert_info)
+        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        
+        async def send_one(session, chat_id):
+            payload = {
+                "chat_id": chat_id,
+                "text": message,
+                "parse_mode": "Markdown"
+            }
+            async with session.post(url, json=payload) as response:
+                response.raise_for_status()
+        
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await asyncio.gather(*(send_one(session, chat_id) for chat_id in chat_ids))
+            
+        logger.info(f"已发送Telegram告警至 {len(chat_ids)} 个接收者")
+        return True
+        
+    except Exception as e:
+        logger.error(f"发送Telegram告警时出错: {str(e)}")
+        return False
+
+def format_telegram_message(alert_info):
+    """格式化Telegram告警消息"""
+    return f"""
+🚨 *设备告警通知*
+*设备ID:* {alert_info['device_id']}
+*规则:* {alert_info['rule']}
+*消息:* {alert_info['message']}
+*严重性:* {alert_info['severity']}
+*时间:* {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(alert_info['timestamp']))}
+
+*设备数据:*
+```
+{json.dumps(alert_info['data'], indent=2, ensure_ascii=False)}
+```
+        """
+
 def log_alert_to_file(alert_info):
     """记录告警到文件"""
     try:
@@ -0,0 +1,333 @@
+"""
+告警规则引擎
+
+把 ALERT_CONFIG 中的默认规则、设备类型规则和设备规则编译为按字段索引的评估器：
+阈值在编译时转换为数值，每个设备解析一次规则来源并缓存评估器，
+评估一条数据时只查看数据中存在且有规则的字段，一次返回所有触发的规则。
+一批数据按规则组分组后，每个字段的值装入NumPy数组，每条规则做一次数组比较。
+"""
+import logging
+import math
+import threading
+import numpy as np
+from config import ALERT_CONFIG, LOG_CONFIG
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("alert_rules")
+
+# 设备ID前缀对应的设备类型
+DEVICE_TYPE_PREFIXES = (
+    ("temp_", "temperature_sensor"),
+    ("hum_", "humidity_sensor"),
+    ("env_", "environmental_sensor")
+)
+
+# 数值比较条件和字符串比较条件
+NUMERIC_CONDITIONS = ("greater_than", "less_than")
+TEXT_CONDITIONS = ("equals", "not_equals")
+
+# 数据中没有该字段
+_MISSING = object()
+
+def device_type_of(device_id):
+    """
+    根据设备ID前缀判断设备类型
+    :param device_id: 设备ID
+    :return: 设备类型，无法判断时返回None
+    """
+    for prefix, device_type in DEVICE_TYPE_PREFIXES:
+        if device_id.startswith(prefix):
+            return device_type
+    return None
+
+class CompiledRule:
+    """编译后的告警规则，阈值已转换为比较时使用的类型"""
+
+    __slots__ = ("rule", "name", "field", "condition", "threshold", "threshold_text")
+
+    def __init__(self, rule):
+        """
+        :param rule: 配置中的规则字典
+        :raises ValueError: 条件未知或数值阈值无效
+        """
+        self.rule = rule
+        self.name = rule.get("name", "未命名规则")
+        self.field = rule.get("field")
+        self.condition = rule.get("condition")
+        threshold = rule.get("threshold")
+        self.threshold_text = str(threshold)
+        if self.condition in NUMERIC_CONDITIONS:
+            self.threshold = float(threshold)
+        elif self.condition in TEXT_CONDITIONS:
+            self.threshold = self.threshold_text
+        else:
+            raise ValueError(f"未知的告警条件: {self.condition}")
+
+    def evaluate(self, device_id, value, number):
+        """
+        评估规则
+        :param device_id: 设备ID
+        :param value: 字段原始值
+        :param number: 字段的数值，无法转换为数值时为None
+        :return: 触发时返回告警消息，否则返回None
+        """
+        condition = self.condition
+        if condition == "greater_than":
+            if number is not None and number > self.threshold:
+                return f"设备 {device_id} 的 {self.field} 值 ({value}) 超过阈值 {self.threshold_text}"
+        elif condition == "less_than":
+            if number is not None and number < self.threshold:
+                return f"设备 {device_id} 的 {self.field} 值 ({value}) 低于阈值 {self.threshold_text}"
+        elif condition == "equals":
+            if str(value) == self.threshold:
+                return f"设备 {device_id} 的 {self.field} 值等于 {self.threshold_text}"
+        elif str(value) != self.threshold:
+            return f"设备 {device_id} 的 {self.field} 值 ({value}) 不等于期望值 {self.threshold_text}"
+        return None
+
+    def mask(self, numbers, texts, present):
+        """
+        对一批值做数组比较
+        :param numbers: 字段的浮点数数组，缺失或无法转换为数值时为NaN
+        :param texts: 字段值的字符串数组，缺失时为None
+        :param present: 数据中是否有该字段
+        :return: 触发规则的布尔数组
+        """
+        condition = self.condition
+        if condition == "greater_than":
+            return numbers > self.threshold
+        if condition == "less_than":
+            return numbers < self.threshold
+        if condition == "equals":
+            return texts == self.threshold
+        return (texts != self.threshold) & present
+
+def _to_number(value):
+    """把字段值转换为浮点数，无法转换时返回None"""
+    if type(value) is float:
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_float(value):
+    """把字段值转换为浮点数，缺失或无法转换时返回NaN"""
+    number = _to_number(value)
+    return math.nan if number is None else number
+
+def _to_float_array(values):
+    """
+    把一列字段值转换为浮点数数组，缺失（None）或无法转换为数值的值为NaN
+    :param values: 字段值列表
+    :return: 一维浮点数数组
+    """
+    try:
+        numbers = np.array(values, dtype=float)
+        if numbers.ndim == 1:
+            return numbers
+    except (TypeError, ValueError):
+        pass
+    # 有无法转换的值时逐个转换
+    return np.fromiter((_to_float(value) for value in values), dtype=float, count=len(values))
+
+class RuleSetEvaluator:
+    """一组规则的评估器，规则按字段索引"""
+
+    def __init__(self, rules, source):
+        """
+        :param rules: 配置中的规则列表
+        :param source: 规则来源，用于日志，例如 device:env_001、type:temperature_sensor、default
+        """
+        self.source = source
+        self.rules = list(rules or [])
+        self.by_field = {}
+        # 规则在配置中的顺序
+        self.order = {id(rule): index for index, rule in enumerate(self.rules)}
+        for rule in self.rules:
+            try:
+                compiled = CompiledRule(rule)
+            except (TypeError, ValueError) as e:
+                logger.error(f"告警规则 {rule.get('name', '未命名规则')}（{source}）无效，已跳过: {str(e)}")
+                continue
+            self.by_field.setdefault(compiled.field, []).append(compiled)
+        # 字段 -> (规则列表, 是否需要数值)
+        self._fields = {
+            field: (rules, any(rule.condition in NUMERIC_CONDITIONS for rule in rules))
+            for field, rules in self.by_field.items()
+        }
+        # 按字段顺序遍历时告警是否已经是配置中的顺序
+        positions = [self.order[id(rule.rule)] for rules in self.by_field.values() for rule in rules]
+        self._in_order = positions == sorted(positions)
+
+    def evaluate(self, device_id, data):
+        """
+        评估数据，返回所有触发的规则
+        :param device_id: 设备ID
+        :param data: 设备数据
+        :return: [(规则字典, 告警消息), ...]，按规则在配置中的顺序
+        """
+        fields = self._fields
+        fired = []
+        # 遍历数据字段和规则字段中较少的一方
+        if len(data) < len(fields):
+            keys = data
+            in_order = False
+        else:
+            keys = fields
+            in_order = self._in_order
+        for field in keys:
+            entry = fields.get(field)
+            if entry is None:
+                continue
+            value = data.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            rules, needs_number = entry
+            number = _to_number(value) if needs_number else None
+            for rule in rules:
+                message = rule.evaluate(device_id, value, number)
+                if message is not None:
+                    fired.append((rule.rule, message))
+        if not in_order and len(fired) > 1:
+            order = self.order
+            fired.sort(key=lambda item: order[id(item[0])])
+        return fired
+
+    def evaluate_batch(self, device_ids, readings):
+        """
+        用数组比较评估一批数据
+        :param device_ids: 设备ID列表
+        :param readings: 与device_ids对应的设备数据列表
+        :return: [(批内序号, 规则字典, 告警消息), ...]，按批内序号和规则在配置中的顺序
+        """
+        count = len(readings)
+        fired = []
+        for field, (rules, needs_number) in self._fields.items():
+            values = [data.get(field) for data in readings]
+            numbers = texts = present = None
+            if needs_number:
+                numbers = _to_float_array(values)
+            if not all(rule.condition in NUMERIC_CONDITIONS for rule in rules):
+                present = np.fromiter((field in data for data in readings), dtype=bool, count=count)
+                if not present.any():
+                    continue
+                texts = np.array([str(value) for value in values], dtype=object)
+                texts[~present] = None
+
+            for rule in rules:
+                # 只为触发的数据生成告警消息
+                for index in np.flatnonzero(rule.mask(numbers, texts, present)).tolist():
+                    number = float(numbers[index]) if numbers is not None else None
+                    message = rule.evaluate(device_ids[index], values[index], number)
+                    if message is not None:
+                        fired.append((index, rule.rule, message))
+        order = self.order
+        fired.sort(key=lambda item: (item[0], order[id(item[1])]))
+        return fired
+
+class AlertRuleEngine:
+    """按设备缓存规则评估器"""
+
+    def __init__(self, alert_config, cache_size=100000):
+        """
+        :param alert_config: 包含default_rules、type_rules、device_rules的告警配置
+        :param cache_size: 缓存的设备数上限
+        """
+        self.alert_config = alert_config
+        self.cache_size = cache_size
+        # 数据条数达到该值时使用数组比较，较小的批次逐条评估
+        self.vectorize_min_batch = alert_config.get("vectorize_min_batch", 64)
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """重新编译规则，修改ALERT_CONFIG中的规则后调用"""
+        config = self.alert_config
+        with self._lock:
+            self._default = RuleSetEvaluator(config.get("default_rules", []), "default")
+            self._types = {
+                device_type: RuleSetEvaluator(rules, f"type:{device_type}")
+                for device_type, rules in config.get("type_rules", {}).items()
+            }
+            self._devices = {
+                device_id: RuleSetEvaluator(rules, f"device:{device_id}")
+                for device_id, rules in config.get("device_rules", {}).items()
+            }
+            # 设备ID -> 评估器
+            self._cache = {}
+
+    def evaluator(self, device_id):
+        """
+        获取设备的规则评估器：设备规则优先，其次设备类型规则，最后默认规则
+        :param device_id: 设备ID
+        :return: RuleSetEvaluator
+        """
+        evaluator = self._cache.get(device_id)
+        if evaluator is None:
+            evaluator = self._devices.get(device_id)
+            if evaluator is None:
+                evaluator = self._types.get(device_type_of(device_id), self._default)
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[device_id] = evaluator
+        return evaluator
+
+    def evaluate(self, device_id, data):
+        """
+        评估设备数据
+        :param device_id: 设备ID
+        :param data: 设备数据
+        :return: [(规则字典, 告警消息), ...]
+        """
+        return self.evaluator(device_id).evaluate(device_id, data)
+
+    def evaluate_batch(self, records):
+        """
+        评估一批设备数据，同一规则组的数据一起做数组比较
+        :param records: [(device_id, data), ...]
+        :return: [(批内序号, device_id, 规则字典, 告警消息), ...]，按批内序号和规则在配置中的顺序，
+                 同一设备的告警顺序与逐条评估相同，可以直接按冷却时间过滤
+        """
+        if len(records) < self.vectorize_min_batch:
+            return [
+                (index, device_id, rule, message)
+                for index, (device_id, data) in enumerate(records)
+                for rule, message in self.evaluate(device_id, data)
+            ]
+
+        # 按评估器分组，默认规则和设备类型规则由多个设备共用
+        groups = {}
+        for index, (device_id, _) in enumerate(records):
+            evaluator = self.evaluator(device_id)
+            group = groups.get(id(evaluator))
+            if group is None:
+                group = groups[id(evaluator)] = (evaluator, [])
+            group[1].append(index)
+
+        fired = []
+        for evaluator, indexes in groups.values():
+            if not evaluator.by_field:
+                continue
+            device_ids = [records[index][0] for index in indexes]
+            readings = [records[index][1] for index in indexes]
+            for position, rule, message in evaluator.evaluate_batch(device_ids, readings):
+                fired.append((indexes[position], device_ids[position], rule, message))
+        if len(groups) > 1:
+            fired.sort(key=lambda item: item[0])
+        return fired
+
+# 单例实例
+_engine = None
+
+def get_rule_engine():
+    """获取使用ALERT_CONFIG的告警规则引擎"""
+    global _engine
+    if _engine is None:
+        _engine = AlertRuleEngine(ALERT_CONFIG)
+    return _engine
@@ -0,0 +1,138 @@
+"""
+设备数据分析
+
+对 influx_writer.query_frame 返回的列式数据做向量化统计：全体设备的字段汇总、
+按标签（如location）和时间窗口分组的分位数、字段之间的相关系数。
+所有计算都在pandas/NumPy中按列完成，不逐条遍历记录。
+"""
+import math
+import pandas as pd
+
+# 列式数据中的时间列和标签列，不参与数值统计
+TIME_COLUMN = "_time"
+TAG_COLUMNS = ("device_id", "device_type", "location")
+
+def _clean(value):
+    """把NumPy数值转换为可JSON序列化的值，NaN转换为None"""
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) or math.isinf(value) else value
+
+def parse_percentiles(text, default=(50, 90, 99)):
+    """
+    解析分位数参数
+    :param text: 逗号分隔的百分位，例如 "50,90,99"
+    :param default: text为空时使用的值
+    :return: 百分位元组
+    :raises ValueError: 百分位不在0到100之间
+    """
+    if not text:
+        return tuple(default)
+    percentiles = tuple(float(item) for item in str(text).split(",") if item.strip())
+    for percentile in percentiles:
+        if not 0 <= percentile <= 100:
+            raise ValueError(f"百分位必须在0到100之间: {percentile}")
+    return percentiles
+
+def numeric_columns(frame, fields=None):
+    """
+    获取参与统计的数值列
+    :param frame: 列式数据
+    :param fields: 指定的字段，为空时使用全部数值列
+    :return: 列名列表
+    """
+    if fields:
+        return [field for field in fields if field in frame.columns and pd.api.types.is_numeric_dtype(frame[field])]
+    return [
+        column for column in frame.columns
+        if column != TIME_COLUMN and column not in TAG_COLUMNS and pd.api.types.is_numeric_dtype(frame[column])
+    ]
+
+def fleet_summary(frame, fields=None, percentiles=(50, 95)):
+    """
+    全体设备的字段汇总
+    :param frame: 列式数据
+    :param fields: 要统计的字段，为空时统计全部数值字段
+    :param percentiles: 额外计算的百分位
+    :return: {"devices", "rows", "fields": {字段名: {"mean", "std", "min", "max", "count", "p50", ...}}}
+    """
+    columns = numeric_columns(frame, fields)
+    summary = {
+        "devices": int(frame["device_id"].nunique()) if "device_id" in frame.columns else 0,
+        "rows": int(len(frame)),
+        "fields": {}
+    }
+    if not columns or frame.empty:
+        return summary
+
+    values = frame[columns]
+    stats = values.agg(["mean", "std", "min", "max", "count"])
+    quantiles = values.quantile([p / 100 for p in percentiles])
+    for column in columns:
+        field_stats = {name: _clean(stats.at[name, column]) for name in ("mean", "std", "min", "max")}
+        field_stats["count"] = int(stats.at["count", column])
+        for percentile, quantile in zip(percentiles, quantiles.index):
+            field_stats[f"p{percentile:g}"] = _clean(quantiles.at[quantile, column])
+        summary["fields"][column] = field_stats
+    return summary
+
+def group_percentiles(frame, field, by="location", every_seconds=3600, percentiles=(50, 90, 99)):
+    """
+    按标签和时间窗口分组计算字段的分位数
+    :param frame: 列式数据
+    :param field: 字段名
+    :param by: 分组的标签列，例如 location、device_type
+    :param every_seconds: 时间窗口（秒）
+    :param percentiles: 百分位
+    :return: [{"group", "time"(毫秒), "count", "p50", ...}]，按分组和时间排序
+    :raises ValueError: 字段或分组列不存在
+    """
+    if frame.empty:
+        return []
+    if field not in frame.columns:
+        raise ValueError(f"数据中没有字段: {field}")
+    if by not in frame.columns:
+        raise ValueError(f"数据中没有分组列: {by}")
+
+    windows = frame[TIME_COLUMN].dt.floor(f"{int(every_seconds)}s")
+    groups = frame[by].fillna("unknown")
+    grouped = frame[field].groupby([groups, windows])
+    quantiles = grouped.quantile([p / 100 for p in percentiles]).unstack()
+    counts = grouped.count().reindex(quantiles.index).to_numpy()
+    values = quantiles.to_numpy()
+    names = [f"p{percentile:g}" for percentile in percentiles]
+
+    # 毫秒时间戳按列一次计算
+    group_labels = quantiles.index.get_level_values(0)
+    window_starts = quantiles.index.get_level_values(1)
+    times = ((window_starts - pd.Timestamp(0, tz=window_starts.tz)) // pd.Timedelta(milliseconds=1)).to_numpy()
+    result = []
+    for position in range(len(quantiles)):
+        row = {"group": group_labels[position], "time": int(times[position]), "count": int(counts[position])}
+        for index, name in enumerate(names):
+            row[name] = _clean(values[position, index])
+        result.append(row)
+    return result
+
+def correlation(frame, fields=None, method="pearson"):
+    """
+    字段之间的相关系数
+    :param frame: 列式数据
+    :param fields: 字段列表，为空时使用全部数值字段
+    :param method: pearson、spearman或kendall
+    :return: {"fields": [...], "matrix": [[...]], "rows"}
+    :raises ValueError: 方法无效
+    """
+    if method not in ("pearson", "spearman", "kendall"):
+        raise ValueError(f"不支持的相关系数方法: {method}")
+    columns = numeric_columns(frame, fields)
+    if len(columns) < 2 or frame.empty:
+        return {"fields": columns, "matrix": [], "rows": int(len(frame))}
+
+    matrix = frame[columns].corr(method=method).to_numpy()
+    return {
+        "fields": columns,
+        "matrix": [[_clean(value) for value in row] for row in matrix],
+        "rows": int(len(frame))
+    }
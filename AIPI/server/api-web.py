@@ -9,10 +9,15 @@ from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 from werkzeug.security import check_password_hash
-from config import WEB_CONFIG, LOG_CONFIG, JWT_CONFIG
+from config import WEB_CONFIG, PIPELINE_CONFIG, LOG_CONFIG, JWT_CONFIG
 from mqtt_client import get_mqtt_client
 from device_controller import execute_device_action, get_device_status
-from influx_writer import query_latest_data
+from influx_writer import query_latest_data, query_history, query_frame, parse_flux_duration, get_write_metrics, get_spool_metrics, record_latest_data, get_last_value_store, get_field_schema, get_local_store, get_influx_status
+from ingest_supervisor import load_ingest_metrics
+from analytics import fleet_summary, group_percentiles, correlation, parse_percentiles
+from topic_router import TopicRouter
+from codec import decode_message, CodecError
+from telemetry_delta import DeltaReassembler
 
 # 配置日志
 logging.basicConfig(
@@ -306,24 +311,137 @@ def control_device(device_id):
 @requires_auth
 def get_device_history(device_id):
     """
-    获取设备历史数据
+    获取设备历史数据，按时间窗口聚合
+    查询参数: start/stop（相对时长如-1h、Unix时间戳或ISO 8601时间）、every（聚合窗口，默认自动选择）、
+    fn（mean/max/min/last）、fields（逗号分隔）、points（每个字段的点数上限）；
+    兼容旧参数range（等同于start=-range）
     :param device_id: 设备ID
     :return: 历史数据
     """
-    time_range = request.args.get('range', '1h')
+    start = request.args.get('start') or f"-{request.args.get('range', '1h').lstrip('-')}"
     fields = request.args.get('fields')
     
     if fields:
-        fields = fields.split(',')
+        fields = [field for field in fields.split(',') if field]
     
     try:
         # 查询历史数据
-        data = query_latest_data(device_id, fields, time_range)
-        return jsonify(data or {})
+        data = query_history(
+            device_id,
+            start=start,
+            stop=request.args.get('stop', 'now'),
+            every=request.args.get('every'),
+            fn=request.args.get('fn', 'mean'),
+            fields=fields,
+            max_points=request.args.get('points', type=int)
+        )
+        if data is None:
+            return jsonify({"error": "InfluxDB未连接"}), 503
+        return jsonify(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"获取设备 {device_id} 历史数据时出错: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def split_arg(name):
+    """把逗号分隔的查询参数拆分为列表，参数为空时返回None"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return [item for item in value.split(',') if item]
+
+def load_analytics_frame(fields=None):
+    """
+    按查询参数读取分析用的列式数据
+    查询参数: start/stop、fields、devices（逗号分隔的设备ID，为空时为全部设备）、
+    resolution（每个设备的聚合精度，默认自动选择）、points（每个设备的点数上限）
+    :param fields: 要读取的字段，为空时使用查询参数fields
+    :return: DataFrame
+    """
+    return query_frame(
+        start=request.args.get('start', '-1h'),
+        stop=request.args.get('stop', 'now'),
+        fields=fields or split_arg('fields'),
+        device_ids=split_arg('devices'),
+        every=request.args.get('resolution'),
+        max_points=request.args.get('points', type=int)
+    )
+
+def analytics_response(compute):
+    """
+    执行分析并统一处理错误
+    :param compute: 计算函数，返回可JSON序列化的结果
+    :return: Flask响应
+    """
+    try:
+        return jsonify(compute())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ConnectionError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logger.error(f"数据分析出错: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+# API路由：全体设备字段汇总
+@app.route('/api/analytics/fleet', methods=['GET'])
+@requires_auth
+def get_fleet_summary():
+    """
+    全体设备各字段的平均值、标准差、极值和分位数
+    额外查询参数: percentiles（逗号分隔，默认50,95）
+    :return: 汇总结果
+    """
+    def compute():
+        percentiles = parse_percentiles(request.args.get('percentiles'), (50, 95))
+        return fleet_summary(load_analytics_frame(), split_arg('fields'), percentiles)
+    return analytics_response(compute)
+
+# API路由：分组分位数
+@app.route('/api/analytics/percentiles', methods=['GET'])
+@requires_auth
+def get_group_percentiles():
+    """
+    按标签和时间窗口分组计算字段分位数，例如每个位置每小时的温度P50/P90/P99
+    额外查询参数: field（必需）、by（分组标签，默认location）、every（时间窗口，默认1h）、
+    percentiles（逗号分隔，默认50,90,99）
+    :return: 各分组各时间窗口的分位数
+    """
+    def compute():
+        field = request.args.get('field')
+        if not field:
+            raise ValueError("缺少参数: field")
+        by = request.args.get('by', 'location')
+        every = request.args.get('every', '1h')
+        every_seconds = parse_flux_duration(every)
+        if not every_seconds:
+            raise ValueError(f"无效的时间窗口: {every}")
+        percentiles = parse_percentiles(request.args.get('percentiles'))
+        frame = load_analytics_frame([field])
+        return {
+            "field": field,
+            "by": by,
+            "every": every,
+            "percentiles": list(percentiles),
+            "groups": group_percentiles(frame, field, by, every_seconds, percentiles)
+        }
+    return analytics_response(compute)
+
+# API路由：字段相关系数
+@app.route('/api/analytics/correlation', methods=['GET'])
+@requires_auth
+def get_field_correlation():
+    """
+    计算字段之间的相关系数矩阵
+    额外查询参数: method（pearson/spearman/kendall，默认pearson）
+    :return: 相关系数矩阵
+    """
+    def compute():
+        frame = load_analytics_frame()
+        return correlation(frame, split_arg('fields'), request.args.get('method', 'pearson'))
+    return analytics_response(compute)
+
 # API路由：设备数据监控
 @app.route('/api/monitor', methods=['GET'])
 @requires_auth
@@ -354,6 +472,32 @@ def api_status():
         }
     })
 
+# API路由：消息流水线指标
+@app.route('/api/metrics/pipeline', methods=['GET'])
+def get_pipeline_metrics():
+    """
+    返回消息接入流水线的队列深度和各阶段延迟
+    :return: 流水线指标
+    """
+    return jsonify({
+        "pipeline": mqtt_client.pipeline.get_metrics(),
+        # 多进程接入模式下由监督进程汇总的各接入进程指标
+        "ingest_workers": load_ingest_metrics(),
+        # 共享InfluxDB连接的超时配置和熔断器状态
+        "influxdb": get_influx_status(),
+        # InfluxDB批量写入的待写入数量、失败计数和刷新延迟
+        "influx_writer": get_write_metrics(),
+        # InfluxDB不可用时的磁盘缓冲大小和重放进度
+        "influx_spool": get_spool_metrics(),
+        # 最新值存储的设备数和命中率
+        "last_values": get_last_value_store().stats() if get_last_value_store() else None,
+        # 字段类型注册表登记的类型和丢弃计数
+        "field_schema": get_field_schema().stats() if get_field_schema() else None,
+        # 嵌入式存储的分区数和写入计数（STORAGE_BACKEND=sqlite时）
+        "sqlite_store": get_local_store().stats() if get_local_store() else None,
+        "timestamp": time.time()
+    })
+
 # 获取所有设备状态
 def get_all_device_status():
     """
@@ -384,36 +528,43 @@ def mqtt_message_handler():
     if not mqtt_client.connected:
         mqtt_client.connect()
     
-    # 订阅设备数据主题
-    device_data_topic = "device/+/data"
-    mqtt_client.client.message_callback_add(device_data_topic, on_device_data)
-    mqtt_client.client.subscribe(device_data_topic)
-    
-    # 订阅设备控制结果主题
-    control_result_topic = "device/control/result"
-    mqtt_client.client.message_callback_add(control_result_topic, on_control_result)
-    mqtt_client.client.subscribe(control_result_topic)
+    # 订阅设备数据和设备控制结果主题，收到的消息统一由路由器分发
+    for topic_filter in topic_router.filters():
+        mqtt_client.client.message_callback_add(topic_filter, on_routed_message)
+        mqtt_client.client.subscribe(topic_filter)
     
     logger.info("MQTT消息处理器已启动")
 
-# 设备数据消息回调
-def on_device_data(client, userdata, msg):
+# MQTT消息回调
+def on_routed_message(client, userdata, msg):
     """
-    处理设备数据消息
+    解析消息并交给主题路由器分发
     :param client: MQTT客户端
     :param userdata: 用户数据
     :param msg: 消息
     """
     try:
-        topic = msg.topic
-        payload = json.loads(msg.payload.decode('utf-8'))
-        
-        # 从主题中提取设备ID，格式：device/{device_id}/data
-        device_id = topic.split('/')[1]
+        payload = decode_message(msg.topic, msg.payload)
+    except CodecError as e:
+        logger.warning(f"MQTT消息解码失败，主题: {msg.topic}，{str(e)}")
+        return
+    topic_router.dispatch(msg.topic, payload)
+
+# 设备数据消息处理
+def on_device_data(payload, device_id):
+    """
+    处理设备数据消息
+    :param payload: 消息内容
+    :param device_id: 设备ID，由路由器从主题 device/{device_id}/data 中解析
+    """
+    try:
+        # 设备以增量帧发送时合并成完整快照
+        payload = delta_reassembler.apply(payload)
         
         # 更新设备数据缓存
         device_data_cache[device_id] = payload
         last_update_time[device_id] = time.time()
+        record_latest_data(device_id, payload)
         
         # 通过WebSocket推送实时数据
         socketio.emit('device_data_update', {
@@ -422,21 +573,16 @@ def on_device_data(client, userdata, msg):
             "timestamp": time.time()
         })
         
-    except json.JSONDecodeError:
-        logger.warning(f"无法解析MQTT消息为JSON: {msg.payload}")
     except Exception as e:
         logger.error(f"处理MQTT设备数据消息时出错: {str(e)}")
 
-# 控制结果消息回调
-def on_control_result(client, userdata, msg):
+# 控制结果消息处理
+def on_control_result(payload):
     """
     处理设备控制结果消息
-    :param client: MQTT客户端
-    :param userdata: 用户数据
-    :param msg: 消息
+    :param payload: 消息内容
     """
     try:
-        payload = json.loads(msg.payload.decode('utf-8'))
         device_id = payload.get("device_id")
         
         # 通过WebSocket推送控制结果
@@ -449,11 +595,17 @@ def on_control_result(client, userdata, msg):
             "timestamp": time.time()
         })
         
-    except json.JSONDecodeError:
-        logger.warning(f"无法解析MQTT控制结果消息为JSON: {msg.payload}")
     except Exception as e:
         logger.error(f"处理MQTT控制结果消息时出错: {str(e)}")
 
+# 增量帧合并，该进程订阅了设备数据主题，需要自己维护各设备的快照
+delta_reassembler = DeltaReassembler(mqtt_client.request_keyframe, PIPELINE_CONFIG["keyframe_request_interval"])
+
+# MQTT主题路由，设备ID在匹配时从主题中解析一次
+topic_router = TopicRouter()
+topic_router.add("device/{device_id}/data", on_device_data)
+topic_router.add("device/control/result", on_control_result)
+
 # 前端路由（处理SPA的路由）
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -0,0 +1,352 @@
+"""
+基于asyncio的MQTT客户端
+
+不使用paho的loop_start()后台线程，而是把paho的socket读写回调挂到asyncio事件循环上，
+消息处理全部以协程执行，成千上万个进行中的处理只占用协程而不是线程。
+提供异步的订阅、发布和请求-响应（按command_id关联）接口。
+"""
+import asyncio
+import logging
+import time
+import uuid
+import paho.mqtt.client as mqtt
+from config import MQTT_CONFIG, PIPELINE_CONFIG, INGEST_CONFIG, LOG_CONFIG
+from topic_router import TopicRouter
+from codec import decode_message, encode_json, CodecError
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("async_mqtt_client")
+
+class AsyncMQTTClient:
+    """由asyncio事件循环驱动的paho MQTT客户端"""
+
+    def __init__(self, client_id="", host=None, port=None, username=None,
+                 password=None, keep_alive=None, max_inflight=None):
+        """
+        :param client_id: MQTT客户端ID，为空时由代理服务器分配
+        :param host: 代理服务器地址，默认使用MQTT_CONFIG
+        :param port: 代理服务器端口，默认使用MQTT_CONFIG
+        :param username: 用户名，默认使用MQTT_CONFIG
+        :param password: 密码，默认使用MQTT_CONFIG
+        :param keep_alive: 心跳间隔（秒），默认使用MQTT_CONFIG
+        :param max_inflight: 同时处理的消息数上限，默认使用PIPELINE_CONFIG["async_max_inflight"]
+        """
+        self.host = host or MQTT_CONFIG["broker_host"]
+        self.port = port or MQTT_CONFIG["broker_port"]
+        self.keep_alive = keep_alive or MQTT_CONFIG["keep_alive"]
+        self.max_inflight = max_inflight or PIPELINE_CONFIG["async_max_inflight"]
+
+        self.client = mqtt.Client(client_id=client_id)
+        username = username if username is not None else MQTT_CONFIG["username"]
+        password = password if password is not None else MQTT_CONFIG["password"]
+        if username:
+            self.client.username_pw_set(username, password)
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_subscribe = self._on_subscribe
+        self.client.on_publish = self._on_publish
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+        self.loop = None
+        self.connected = False
+        self._connected_future = None
+        self._misc_task = None
+        self._inflight = None
+
+        # 订阅和发布确认，按消息ID关联
+        self._pending_subscribes = {}
+        self._pending_publishes = {}
+
+        # 请求-响应：关联ID -> Future
+        self._pending_requests = {}
+        self._response_topics = set()
+
+        # 消息处理器：主题过滤器 -> 协程函数
+        self.router = TopicRouter()
+
+    # ---- paho socket回调，全部在事件循环线程中执行 ----
+
+    def _on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self._misc_task:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        """处理心跳和重传，替代loop_start()线程中的定时逻辑"""
+        try:
+            while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            pass
+
+    # ---- paho协议回调 ----
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connected = True
+            logger.info(f"已连接到MQTT代理服务器 {self.host}:{self.port}")
+            # 重连后恢复已注册的订阅
+            for topic_filter in self.router.filters():
+                client.subscribe(topic_filter)
+            for topic in self._response_topics:
+                client.subscribe(topic)
+            if self._connected_future and not self._connected_future.done():
+                self._connected_future.set_result(True)
+        else:
+            logger.error(f"连接MQTT代理服务器失败，返回码: {rc}")
+            if self._connected_future and not self._connected_future.done():
+                self._connected_future.set_exception(ConnectionError(f"MQTT连接失败，返回码: {rc}"))
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        if rc != 0:
+            logger.warning(f"意外断开MQTT连接，返回码: {rc}")
+            self.loop.create_task(self._reconnect())
+        else:
+            logger.info("已断开MQTT连接")
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos):
+        future = self._pending_subscribes.pop(mid, None)
+        if future and not future.done():
+            future.set_result(granted_qos)
+
+    def _on_publish(self, client, userdata, mid):
+        future = self._pending_publishes.pop(mid, None)
+        if future and not future.done():
+            future.set_result(mid)
+
+    def _on_message(self, client, userdata, msg):
+        """解码消息并分发：先匹配等待中的请求，再交给注册的处理器协程"""
+        try:
+            data = decode_message(msg.topic, msg.payload)
+        except CodecError as e:
+            logger.warning(f"消息解码失败，主题: {msg.topic}，{str(e)}")
+            return
+
+        # 请求-响应
+        if isinstance(data, dict) and msg.topic in self._response_topics:
+            future = self._pending_requests.pop(data.get("command_id"), None)
+            if future and not future.done():
+                future.set_result(data)
+                return
+
+        for handler, _ in self.router.match(msg.topic):
+            self.loop.create_task(self._dispatch(handler, msg.topic, data))
+
+    async def _dispatch(self, handler, topic, data):
+        """在并发上限内执行处理器协程"""
+        async with self._inflight:
+            try:
+                await handler(topic, data)
+            except Exception as e:
+                logger.error(f"处理消息时出错，主题: {topic}，错误: {str(e)}")
+
+    async def _reconnect(self, delay=5):
+        """断线后定期重连"""
+        while not self.connected:
+            await asyncio.sleep(delay)
+            try:
+                self.client.reconnect()
+                return
+            except Exception as e:
+                logger.error(f"MQTT重连失败: {str(e)}")
+
+    # ---- 公共接口 ----
+
+    async def connect(self, timeout=10):
+        """
+        连接到MQTT代理服务器并等待CONNACK
+        :param timeout: 最长等待时间（秒）
+        :return: 是否连接成功
+        """
+        self.loop = asyncio.get_running_loop()
+        self._inflight = asyncio.Semaphore(self.max_inflight)
+        self._connected_future = self.loop.create_future()
+
+        self.client.connect(self.host, self.port, self.keep_alive)
+        await asyncio.wait_for(self._connected_future, timeout)
+        return self.connected
+
+    async def disconnect(self):
+        """断开MQTT连接，取消所有等待中的请求"""
+        for future in self._pending_requests.values():
+            if not future.done():
+                future.cancel()
+        self._pending_requests.clear()
+        self.client.disconnect()
+        self.connected = False
+
+    async def subscribe(self, topic, qos=0, handler=None, timeout=10):
+        """
+        订阅主题并等待SUBACK
+        :param topic: 主题过滤器，支持+和#通配符
+        :param qos: 服务质量等级
+        :param handler: 处理器协程函数，签名为 async handler(topic, data)
+        :param timeout: 最长等待时间（秒）
+        :return: 授予的QoS
+        """
+        if handler is not None:
+            self.router.add(topic, handler)
+
+        rc, mid = self.client.subscribe(topic, qos)
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            raise ConnectionError(f"订阅主题失败: {topic}，错误码: {rc}")
+
+        future = self.loop.create_future()
+        self._pending_subscribes[mid] = future
+        granted_qos = await asyncio.wait_for(future, timeout)
+        logger.info(f"已订阅主题: {topic}")
+        return granted_qos
+
+    async def publish(self, topic, message, qos=0, retain=False, timeout=10):
+        """
+        发布消息，QoS大于0时等待代理服务器确认
+        :param topic: 主题
+        :param message: 消息内容，字典会被序列化为JSON
+        :param qos: 服务质量等级
+        :param retain: 是否保留消息
+        :param timeout: 最长等待时间（秒）
+        :return: 是否发布成功
+        """
+        if isinstance(message, dict):
+            message = encode_json(message)
+
+        future = None
+        if qos > 0:
+            future = self.loop.create_future()
+
+        info = self.client.publish(topic, message, qos=qos, retain=retain)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.error(f"消息发布失败 - 错误码: {info.rc}")
+            return False
+
+        if future is not None:
+            if info.is_published():
+                return True
+            self._pending_publishes[info.mid] = future
+            await asyncio.wait_for(future, timeout)
+        return True
+
+    async def request(self, topic, message, response_topic, timeout=30):
+        """
+        发送请求并等待响应，响应按command_id与请求关联
+        :param topic: 请求主题，例如 device/{device_id}/command
+        :param message: 请求内容字典，未包含command_id时自动生成
+        :param response_topic: 响应主题，例如 device/{device_id}/result
+        :param timeout: 最长等待时间（秒）
+        :return: 响应数据字典
+        """
+        if response_topic not in self._response_topics:
+            self._response_topics.add(response_topic)
+            await self.subscribe(response_topic)
+
+        message = dict(message)
+        command_id = message.setdefault("command_id", str(uuid.uuid4()))
+        future = self.loop.create_future()
+        self._pending_requests[command_id] = future
+
+        try:
+            await self.publish(topic, message)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending_requests.pop(command_id, None)
+
+    async def execute_command(self, device_id, command, timeout=30):
+        """
+        在设备上执行命令并等待结果
+        :param device_id: 设备ID
+        :param command: 命令字符串
+        :param timeout: 最长等待时间（秒）
+        :return: 命令结果字典，超时返回失败结果
+        """
+        try:
+            return await self.request(
+                MQTT_CONFIG["publish_topics"]["device_command"].format(device_id=device_id),
+                {"command": command, "timeout": timeout},
+                f"device/{device_id}/result",
+                timeout=timeout + 2
+            )
+        except asyncio.TimeoutError:
+            return {
+                "success": False,
+                "error": f"等待命令结果超时（等待了{timeout + 2}秒）",
+                "device_id": device_id,
+                "command": command,
+                "timestamp": time.time()
+            }
+
+async def run_async_ingest():
+    """
+    以asyncio模式运行服务端数据接入：订阅配置的主题，
+    每条消息以协程执行异步版本的InfluxDB写入、告警检查和LLM分析。
+    同一设备的消息通过设备锁按到达顺序处理。
+    """
+    from langchain_processor import process_device_data_async
+    from telemetry_delta import DeltaReassembler
+
+    client = AsyncMQTTClient()
+    device_locks = {}
+
+    def request_keyframe(device_id):
+        client.loop.create_task(client.publish(
+            MQTT_CONFIG["publish_topics"]["keyframe_request"].format(device_id=device_id),
+            {"device_id": device_id, "timestamp": time.time()}
+        ))
+
+    reassembler = DeltaReassembler(request_keyframe, PIPELINE_CONFIG["keyframe_request_interval"])
+
+    async def handle_message(topic, data):
+        # 协程按创建顺序开始执行，第一个await之前的合并步骤保持消息到达顺序
+        data = reassembler.apply(data)
+        device_id = data.get("device_id", topic) if isinstance(data, dict) else topic
+        lock = device_locks.get(device_id)
+        if lock is None:
+            lock = device_locks[device_id] = asyncio.Lock()
+        # asyncio.Lock按等待顺序唤醒，保证同一设备的消息有序
+        async with lock:
+            await process_device_data_async(topic, data)
+
+    # 与MQTTClient使用同一设置：配置了多进程接入时其他进程也会回复确认，都不启用增量帧
+    features = ["delta"] if INGEST_CONFIG["workers"] == 0 else []
+
+    async def handle_schema(topic, schema):
+        # 字段字典已在解码时记录，回复确认
+        await client.publish(
+            MQTT_CONFIG["publish_topics"]["schema_ack"].format(device_id=schema["device_id"]),
+            {"schema_id": schema["schema_id"], "encoding": schema.get("encoding", "struct"), "features": features}
+        )
+
+    await client.connect()
+    for topic in MQTT_CONFIG["subscribe_topics"]:
+        if topic == "device/+/schema":
+            await client.subscribe(topic, handler=handle_schema)
+        else:
+            await client.subscribe(topic, handler=handle_message)
+
+    logger.info("asyncio MQTT接入服务已启动")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await client.disconnect()
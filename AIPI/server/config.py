@@ -37,19 +37,80 @@ MQTT_CONFIG = {
     "keep_alive": int(os.getenv("MQTT_KEEP_ALIVE", "60")),
     "subscribe_topics": [
         "device/+/data",       # 设备数据主题，+是通配符
+        "device/+/schema",     # 设备二进制遥测字段字典（保留消息）
         "device/+/status",     # 设备状态主题
         "device/+/result",     # 设备命令结果主题
         "langchain/process/+", # LangChain处理请求
         "device/control/#"      # 设备控制主题，#是多级通配符
     ],
+    # 订阅主题对应的处理优先级类别，按顺序匹配，未匹配的主题归入telemetry
+    "topic_priorities": {
+        "device/control/#": "control",
+        "device/+/result": "command",
+        "device/+/status": "status",
+        "langchain/process/+": "status",
+        "device/+/data": "telemetry"
+    },
     "publish_topics": {
         "device_control": "device/control",
         "device_command": "device/{device_id}/command",  # 格式化字符串，将在使用时替换{device_id}
+        "schema_ack": "device/{device_id}/schema/ack",   # 确认已收到设备的二进制字段字典
+        "keyframe_request": "device/{device_id}/keyframe",  # 增量帧序号不连续时请求设备发送关键帧
         "device_status": "device/status",
         "alert": "alert"
     }
 }
 
+# 消息接入流水线配置（MQTT网络线程只负责解码和入队）
+PIPELINE_CONFIG = {
+    "queue_size": int(os.getenv("PIPELINE_QUEUE_SIZE", "10000")),      # 接入队列容量
+    "worker_count": int(os.getenv("PIPELINE_WORKERS", "4")),           # 按设备分片的处理线程数
+    "enqueue_timeout": float(os.getenv("PIPELINE_ENQUEUE_TIMEOUT", "0")),  # 队列满时的最长等待秒数，0表示立即丢弃
+
+    # 微批处理模式：攒够batch_max_size条或等待batch_max_wait_ms毫秒后整批处理
+    "batch_enabled": os.getenv("PIPELINE_BATCH_ENABLED", "False").lower() == "true",
+    "batch_max_size": int(os.getenv("PIPELINE_BATCH_MAX_SIZE", "500")),
+    "batch_max_wait_ms": int(os.getenv("PIPELINE_BATCH_MAX_WAIT_MS", "200")),
+
+    # 增量帧序号不连续时，同一设备两次请求关键帧的最短间隔（秒）
+    "keyframe_request_interval": float(os.getenv("PIPELINE_KEYFRAME_REQUEST_INTERVAL", "10")),
+
+    # asyncio模式下同时处理的消息数上限
+    "async_max_inflight": int(os.getenv("PIPELINE_ASYNC_MAX_INFLIGHT", "1000")),
+
+    # 优先级类别：每个类别有独立的队列和处理线程，互不阻塞
+    # shed_policy: block - 队列满时最多等待enqueue_timeout秒；drop - 队列满时丢弃；
+    #              sample - 队列深度超过shed_watermark后按1/sample_rate采样，队列满时丢弃
+    # 入队在MQTT网络线程中执行，block等待期间所有MQTT收发（包括心跳）都会停顿，
+    # 因此控制和命令消息使用较大的独立队列和drop策略，而不是在网络线程中等待
+    # telemetry未配置的workers/queue_size使用上面的worker_count/queue_size，并支持微批模式
+    "priority_classes": {
+        "control": {"workers": 1, "queue_size": 5000, "shed_policy": "drop"},
+        "command": {"workers": 1, "queue_size": 5000, "shed_policy": "drop"},
+        "status": {"workers": 1, "queue_size": 2000, "shed_policy": "drop"},
+        "telemetry": {
+            "shed_policy": os.getenv("PIPELINE_TELEMETRY_SHED_POLICY", "sample"),
+            "sample_rate": int(os.getenv("PIPELINE_TELEMETRY_SAMPLE_RATE", "10")),
+            "shed_watermark": float(os.getenv("PIPELINE_SHED_WATERMARK", "0.8"))
+        }
+    },
+    "bulk_class": "telemetry"
+}
+
+# 多进程接入配置：启动多个接入进程，通过MQTT v5共享订阅($share/<group>/...)分摊消息
+INGEST_CONFIG = {
+    "workers": int(os.getenv("INGEST_WORKERS", "0")),                   # 接入进程数，0表示单进程模式
+    "share_group": os.getenv("INGEST_SHARE_GROUP", "aipi_ingest"),      # 共享订阅组名
+    "client_id_prefix": os.getenv("INGEST_CLIENT_ID_PREFIX", "aipi_ingest"),  # 每个进程的客户端ID为 前缀-编号
+    "metrics_interval": float(os.getenv("INGEST_METRICS_INTERVAL", "10")),    # 进程上报指标的间隔（秒）
+    "restart_delay": float(os.getenv("INGEST_RESTART_DELAY", "5")),     # 进程退出后重启前的等待时间（秒）
+    "metrics_file": os.getenv("INGEST_METRICS_FILE", "logs/ingest_metrics.json"),  # 汇总指标输出文件
+    # 各接入进程共用的告警冷却记录（SQLite），避免同一告警由多个进程重复发送
+    "alert_cooldown_db": os.getenv("INGEST_ALERT_COOLDOWN_DB", "data/alert_cooldown.db"),
+    # 不使用共享订阅的主题：每个接入进程都需要收到全部设备的字段字典（共享订阅也不会投递保留消息）
+    "broadcast_topics": ["device/+/schema"]
+}
+
 # 设备IDs
 DEVICE_IDS = os.getenv("DEVICE_IDS", "").split(",")
 
@@ -140,13 +201,103 @@ INFLUXDB_CONFIG = {
     "token": os.getenv("INFLUXDB_TOKEN", ""),
     "org": os.getenv("INFLUXDB_ORG", "smart_iot"),
     "bucket": os.getenv("INFLUXDB_BUCKET", "device_data"),
-    "measurement": "sensors"
+    "measurement": "sensors",
+
+    # 连接：进程内共享一个客户端和连接池，请求有超时，连续失败时熔断
+    "connect_timeout_ms": int(os.getenv("INFLUXDB_CONNECT_TIMEOUT_MS", "5000")),
+    "read_timeout_ms": int(os.getenv("INFLUXDB_READ_TIMEOUT_MS", "30000")),
+    "pool_maxsize": int(os.getenv("INFLUXDB_POOL_MAXSIZE", "20")),               # 连接池保留的连接数
+    "enable_gzip": os.getenv("INFLUXDB_ENABLE_GZIP", "False").lower() == "true",
+    "breaker_failure_threshold": int(os.getenv("INFLUXDB_BREAKER_FAILURES", "5")),  # 打开熔断器的连续失败次数
+    "breaker_reset_timeout": float(os.getenv("INFLUXDB_BREAKER_RESET_TIMEOUT", "30")),  # 熔断后的冷却时间（秒）
+
+    # 批量写入：写入调用只入队，后台线程攒批写入，失败时指数退避重试
+    "batch_enabled": os.getenv("INFLUXDB_BATCH_ENABLED", "True").lower() == "true",
+    "batch_size": int(os.getenv("INFLUXDB_BATCH_SIZE", "1000")),               # 每批最多数据点数
+    "flush_interval_ms": int(os.getenv("INFLUXDB_FLUSH_INTERVAL_MS", "1000")),  # 最长攒批时间
+    "jitter_ms": int(os.getenv("INFLUXDB_JITTER_MS", "0")),                     # 每批随机额外等待时间上限
+    "max_retries": int(os.getenv("INFLUXDB_MAX_RETRIES", "5")),
+    "retry_interval_ms": int(os.getenv("INFLUXDB_RETRY_INTERVAL_MS", "1000")),  # 第一次重试前的等待时间
+    "max_retry_delay_ms": int(os.getenv("INFLUXDB_MAX_RETRY_DELAY_MS", "30000")),
+    "max_pending": int(os.getenv("INFLUXDB_MAX_PENDING", "100000")),            # 内存中待写入数据点上限
+    "close_timeout": float(os.getenv("INFLUXDB_CLOSE_TIMEOUT", "10")),          # 关闭时等待写完的最长时间（秒）
+
+    # 写入缓冲：InfluxDB不可用时把数据追加到本地分段文件，恢复后按顺序限速重放
+    "spool_enabled": os.getenv("INFLUXDB_SPOOL_ENABLED", "True").lower() == "true",
+    "spool_dir": os.getenv("INFLUXDB_SPOOL_DIR", "data/influx_spool"),
+    "spool_segment_bytes": int(os.getenv("INFLUXDB_SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024))),  # 单个分段文件大小上限
+    "spool_max_bytes": int(os.getenv("INFLUXDB_SPOOL_MAX_BYTES", str(1024 * 1024 * 1024))),        # 缓冲总大小上限
+    "spool_fsync_interval_ms": int(os.getenv("INFLUXDB_SPOOL_FSYNC_INTERVAL_MS", "1000")),          # 合并fsync的时间窗口
+    "spool_eviction": os.getenv("INFLUXDB_SPOOL_EVICTION", "drop_oldest"),    # 超过上限时: drop_oldest 或 reject
+    "spool_replay_rate": int(os.getenv("INFLUXDB_SPOOL_REPLAY_RATE", "5000")),  # 重放速率上限（数据点/秒）
+    "spool_replay_batch": int(os.getenv("INFLUXDB_SPOOL_REPLAY_BATCH", "1000")),
+
+    # 最新值存储：接收数据时记录每个设备各字段的最新值，查询最新数据时不再访问InfluxDB
+    "last_value_enabled": os.getenv("INFLUXDB_LAST_VALUE_ENABLED", "True").lower() == "true",
+    "last_value_max_devices": int(os.getenv("INFLUXDB_LAST_VALUE_MAX_DEVICES", "100000")),
+    "last_value_query_ttl": float(os.getenv("INFLUXDB_LAST_VALUE_QUERY_TTL", "60")),  # 从InfluxDB查询得到的最新值的有效期（秒）
+
+    # 历史数据查询：按时间窗口在InfluxDB中聚合，每个字段返回的点数不超过上限
+    "history_max_points": int(os.getenv("INFLUXDB_HISTORY_MAX_POINTS", "1000")),        # 默认每个字段的点数上限
+    "history_points_limit": int(os.getenv("INFLUXDB_HISTORY_POINTS_LIMIT", "10000")),   # 请求可指定的点数上限
+
+    # 字段类型注册表：登记每个字段的类型，转换或丢弃类型不一致的值，展开嵌套对象
+    "schema_enabled": os.getenv("INFLUXDB_SCHEMA_ENABLED", "True").lower() == "true",
+    "schema_field_types": os.getenv("INFLUXDB_SCHEMA_FIELD_TYPES", ""),         # 声明的字段类型，例如 rssi:int,relay:bool
+    # 未声明的数值字段是否都按浮点数登记；默认整数仍按整数写入，与已有bucket中的字段类型一致
+    "schema_numeric_as_float": os.getenv("INFLUXDB_SCHEMA_NUMERIC_AS_FLOAT", "False").lower() == "true",
+    "schema_allow_strings": os.getenv("INFLUXDB_SCHEMA_ALLOW_STRINGS", "True").lower() == "true",        # 是否允许新的字符串字段
+    "schema_nested_mode": os.getenv("INFLUXDB_SCHEMA_NESTED_MODE", "flatten"),  # 嵌套对象: flatten、string 或 drop
+    "schema_max_depth": int(os.getenv("INFLUXDB_SCHEMA_MAX_DEPTH", "3")),
+    "schema_max_string_length": int(os.getenv("INFLUXDB_SCHEMA_MAX_STRING_LENGTH", "1024")),
+    "schema_max_fields": int(os.getenv("INFLUXDB_SCHEMA_MAX_FIELDS", "1000"))   # 每个measurement的字段数上限
+}
+
+# 存储后端配置：influxdb 或 sqlite（嵌入式存储，不需要InfluxDB服务，适用于边缘节点和CI）
+STORAGE_CONFIG = {
+    "backend": os.getenv("STORAGE_BACKEND", "influxdb").lower(),
+    "sqlite_path": os.getenv("SQLITE_PATH", "data/timeseries.db"),
+    "sqlite_partition_hours": int(os.getenv("SQLITE_PARTITION_HOURS", "24")),    # 每个分区表覆盖的小时数
+    "sqlite_retention_days": float(os.getenv("SQLITE_RETENTION_DAYS", "30")),    # 数据保留天数，0表示不删除
+    "sqlite_prune_interval": int(os.getenv("SQLITE_PRUNE_INTERVAL", "3600")),    # 清理过期数据的间隔（秒）
+    "sqlite_synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")              # NORMAL 或 FULL
+}
+
+# 降采样配置：InfluxDB任务把原始数据聚合（mean/min/max/count/last）写入降采样bucket，
+# 历史查询按聚合窗口选择能满足精度的最粗级别
+ROLLUP_CONFIG = {
+    "enabled": os.getenv("INFLUXDB_ROLLUP_ENABLED", "True").lower() == "true",
+    "task_prefix": os.getenv("INFLUXDB_ROLLUP_TASK_PREFIX", "aipi_rollup"),
+    "offset": os.getenv("INFLUXDB_ROLLUP_OFFSET", "10s"),                        # 任务延迟运行时间，等待迟到的数据
+    "maintain_interval": int(os.getenv("INFLUXDB_ROLLUP_MAINTAIN_INTERVAL", "3600")),  # 检查bucket和任务的间隔（秒）
+    "tiers": [
+        {
+            "every": "1m",
+            "bucket": os.getenv("INFLUXDB_ROLLUP_1M_BUCKET", f"{INFLUXDB_CONFIG['bucket']}_1m"),
+            "retention_days": int(os.getenv("INFLUXDB_ROLLUP_1M_RETENTION_DAYS", "90"))
+        },
+        {
+            "every": "1h",
+            "bucket": os.getenv("INFLUXDB_ROLLUP_1H_BUCKET", f"{INFLUXDB_CONFIG['bucket']}_1h"),
+            "retention_days": int(os.getenv("INFLUXDB_ROLLUP_1H_RETENTION_DAYS", "730"))
+        }
+    ]
 }
 
 # 告警配置
 ALERT_CONFIG = {
     "cooldown_seconds": int(os.getenv("ALERT_COOLDOWN", "300")),
     "check_interval_minutes": int(os.getenv("ALERT_CHECK_INTERVAL", "5")),
+    "data_time_range": os.getenv("ALERT_DATA_TIME_RANGE", "10m"),     # 检查最近多长时间内的数据
+    
+    # 批量检查：一次Flux查询获取一批设备的最新数据，多个分片并发查询
+    "batch_query": os.getenv("ALERT_BATCH_QUERY", "True").lower() == "true",
+    "batch_shard_size": int(os.getenv("ALERT_BATCH_SHARD_SIZE", "500")),      # 每个查询包含的设备数
+    "batch_query_workers": int(os.getenv("ALERT_BATCH_QUERY_WORKERS", "4")),  # 并发查询数
+    # 除配置中的设备外，同时检查时间范围内上报过数据的所有设备（一次查询全部设备）
+    "check_reporting_devices": os.getenv("ALERT_CHECK_REPORTING_DEVICES", "False").lower() == "true",
+    # 批量评估的数据条数达到该值时，按字段装入数组一次比较
+    "vectorize_min_batch": int(os.getenv("ALERT_VECTORIZE_MIN_BATCH", "64")),
     
     # 默认告警规则
     "default_rules": [
@@ -7,9 +7,8 @@ import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Union
 from dotenv import load_dotenv
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS, ASYNCHRONOUS
 import json
+from config import INFLUXDB_CONFIG
 
 # 配置日志
 logging.basicConfig(
@@ -21,6 +20,10 @@ logger = logging.getLogger("data_manager")
 # 加载环境变量
 load_dotenv()
 
+# 命令结果和告警的measurement
+COMMAND_RESULTS_MEASUREMENT = "command_results"
+ALERTS_MEASUREMENT = "alerts"
+
 class DeviceManager:
     """设备管理器，负责设备的CRUD操作"""
     
@@ -213,6 +216,23 @@ class DataManager:
     def __init__(self):
         """初始化数据管理器"""
         self.device_manager = DeviceManager()
+        self.influx_url = INFLUXDB_CONFIG["url"]
+        self.influx_org = INFLUXDB_CONFIG["org"]
+        self.influx_bucket = INFLUXDB_CONFIG["bucket"]
+    
+    def _connect(self) -> bool:
+        """检查数据库是否可用
+        
+        使用进程内共享的InfluxDB连接，不单独创建客户端；使用嵌入式存储时始终可用
+        
+        Returns:
+            是否可用
+        """
+        from influx_writer import get_local_store
+        if get_local_store() is not None:
+            return True
+        from influx_connection import get_influx_connection
+        return get_influx_connection().ping()
     
     # 设备管理方法
     def load_devices(self) -> List[Dict[str, Any]]:
@@ -247,9 +267,8 @@ class DataManager:
         Returns:
             是否写入成功
         """
-        # 示例实现，真实环境应该写入到InfluxDB或其他数据库
-        logger.info(f"写入设备数据: {device_id}, {data}")
-        return True
+        from influx_writer import write_to_influxdb
+        return write_to_influxdb(device_id, data)
     
     def write_command_result(self, device_id: str, command: str, success: bool, output: str = "", error: str = "") -> bool:
         """写入命令结果到数据库
@@ -264,9 +283,79 @@ class DataManager:
         Returns:
             是否写入成功
         """
-        # 示例实现，真实环境应该写入到InfluxDB或其他数据库
-        logger.info(f"写入命令结果: {device_id}, {command}, {success}, {output}, {error}")
-        return True
+        from influx_writer import write_record_to_influxdb
+        return write_record_to_influxdb(
+            COMMAND_RESULTS_MEASUREMENT,
+            device_id,
+            {"command": command, "success": bool(success), "output": output or "", "error": error or ""},
+            tags={"status": "success" if success else "failed"}
+        )
+    
+    def write_alert(self, device_id: str, alert_type: str, message: str,
+                    severity: str = "info", data: Optional[Dict[str, Any]] = None) -> bool:
+        """写入告警到数据库
+        
+        Args:
+            device_id: 设备ID
+            alert_type: 告警类型
+            message: 告警信息
+            severity: 严重性
+            data: 附加数据，按JSON字符串保存在data字段
+            
+        Returns:
+            是否写入成功
+        """
+        fields = {"message": message}
+        if data:
+            fields["data"] = json.dumps(data, ensure_ascii=False, default=str)
+        from influx_writer import write_record_to_influxdb
+        return write_record_to_influxdb(
+            ALERTS_MEASUREMENT,
+            device_id,
+            fields,
+            tags={"alert_type": alert_type, "severity": severity}
+        )
+    
+    def query_device_data(self, device_id: str, measurement: str = "device_data",
+                          start_time: str = "-1h", limit: int = 100) -> List[Dict[str, Any]]:
+        """查询设备最近的记录，时间范围和条数限制在数据库中执行
+        
+        Args:
+            device_id: 设备ID
+            measurement: device_data（设备数据）、command_results、alerts 或其他measurement
+            start_time: 起始时间，相对时长（-1h）、Unix时间戳或ISO 8601时间
+            limit: 最多返回的记录数
+            
+        Returns:
+            记录列表，按时间从新到旧
+            
+        Raises:
+            ValueError: 参数无效
+            ConnectionError: InfluxDB未连接
+        """
+        from influx_writer import query_records
+        return query_records(measurement, device_id, start_time, limit)
+    
+    def query_device_history(self, device_id: str, start: str = "-1h", stop: str = "now",
+                             every: Optional[str] = None, fn: str = "mean",
+                             fields: Optional[List[str]] = None,
+                             max_points: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """查询设备历史数据，按聚合窗口自动选择原始数据或降采样数据
+        
+        Args:
+            device_id: 设备ID
+            start: 起始时间，相对时长（-1h）、Unix时间戳或ISO 8601时间
+            stop: 结束时间
+            every: 聚合窗口，为空时自动选择
+            fn: 聚合函数，mean/max/min/last
+            fields: 字段列表
+            max_points: 每个字段的点数上限
+            
+        Returns:
+            按字段分组的历史数据，InfluxDB未连接时返回None
+        """
+        from influx_writer import query_history
+        return query_history(device_id, start, stop, every, fn, fields, max_points)
 
 # 单例模式，确保只有一个数据管理器实例
 _data_manager_instance = None
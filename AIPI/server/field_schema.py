@@ -0,0 +1,336 @@
+"""
+字段类型注册表
+
+按 (measurement, 字段) 记录字段类型：配置中声明的类型优先，未声明的字段使用第一次出现的值推断类型。
+之后的值按类型转换（例如整数写入浮点字段、"25.3"写入浮点字段、0/1写入布尔字段），无法转换的值被丢弃并计数，
+避免同一字段出现不同类型导致整批写入被InfluxDB拒绝。
+整数默认按整数登记，与之前直接写入的类型一致，升级后不会与InfluxDB中已有的integer字段冲突；
+开启 numeric_as_float 后数值都按浮点数登记，温度等字段上报 25 和 25.5 时不会产生 integer/float 冲突
+（适用于新的bucket，已有integer字段需要先在 schema_field_types 中声明）；
+可以解析为数字的字符串按数字登记，保持在可压缩的数值存储路径上。
+嵌套对象（例如 system_info）按配置展开为 "system_info_cpu_percent" 形式的独立字段、转为字符串或丢弃。
+"""
+import json
+import math
+import re
+import threading
+from line_protocol import NON_FIELD_KEYS
+
+# 字段类型
+FIELD_FLOAT = "float"
+FIELD_INT = "int"
+FIELD_BOOL = "bool"
+FIELD_STRING = "string"
+FIELD_TYPES = (FIELD_FLOAT, FIELD_INT, FIELD_BOOL, FIELD_STRING)
+
+# 嵌套对象的处理方式
+NESTED_FLATTEN = "flatten"
+NESTED_STRING = "string"
+NESTED_DROP = "drop"
+NESTED_MODES = (NESTED_FLATTEN, NESTED_STRING, NESTED_DROP)
+
+# 丢弃字段值的原因
+REJECT_TYPE_CONFLICT = "type_conflict"
+REJECT_NON_FINITE = "non_finite"
+REJECT_STRING_NOT_ALLOWED = "string_not_allowed"
+REJECT_STRING_TOO_LONG = "string_too_long"
+REJECT_UNSUPPORTED = "unsupported_type"
+REJECT_TOO_DEEP = "too_deep"
+REJECT_TOO_MANY_FIELDS = "too_many_fields"
+
+# 各类型对应的Python类型，值的类型一致时不需要转换
+_PYTHON_TYPES = {
+    FIELD_FLOAT: float,
+    FIELD_INT: int,
+    FIELD_BOOL: bool,
+    FIELD_STRING: str
+}
+
+# InfluxDB错误信息中的类型名称
+_INFLUX_TYPE_NAMES = {
+    "float": FIELD_FLOAT,
+    "integer": FIELD_INT,
+    "unsigned": FIELD_INT,
+    "boolean": FIELD_BOOL,
+    "string": FIELD_STRING
+}
+
+_TRUE_STRINGS = frozenset(("true", "on", "yes", "1"))
+_FALSE_STRINGS = frozenset(("false", "off", "no", "0"))
+
+# 例如: field type conflict: input field "temperature" on measurement "sensors" is type integer, already exists as type float
+_CONFLICT_PATTERN = re.compile(
+    r'input field \\?"(?P<field>[^"\\]+)\\?" on measurement \\?"(?P<measurement>[^"\\]+)\\?" '
+    r'is type \w+, already exists as type (?P<type>\w+)'
+)
+
+class _Rejected(Exception):
+    """字段值无法转换为登记的类型"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+def parse_field_types(text):
+    """
+    解析声明的字段类型
+    :param text: 逗号分隔的 "字段:类型" 或 "measurement.字段:类型"，例如 "rssi:int,relay:bool"
+    :return: {字段或measurement.字段: 类型}
+    :raises ValueError: 类型无效
+    """
+    declared = {}
+    for item in (text or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, field_type = item.rpartition(":")
+        field_type = field_type.strip().lower()
+        if not name or field_type not in FIELD_TYPES:
+            raise ValueError(f"字段类型声明无效: {item}")
+        declared[name.strip()] = field_type
+    return declared
+
+def _parse_number(text):
+    """把字符串解析为数字，无法解析时返回None"""
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+class FieldSchemaRegistry:
+    """记录并强制字段类型，转换或丢弃与登记类型不一致的值"""
+
+    def __init__(self, declared=None, numeric_as_float=False, allow_strings=True, nested_mode=NESTED_FLATTEN,
+                 separator="_", max_depth=3, max_string_length=1024, max_fields=1000):
+        """
+        :param declared: 声明的字段类型 {字段或measurement.字段: 类型}
+        :param numeric_as_float: 未声明的数值字段是否都按浮点数登记
+        :param allow_strings: 是否允许登记新的字符串字段
+        :param nested_mode: 嵌套对象的处理方式: flatten、string 或 drop
+        :param separator: 展开嵌套对象时字段名的分隔符
+        :param max_depth: 展开嵌套对象的最大层数
+        :param max_string_length: 字符串字段值的最大长度，0表示不限制
+        :param max_fields: 每个measurement登记字段数的上限，0表示不限制
+        """
+        if nested_mode not in NESTED_MODES:
+            raise ValueError(f"嵌套对象处理方式无效: {nested_mode}")
+        self.declared = dict(declared or {})
+        self.numeric_as_float = numeric_as_float
+        self.allow_strings = allow_strings
+        self.nested_mode = nested_mode
+        self.separator = separator
+        self.max_depth = max_depth
+        self.max_string_length = max_string_length
+        self.max_fields = max_fields
+        # measurement -> {字段: 类型}
+        self._types = {}
+        # (measurement, 字段, 原因) -> 次数
+        self._rejections = {}
+        self._coerced = 0
+        self._flattened = 0
+        self._lock = threading.Lock()
+
+    def field_type(self, measurement, field):
+        """获取字段登记的类型，未登记时返回None"""
+        return self._types.get(measurement, {}).get(field)
+
+    def declare(self, measurement, field, field_type):
+        """
+        登记或修改字段类型，例如按InfluxDB中已有的类型修正推断结果
+        :param measurement: measurement名称
+        :param field: 字段名
+        :param field_type: 字段类型
+        """
+        if field_type not in FIELD_TYPES:
+            raise ValueError(f"字段类型无效: {field_type}")
+        with self._lock:
+            self._types.setdefault(measurement, {})[field] = field_type
+
+    def learn_from_error(self, message):
+        """
+        从InfluxDB的字段类型冲突错误中获取已有类型并登记，之后的值按已有类型转换
+        :param message: 写入错误信息
+        :return: 修正的字段数
+        """
+        corrected = 0
+        for match in _CONFLICT_PATTERN.finditer(message or ""):
+            field_type = _INFLUX_TYPE_NAMES.get(match.group("type"))
+            if field_type is None:
+                continue
+            self.declare(match.group("measurement"), match.group("field"), field_type)
+            corrected += 1
+        return corrected
+
+    def normalize(self, measurement, data):
+        """
+        按登记的类型转换数据中的字段
+        :param measurement: measurement名称
+        :param data: 设备数据字典
+        :return: 新的数据字典，标签和时间戳不变，无法转换的字段已去掉
+        """
+        types = self._types.get(measurement)
+        if types is None:
+            with self._lock:
+                types = self._types.setdefault(measurement, {})
+
+        result = {}
+        for key, value in data.items():
+            if key in NON_FIELD_KEYS:
+                result[key] = value
+                continue
+            field_type = types.get(key)
+            # 值的类型与登记类型一致时直接使用
+            if field_type is not None and type(value) is _PYTHON_TYPES[field_type]:
+                if field_type is not FIELD_FLOAT or math.isfinite(value):
+                    result[key] = value
+                    continue
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                self._add_nested(measurement, types, result, key, value, 1)
+            else:
+                self._add_value(measurement, types, result, key, value)
+        return result
+
+    def _add_nested(self, measurement, types, result, key, value, depth):
+        """按配置处理嵌套对象"""
+        if self.nested_mode == NESTED_DROP:
+            return
+        if self.nested_mode == NESTED_STRING:
+            self._add_value(measurement, types, result, key, json.dumps(value, ensure_ascii=False, default=str))
+            return
+        if depth > self.max_depth:
+            self._reject(measurement, key, REJECT_TOO_DEEP)
+            return
+        self._flattened += 1
+        for child_key, child_value in value.items():
+            name = f"{key}{self.separator}{child_key}"
+            if child_value is None:
+                continue
+            if isinstance(child_value, dict):
+                self._add_nested(measurement, types, result, name, child_value, depth + 1)
+            else:
+                self._add_value(measurement, types, result, name, child_value)
+
+    def _add_value(self, measurement, types, result, key, value):
+        """按登记的类型转换一个字段值，未登记的字段先推断类型"""
+        field_type = types.get(key)
+        try:
+            if field_type is None:
+                if self.max_fields and len(types) >= self.max_fields:
+                    raise _Rejected(REJECT_TOO_MANY_FIELDS)
+                field_type = self.declared.get(f"{measurement}.{key}") or self.declared.get(key) or self._infer(value)
+                with self._lock:
+                    # 并发时以先登记的类型为准
+                    field_type = types.setdefault(key, field_type)
+            converted = self._coerce(value, field_type)
+        except _Rejected as e:
+            self._reject(measurement, key, e.reason)
+            return
+        if type(converted) is not type(value):
+            self._coerced += 1
+        result[key] = converted
+
+    def _infer(self, value):
+        """根据第一次出现的值推断字段类型"""
+        if isinstance(value, bool):
+            return FIELD_BOOL
+        if isinstance(value, (int, float)):
+            if isinstance(value, int) and not self.numeric_as_float:
+                return FIELD_INT
+            return FIELD_FLOAT
+        if isinstance(value, str):
+            text = value.strip().lower()
+            if text in ("true", "false"):
+                return FIELD_BOOL
+            if _parse_number(text) is not None:
+                return FIELD_FLOAT
+            if not self.allow_strings:
+                raise _Rejected(REJECT_STRING_NOT_ALLOWED)
+            return FIELD_STRING
+        if isinstance(value, (list, tuple)):
+            if self.nested_mode == NESTED_STRING:
+                return FIELD_STRING
+            raise _Rejected(REJECT_UNSUPPORTED)
+        raise _Rejected(REJECT_UNSUPPORTED)
+
+    def _coerce(self, value, field_type):
+        """把值转换为字段类型，无法转换时抛出_Rejected"""
+        if field_type == FIELD_FLOAT:
+            if isinstance(value, (int, float)):
+                value = float(value)
+            elif isinstance(value, str):
+                value = _parse_number(value.strip())
+                if value is None:
+                    raise _Rejected(REJECT_TYPE_CONFLICT)
+            else:
+                raise _Rejected(REJECT_TYPE_CONFLICT)
+            if not math.isfinite(value):
+                raise _Rejected(REJECT_NON_FINITE)
+            return value
+
+        if field_type == FIELD_INT:
+            if isinstance(value, bool):
+                return int(value)
+            if isinstance(value, int):
+                return int(value)
+            if isinstance(value, float) and value.is_integer():
+                return int(value)
+            if isinstance(value, str):
+                number = _parse_number(value.strip())
+                if number is not None and number.is_integer():
+                    return int(number)
+            raise _Rejected(REJECT_TYPE_CONFLICT)
+
+        if field_type == FIELD_BOOL:
+            if isinstance(value, bool):
+                return value
+            if isinstance(value, (int, float)) and value in (0, 1):
+                return bool(value)
+            if isinstance(value, str):
+                text = value.strip().lower()
+                if text in _TRUE_STRINGS:
+                    return True
+                if text in _FALSE_STRINGS:
+                    return False
+            raise _Rejected(REJECT_TYPE_CONFLICT)
+
+        # 字符串字段
+        if isinstance(value, (list, tuple, dict)):
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        elif isinstance(value, bool):
+            value = "true" if value else "false"
+        elif not isinstance(value, str):
+            value = str(value)
+        if self.max_string_length and len(value) > self.max_string_length:
+            raise _Rejected(REJECT_STRING_TOO_LONG)
+        return value
+
+    def _reject(self, measurement, field, reason):
+        key = (measurement, field, reason)
+        with self._lock:
+            self._rejections[key] = self._rejections.get(key, 0) + 1
+
+    def stats(self):
+        """
+        获取注册表统计
+        :return: 登记的字段类型、各原因的丢弃次数和转换次数
+        """
+        with self._lock:
+            rejections = dict(self._rejections)
+            fields = {measurement: dict(types) for measurement, types in self._types.items()}
+        by_reason = {}
+        for (_, _, reason), count in rejections.items():
+            by_reason[reason] = by_reason.get(reason, 0) + count
+        return {
+            "fields": fields,
+            "coerced": self._coerced,
+            "flattened": self._flattened,
+            "rejected": sum(rejections.values()),
+            "rejected_by_reason": by_reason,
+            "rejections": [
+                {"measurement": measurement, "field": field, "reason": reason, "count": count}
+                for (measurement, field, reason), count in sorted(rejections.items())
+            ]
+        }
@@ -0,0 +1,261 @@
+"""
+InfluxDB批量写入器
+
+写入调用只把数据点放入内存缓冲区就返回，由后台线程按条数或时间窗口攒批后一次写入，
+每条数据不再单独等待一次HTTP往返。写入失败时按指数退避重试，重试用尽后通过回调通知调用方。
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from config import LOG_CONFIG
+from ingest_pipeline import PipelineMetrics
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("influx_batch_writer")
+
+# 客户端错误（请求本身有问题）重试也不会成功，429除外
+_NON_RETRYABLE_STATUS = range(400, 500)
+
+def is_retryable(error):
+    """
+    判断写入错误是否值得重试
+    :param error: 写入时抛出的异常
+    :return: 网络错误、服务端错误和429返回True，其他4xx返回False
+    """
+    status = getattr(error, "status", None)
+    if isinstance(status, int) and status in _NON_RETRYABLE_STATUS and status != 429:
+        return False
+    return True
+
+class BatchingWriter:
+    """按条数或时间窗口攒批写入，带重试、回调和指标"""
+
+    def __init__(self, write_fn, batch_size=1000, flush_interval_ms=1000, jitter_ms=0,
+                 max_retries=5, retry_interval_ms=1000, max_retry_delay_ms=30000,
+                 exponential_base=2, max_pending=100000,
+                 on_success=None, on_error=None, on_retry=None, name="influx"):
+        """
+        :param write_fn: 实际写入函数，签名为 write_fn(records)，失败时抛出异常
+        :param batch_size: 每批最多数据点数
+        :param flush_interval_ms: 第一条数据入队后最长等待时间（毫秒）
+        :param jitter_ms: 每批额外随机等待的最长时间（毫秒），避免多个实例同时写入
+        :param max_retries: 失败后的最大重试次数
+        :param retry_interval_ms: 第一次重试前的等待时间（毫秒）
+        :param max_retry_delay_ms: 重试等待时间上限（毫秒）
+        :param exponential_base: 重试等待时间的指数底数
+        :param max_pending: 缓冲区容量，超过后write返回False
+        :param on_success: 批次写入成功回调，签名为 on_success(records)
+        :param on_error: 批次最终写入失败回调，签名为 on_error(records, error)
+        :param on_retry: 批次准备重试时的回调，签名为 on_retry(records, error, attempt)
+        :param name: 写入器名称，用于线程命名和日志
+        """
+        self.write_fn = write_fn
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.max_retries = max(0, int(max_retries))
+        self.retry_interval = retry_interval_ms / 1000.0
+        self.max_retry_delay = max_retry_delay_ms / 1000.0
+        self.exponential_base = exponential_base
+        self.max_pending = max(1, int(max_pending))
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_retry = on_retry
+        self.name = name
+        self.metrics = PipelineMetrics()
+
+        self.buffer = deque()
+        self.in_flight = 0
+        self.max_depth = 0
+        self.running = False
+        self.flush_requested = False
+        self.flush_thread = None
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """启动写入线程，重复调用不会重复启动"""
+        with self._cond:
+            if self.running:
+                return
+            self.running = True
+            self._stop_event.clear()
+            self.flush_thread = threading.Thread(target=self._flush_loop, name=f"{self.name}-writer")
+            self.flush_thread.daemon = True
+            self.flush_thread.start()
+        logger.info(f"批量写入器 {self.name} 已启动，批大小: {self.batch_size}，"
+                    f"刷新间隔: {self.flush_interval * 1000:.0f}ms")
+
+    def write(self, records):
+        """
+        把数据点放入缓冲区
+        :param records: 单个数据点或数据点列表
+        :return: 是否已放入缓冲区，缓冲区满时返回False
+        """
+        if not isinstance(records, list):
+            records = [records]
+        if not records:
+            return True
+        if not self.running:
+            self.start()
+
+        now = time.perf_counter()
+        with self._cond:
+            if len(self.buffer) + len(records) > self.max_pending:
+                self.metrics.incr("dropped", len(records))
+                return False
+            was_empty = not self.buffer
+            self.buffer.extend((record, now) for record in records)
+            depth = len(self.buffer)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if was_empty or depth >= self.batch_size:
+                self._cond.notify_all()
+
+        self.metrics.incr("enqueued", len(records))
+        return True
+
+    def _next_batch(self):
+        """等待并取出下一批数据点，停止且缓冲区为空时返回None"""
+        with self._cond:
+            while not self.buffer:
+                if not self.running:
+                    return None
+                self._cond.wait()
+
+            # 从最早一条数据开始计时，加上随机抖动
+            deadline = self.buffer[0][1] + self.flush_interval
+            if self.jitter:
+                deadline += random.uniform(0, self.jitter)
+            while self.running and not self.flush_requested and len(self.buffer) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            count = min(len(self.buffer), self.batch_size)
+            batch = [self.buffer.popleft() for _ in range(count)]
+            self.in_flight = count
+            return batch
+
+    def _flush_loop(self):
+        """写入线程主循环"""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            records = [record for record, _ in batch]
+            started_at = time.perf_counter()
+            self.metrics.observe("queue_wait", started_at - batch[0][1])
+            self._write_with_retry(records)
+            self.metrics.observe("flush", time.perf_counter() - started_at)
+
+            with self._cond:
+                self.in_flight = 0
+                if not self.buffer:
+                    self.flush_requested = False
+                self._cond.notify_all()
+
+    def _write_with_retry(self, records):
+        """写入一批数据点，失败时按指数退避重试"""
+        attempt = 0
+        while True:
+            try:
+                self.write_fn(records)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self.metrics.incr("failed", len(records))
+                    self.metrics.incr("failed_batches")
+                    logger.error(f"批量写入失败，数据点数: {len(records)}，重试次数: {attempt}，错误: {str(e)}")
+                    self._callback(self.on_error, records, e)
+                    return False
+
+                delay = min(self.retry_interval * self.exponential_base ** attempt, self.max_retry_delay)
+                if self.jitter:
+                    delay += random.uniform(0, self.jitter)
+                attempt += 1
+                self.metrics.incr("retries")
+                logger.warning(f"批量写入失败，{delay:.1f}秒后第{attempt}次重试，错误: {str(e)}")
+                self._callback(self.on_retry, records, e, attempt)
+                # 关闭时不再等待退避时间，尽快完成剩余重试
+                self._stop_event.wait(delay)
+                continue
+
+            self.metrics.incr("written", len(records))
+            self.metrics.incr("batches")
+            self._callback(self.on_success, records)
+            return True
+
+    def _callback(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"批量写入回调出错: {str(e)}")
+
+    def flush(self, timeout=10.0):
+        """
+        立即写入缓冲区中的全部数据点并等待完成
+        :param timeout: 最长等待时间（秒）
+        :return: 是否在超时前全部写完
+        """
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            if not self.running:
+                return not self.buffer
+            self.flush_requested = True
+            self._cond.notify_all()
+            while self.buffer or self.in_flight:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """
+        写完缓冲区中的数据点后停止写入线程
+        :param timeout: 最长等待时间（秒）
+        :return: 是否在超时前全部写完
+        """
+        flushed = self.flush(timeout)
+        with self._cond:
+            if not self.running:
+                return flushed
+            self.running = False
+            self._stop_event.set()
+            self._cond.notify_all()
+        if self.flush_thread:
+            self.flush_thread.join(timeout=timeout)
+        pending = self.pending()
+        if pending:
+            logger.warning(f"批量写入器 {self.name} 关闭时仍有 {pending} 个数据点未写入")
+        logger.info(f"批量写入器 {self.name} 已停止")
+        return flushed and not pending
+
+    def pending(self):
+        """缓冲区和正在写入的数据点总数"""
+        with self._cond:
+            return len(self.buffer) + self.in_flight
+
+    def get_metrics(self):
+        """获取待写入数量、写入/失败计数和刷新延迟"""
+        snapshot = self.metrics.snapshot()
+        with self._cond:
+            snapshot["queue"] = {
+                "pending": len(self.buffer) + self.in_flight,
+                "max_depth": self.max_depth,
+                "capacity": self.max_pending,
+                "batch_size": self.batch_size,
+                "flush_interval_ms": self.flush_interval * 1000
+            }
+        return snapshot
@@ -0,0 +1,221 @@
+"""
+InfluxDB连接管理
+
+每个进程只创建一个InfluxDBClient，写入、查询和降采样管理都通过 get_influx_connection() 获取，
+复用同一个urllib3连接池（HTTP keep-alive），不再为每次查询重新建立TCP/TLS连接。
+每个请求都有连接超时和读取超时；InfluxDB连续失败达到阈值后熔断器打开，
+之后的请求立即失败（写入转入批量重试和磁盘缓冲），不再每次等待超时，冷却时间过后放行一个探测请求。
+"""
+import logging
+import threading
+import time
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS
+from config import INFLUXDB_CONFIG, LOG_CONFIG
+from influx_batch_writer import is_retryable
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("influx_connection")
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+class CircuitOpenError(ConnectionError):
+    """熔断器打开，请求未发送"""
+
+class CircuitBreaker:
+    """连续失败达到阈值后拒绝请求，冷却时间过后放行一个探测请求，成功后恢复"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, name="influxdb"):
+        """
+        :param failure_threshold: 打开熔断器的连续失败次数
+        :param reset_timeout: 打开后到放行探测请求的等待时间（秒）
+        :param name: 名称，用于日志
+        """
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self.trips = 0
+        self.last_error = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        判断是否可以发送请求
+        :return: 熔断器关闭，或冷却后的第一个探测请求时返回True
+        """
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = STATE_HALF_OPEN
+            if self.state == STATE_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """请求成功，关闭熔断器"""
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                logger.info(f"{self.name} 已恢复，熔断器关闭")
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error=None):
+        """请求失败，连续失败达到阈值或探测请求失败时打开熔断器"""
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) if error is not None else None
+            self._probe_in_flight = False
+            if self.state == STATE_HALF_OPEN or (self.state == STATE_CLOSED and self.failures >= self.failure_threshold):
+                if self.state == STATE_CLOSED:
+                    self.trips += 1
+                    logger.error(f"{self.name} 连续失败 {self.failures} 次，熔断器打开 {self.reset_timeout} 秒: {self.last_error}")
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        """
+        通过熔断器执行请求
+        网络错误、超时和5xx/429计为失败；其他4xx说明服务可用，计为成功后原样抛出
+        :raises CircuitOpenError: 熔断器打开
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} 熔断器已打开，请求未发送")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if is_retryable(e):
+                self.record_failure(e)
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def status(self):
+        """获取熔断器状态"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "last_error": self.last_error
+            }
+
+class InfluxConnection:
+    """进程内共享的InfluxDB客户端、写入API、查询API和熔断器"""
+
+    def __init__(self, url, token, org, connect_timeout_ms=5000, read_timeout_ms=30000,
+                 pool_maxsize=20, enable_gzip=False, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param url: InfluxDB地址
+        :param token: 访问令牌
+        :param org: 组织
+        :param connect_timeout_ms: 建立连接的超时（毫秒）
+        :param read_timeout_ms: 等待响应的超时（毫秒）
+        :param pool_maxsize: 连接池保留的连接数，应不小于并发查询和写入线程数
+        :param enable_gzip: 是否压缩写入和查询的请求/响应
+        :param failure_threshold: 打开熔断器的连续失败次数
+        :param reset_timeout: 熔断器打开后的冷却时间（秒）
+        """
+        self.url = url
+        self.org = org
+        self.connect_timeout_ms = connect_timeout_ms
+        self.read_timeout_ms = read_timeout_ms
+        self.client = InfluxDBClient(
+            url=url,
+            token=token,
+            org=org,
+            timeout=(connect_timeout_ms, read_timeout_ms),
+            enable_gzip=enable_gzip,
+            connection_pool_maxsize=pool_maxsize
+        )
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        self.query_api = self.client.query_api()
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.closed = False
+
+    def call(self, fn, *args, **kwargs):
+        """通过熔断器执行请求，见 CircuitBreaker.call"""
+        return self.breaker.call(fn, *args, **kwargs)
+
+    def ping(self):
+        """
+        检查InfluxDB是否可用
+        :return: 是否可用
+        """
+        try:
+            return bool(self.call(self.client.ping))
+        except Exception as e:
+            logger.warning(f"InfluxDB不可用: {str(e)}")
+            return False
+
+    def status(self):
+        """获取连接配置和熔断器状态"""
+        return {
+            "url": self.url,
+            "org": self.org,
+            "connect_timeout_ms": self.connect_timeout_ms,
+            "read_timeout_ms": self.read_timeout_ms,
+            "breaker": self.breaker.status()
+        }
+
+    def close(self):
+        """关闭客户端和连接池"""
+        if self.closed:
+            return
+        self.closed = True
+        self.client.close()
+        logger.info("InfluxDB连接已关闭")
+
+# 单例实例
+_connection = None
+_connection_lock = threading.Lock()
+
+def get_influx_connection():
+    """
+    获取进程内共享的InfluxDB连接，首次调用时创建
+    :return: InfluxConnection实例
+    """
+    global _connection
+    if _connection is None:
+        with _connection_lock:
+            if _connection is None:
+                _connection = InfluxConnection(
+                    INFLUXDB_CONFIG["url"],
+                    INFLUXDB_CONFIG["token"],
+                    INFLUXDB_CONFIG["org"],
+                    connect_timeout_ms=INFLUXDB_CONFIG["connect_timeout_ms"],
+                    read_timeout_ms=INFLUXDB_CONFIG["read_timeout_ms"],
+                    pool_maxsize=INFLUXDB_CONFIG["pool_maxsize"],
+                    enable_gzip=INFLUXDB_CONFIG["enable_gzip"],
+                    failure_threshold=INFLUXDB_CONFIG["breaker_failure_threshold"],
+                    reset_timeout=INFLUXDB_CONFIG["breaker_reset_timeout"]
+                )
+                logger.info(f"InfluxDB客户端初始化成功: {INFLUXDB_CONFIG['url']}")
+    return _connection
+
+def close_influx_connection():
+    """关闭共享的InfluxDB连接"""
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
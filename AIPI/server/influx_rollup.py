@@ -0,0 +1,254 @@
+"""
+InfluxDB降采样
+
+为每个降采样级别（默认1m和1h）维护一个bucket和一个InfluxDB任务，任务按级别的时间间隔运行，
+把上一个时间窗口的原始数据聚合为mean/min/max/count/last写入降采样bucket。
+降采样数据保持原来的measurement和字段名，聚合方式记录在stat标签中；
+同一字段的各种聚合写在同一个InfluxDB字段中，因此全部转换为浮点数写入（count和整数字段的min/max/last也是浮点数），
+避免字段类型冲突。
+降采样点的时间是窗口的起始时间，再按更大的窗口聚合时落在与原始数据相同的窗口中。
+历史查询按请求的聚合窗口选择能满足精度的最粗级别，周/月范围的查询不再扫描原始数据。
+从降采样数据再聚合时，mean按count加权（sum(mean×count) / sum(count)），max/min/last与原始数据一致；
+最近一个尚未结束的降采样窗口要等任务运行后才有数据。
+bucket和任务由后台线程按维护间隔检查，选择级别时只读取检查结果，不在查询请求中调用InfluxDB管理API。
+"""
+import logging
+import threading
+import time
+from influxdb_client.domain.bucket_retention_rules import BucketRetentionRules
+from influxdb_client.domain.task_create_request import TaskCreateRequest
+from influxdb_client.domain.task_update_request import TaskUpdateRequest
+from config import LOG_CONFIG
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("influx_rollup")
+
+# 降采样写入的聚合方式和记录聚合方式的标签
+ROLLUP_STATS = ("mean", "min", "max", "count", "last")
+STAT_TAG = "stat"
+
+_NUMERIC_FILTER = (
+    'types.isType(v: r._value, type: "float") or types.isType(v: r._value, type: "int") '
+    'or types.isType(v: r._value, type: "uint")'
+)
+
+def build_rollup_flux(task_name, source_bucket, target_bucket, org, measurement, every, offset):
+    """
+    生成降采样任务的Flux脚本
+    任务在每个时间窗口结束后运行，聚合刚结束的窗口，重复运行会覆盖相同的点
+    :param task_name: 任务名称
+    :param source_bucket: 原始数据bucket
+    :param target_bucket: 降采样bucket
+    :param org: 组织
+    :param measurement: measurement名称
+    :param every: 时间窗口（Flux时长）
+    :param offset: 任务延迟运行的时间，等待迟到的数据写入
+    :return: Flux脚本
+    """
+    parts = [f'''import "types"
+
+option task = {{name: "{task_name}", every: {every}, offset: {offset}}}
+
+data = from(bucket: "{source_bucket}")
+    |> range(start: -task.every)
+    |> filter(fn: (r) => r["_measurement"] == "{measurement}")
+    |> filter(fn: (r) => {_NUMERIC_FILTER})
+''']
+    for stat in ROLLUP_STATS:
+        parts.append(f'''
+data
+    |> aggregateWindow(every: task.every, fn: {stat}, createEmpty: false, timeSrc: "_start")
+    |> toFloat()
+    |> set(key: "{STAT_TAG}", value: "{stat}")
+    |> to(bucket: "{target_bucket}", org: "{org}")
+''')
+    return "".join(parts)
+
+class RollupTier:
+    """一个降采样级别"""
+
+    def __init__(self, every, every_seconds, bucket, retention_days, task_name):
+        self.every = every
+        self.every_seconds = every_seconds
+        self.bucket = bucket
+        self.retention_seconds = int(retention_days * 86400) if retention_days else 0
+        self.task_name = task_name
+        # 任务创建时间，之前的数据没有降采样结果
+        self.since = None
+        self.ready = False
+
+class RollupManager:
+    """创建和维护降采样bucket和任务，并为历史查询选择降采样级别"""
+
+    def __init__(self, client, org, source_bucket, measurement, tiers, parse_duration,
+                 task_prefix="aipi_rollup", offset="10s", maintain_interval=3600):
+        """
+        :param client: InfluxDBClient
+        :param org: 组织名称
+        :param source_bucket: 原始数据bucket
+        :param measurement: measurement名称
+        :param tiers: 降采样级别配置列表，每项包含every、bucket、retention_days
+        :param parse_duration: 把Flux时长转换为秒数的函数
+        :param task_prefix: 任务名称前缀
+        :param offset: 任务延迟运行的时间
+        :param maintain_interval: 两次检查bucket和任务的最短间隔（秒）
+        """
+        self.client = client
+        self.org = org
+        self.source_bucket = source_bucket
+        self.measurement = measurement
+        self.offset = offset
+        self.maintain_interval = maintain_interval
+        self.tiers = []
+        for tier in tiers:
+            every_seconds = parse_duration(tier["every"])
+            if not every_seconds:
+                logger.error(f"降采样级别的时间间隔无效: {tier['every']}")
+                continue
+            self.tiers.append(RollupTier(
+                tier["every"], every_seconds, tier["bucket"], tier.get("retention_days"),
+                f"{task_prefix}_{tier['every']}"
+            ))
+        # 从细到粗排列
+        self.tiers.sort(key=lambda tier: tier.every_seconds)
+        self.last_ensure = None
+        self.last_error = None
+        self.maintain_thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        """
+        创建缺少的降采样bucket和任务，更新脚本变化或被停用的任务
+        :return: 是否全部就绪
+        """
+        with self._lock:
+            org_id = self._org_id()
+            all_ready = True
+            for tier in self.tiers:
+                try:
+                    self._ensure_bucket(tier, org_id)
+                    self._ensure_task(tier, org_id)
+                    tier.ready = True
+                except Exception as e:
+                    tier.ready = False
+                    all_ready = False
+                    self.last_error = str(e)
+                    logger.error(f"维护降采样级别 {tier.every} 时出错: {str(e)}")
+            self.last_ensure = time.time()
+            return all_ready
+
+    def start(self):
+        """启动后台维护线程：立即检查一次bucket和任务，之后每maintain_interval秒检查一次"""
+        with self._lock:
+            if self.maintain_thread is not None:
+                return
+            self._stop_event.clear()
+            self.maintain_thread = threading.Thread(target=self._maintain_loop, name="rollup-maintain")
+            self.maintain_thread.daemon = True
+            self.maintain_thread.start()
+
+    def _maintain_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.ensure()
+            except Exception as e:
+                self.last_ensure = time.time()
+                self.last_error = str(e)
+                logger.error(f"检查降采样任务时出错: {str(e)}")
+            self._stop_event.wait(self.maintain_interval)
+
+    def stop(self):
+        """停止后台维护线程"""
+        self._stop_event.set()
+        if self.maintain_thread is not None:
+            self.maintain_thread.join(timeout=5.0)
+            self.maintain_thread = None
+
+    def _org_id(self):
+        organizations = self.client.organizations_api().find_organizations(org=self.org)
+        if not organizations:
+            raise ValueError(f"未找到组织: {self.org}")
+        return organizations[0].id
+
+    def _ensure_bucket(self, tier, org_id):
+        buckets_api = self.client.buckets_api()
+        if buckets_api.find_bucket_by_name(tier.bucket) is not None:
+            return
+        retention_rules = None
+        if tier.retention_seconds:
+            retention_rules = BucketRetentionRules(type="expire", every_seconds=tier.retention_seconds)
+        buckets_api.create_bucket(
+            bucket_name=tier.bucket,
+            org_id=org_id,
+            retention_rules=retention_rules,
+            description=f"{self.source_bucket} 的 {tier.every} 降采样数据"
+        )
+        logger.info(f"已创建降采样bucket: {tier.bucket}")
+
+    def _ensure_task(self, tier, org_id):
+        tasks_api = self.client.tasks_api()
+        flux = build_rollup_flux(
+            tier.task_name, self.source_bucket, tier.bucket, self.org,
+            self.measurement, tier.every, self.offset
+        )
+        tasks = tasks_api.find_tasks(name=tier.task_name, org_id=org_id)
+        if tasks:
+            task = tasks[0]
+            if task.flux != flux or task.status != "active":
+                task = tasks_api.update_task_request(task.id, TaskUpdateRequest(flux=flux, status="active"))
+                logger.info(f"已更新降采样任务: {tier.task_name}")
+        else:
+            task = tasks_api.create_task(task_create_request=TaskCreateRequest(
+                org_id=org_id,
+                status="active",
+                flux=flux,
+                description=f"把 {self.source_bucket} 聚合为 {tier.every} 降采样数据"
+            ))
+            logger.info(f"已创建降采样任务: {tier.task_name}")
+        created_at = getattr(task, "created_at", None)
+        tier.since = created_at.timestamp() if created_at is not None else time.time()
+
+    def route(self, window_seconds, start_ts):
+        """
+        为历史查询选择降采样级别，只读取后台维护线程的检查结果
+        :param window_seconds: 查询的聚合窗口（秒）
+        :param start_ts: 查询的起始时间（Unix时间戳）
+        :return: 能满足精度的最粗级别，没有合适的级别时返回None（查询原始数据）
+        """
+        now = time.time()
+        for tier in reversed(self.tiers):
+            if not tier.ready or tier.since is None:
+                continue
+            # 聚合窗口必须是降采样间隔的整数倍
+            if window_seconds < tier.every_seconds or window_seconds % tier.every_seconds:
+                continue
+            # 任务创建之前和超过保留期的数据没有降采样结果
+            if start_ts < tier.since:
+                continue
+            if tier.retention_seconds and start_ts < now - tier.retention_seconds:
+                continue
+            return tier
+        return None
+
+    def status(self):
+        """获取各降采样级别的状态"""
+        return {
+            "last_ensure": self.last_ensure,
+            "last_error": self.last_error,
+            "tiers": [
+                {
+                    "every": tier.every,
+                    "bucket": tier.bucket,
+                    "task": tier.task_name,
+                    "ready": tier.ready,
+                    "since": tier.since
+                }
+                for tier in self.tiers
+            ]
+        }
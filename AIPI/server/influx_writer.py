@@ -1,9 +1,20 @@
+import json
 import logging
+import re
+import threading
 import time
-from datetime import datetime
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
-from config import INFLUXDB_CONFIG, LOG_CONFIG
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from influxdb_client import Point, WritePrecision
+from config import INFLUXDB_CONFIG, LOG_CONFIG, ROLLUP_CONFIG, STORAGE_CONFIG
+from influx_batch_writer import BatchingWriter, is_retryable
+from influx_connection import get_influx_connection, close_influx_connection, CircuitOpenError
+from write_spool import WriteSpool
+from line_protocol import LineProtocolSerializer
+from field_schema import FieldSchemaRegistry, parse_field_types
+from last_value_store import LastValueStore
+from influx_rollup import RollupManager, STAT_TAG
+from sqlite_store import SQLiteStore
 
 # 配置日志
 logging.basicConfig(
@@ -13,19 +24,331 @@ logging.basicConfig(
 )
 logger = logging.getLogger("influx_writer")
 
-# InfluxDB客户端初始化
-try:
-    influx_client = InfluxDBClient(
-        url=INFLUXDB_CONFIG["url"],
-        token=INFLUXDB_CONFIG["token"],
-        org=INFLUXDB_CONFIG["org"]
+# 嵌入式存储（STORAGE_BACKEND=sqlite），启用后本模块的写入和查询函数都使用本地SQLite，不连接InfluxDB
+local_store = None
+if STORAGE_CONFIG["backend"] == "sqlite":
+    try:
+        local_store = SQLiteStore(
+            STORAGE_CONFIG["sqlite_path"],
+            partition_hours=STORAGE_CONFIG["sqlite_partition_hours"],
+            retention_days=STORAGE_CONFIG["sqlite_retention_days"],
+            prune_interval=STORAGE_CONFIG["sqlite_prune_interval"],
+            synchronous=STORAGE_CONFIG["sqlite_synchronous"]
+        )
+    except Exception as e:
+        logger.error(f"SQLite时序存储初始化失败，改为使用InfluxDB: {str(e)}")
+elif STORAGE_CONFIG["backend"] != "influxdb":
+    logger.error(f"未知的存储后端: {STORAGE_CONFIG['backend']}，使用InfluxDB")
+
+def get_local_store():
+    """获取嵌入式存储，使用InfluxDB时返回None"""
+    return local_store
+
+# InfluxDB客户端初始化，与其他模块共享同一个客户端和连接池
+influx_connection = None
+influx_client = None
+write_api = None
+INFLUX_CONNECTED = False
+if local_store is None:
+    try:
+        influx_connection = get_influx_connection()
+        influx_client = influx_connection.client
+        write_api = influx_connection.write_api
+        INFLUX_CONNECTED = True
+    except Exception as e:
+        logger.error(f"InfluxDB客户端初始化失败: {str(e)}")
+        INFLUX_CONNECTED = False
+
+def get_influx_status():
+    """获取InfluxDB连接和熔断器状态，未使用InfluxDB时返回None"""
+    return influx_connection.status() if influx_connection is not None else None
+
+def _write_records(records):
+    """
+    同步写入数据点，批量写入器和磁盘缓冲重放也使用此函数
+    熔断器打开时不发送请求，直接抛出CircuitOpenError（可重试）
+    """
+    influx_connection.call(
+        write_api.write,
+        bucket=INFLUXDB_CONFIG["bucket"],
+        org=INFLUXDB_CONFIG["org"],
+        record=records
+    )
+
+def _query_stream(query):
+    """通过熔断器执行流式查询，返回记录生成器"""
+    return influx_connection.call(influx_connection.query_api.query_stream, query=query, org=INFLUXDB_CONFIG["org"])
+
+# 磁盘写入缓冲，InfluxDB不可用时暂存数据，恢复后按顺序重放
+# 导入模块时不创建缓冲，第一次需要缓冲数据时（或由run.py调用start_write_spool）才锁定槽位并启动重放线程，
+# 只查询数据的进程（API服务、告警检查等）不会占用槽位
+spool_enabled = INFLUXDB_CONFIG["spool_enabled"] and local_store is None
+write_spool = None
+_spool_start_failed = False
+_spool_lock = threading.Lock()
+
+def start_write_spool():
+    """
+    启动磁盘写入缓冲，重放目录中上次留下的数据，重复调用返回同一个实例
+    :return: WriteSpool实例，未启用、启动失败或所有槽位都被占用时返回None
+    """
+    global write_spool, _spool_start_failed
+    if write_spool is not None or not spool_enabled or _spool_start_failed:
+        return write_spool
+    with _spool_lock:
+        if write_spool is None and not _spool_start_failed:
+            spool = WriteSpool(
+                INFLUXDB_CONFIG["spool_dir"],
+                _write_records if INFLUX_CONNECTED else None,
+                segment_max_bytes=INFLUXDB_CONFIG["spool_segment_bytes"],
+                max_total_bytes=INFLUXDB_CONFIG["spool_max_bytes"],
+                fsync_interval_ms=INFLUXDB_CONFIG["spool_fsync_interval_ms"],
+                eviction=INFLUXDB_CONFIG["spool_eviction"],
+                replay_rate=INFLUXDB_CONFIG["spool_replay_rate"],
+                replay_batch_size=INFLUXDB_CONFIG["spool_replay_batch"]
+            )
+            try:
+                started = spool.start()
+            except OSError as e:
+                logger.error(f"InfluxDB写入缓冲初始化失败: {str(e)}")
+                started = False
+            if started:
+                write_spool = spool
+            else:
+                _spool_start_failed = True
+    return write_spool
+
+def _spool_on_error(records, error):
+    """
+    把写入失败的数据点转入磁盘缓冲，数据本身被拒绝（4xx）时不缓冲
+    :return: 是否已写入缓冲
+    """
+    if not is_retryable(error):
+        # 字段类型冲突时按InfluxDB中已有的类型修正注册表，之后的数据按已有类型转换
+        if field_schema is not None and field_schema.learn_from_error(str(error)):
+            logger.warning(f"已按InfluxDB中的字段类型修正字段类型注册表: {str(error)}")
+        return False
+    spool = start_write_spool()
+    if spool is None:
+        return False
+    if spool.append(records):
+        logger.warning(f"{len(records)} 个数据点已写入磁盘缓冲，InfluxDB恢复后重放")
+        return True
+    return False
+
+# 批量写入器，写入调用只入队，由后台线程攒批写入
+batch_writer = None
+if INFLUX_CONNECTED and INFLUXDB_CONFIG["batch_enabled"]:
+    batch_writer = BatchingWriter(
+        _write_records,
+        batch_size=INFLUXDB_CONFIG["batch_size"],
+        flush_interval_ms=INFLUXDB_CONFIG["flush_interval_ms"],
+        jitter_ms=INFLUXDB_CONFIG["jitter_ms"],
+        max_retries=INFLUXDB_CONFIG["max_retries"],
+        retry_interval_ms=INFLUXDB_CONFIG["retry_interval_ms"],
+        max_retry_delay_ms=INFLUXDB_CONFIG["max_retry_delay_ms"],
+        max_pending=INFLUXDB_CONFIG["max_pending"],
+        on_error=_spool_on_error
+    )
+elif local_store is not None and INFLUXDB_CONFIG["batch_enabled"]:
+    # 嵌入式存储同样攒批写入，每批一个事务
+    batch_writer = BatchingWriter(
+        local_store.write_records,
+        batch_size=INFLUXDB_CONFIG["batch_size"],
+        flush_interval_ms=INFLUXDB_CONFIG["flush_interval_ms"],
+        max_retries=INFLUXDB_CONFIG["max_retries"],
+        retry_interval_ms=INFLUXDB_CONFIG["retry_interval_ms"],
+        max_retry_delay_ms=INFLUXDB_CONFIG["max_retry_delay_ms"],
+        max_pending=INFLUXDB_CONFIG["max_pending"],
+        name="sqlite"
     )
-    write_api = influx_client.write_api(write_options=SYNCHRONOUS)
-    logger.info("InfluxDB客户端初始化成功")
-    INFLUX_CONNECTED = True
-except Exception as e:
-    logger.error(f"InfluxDB客户端初始化失败: {str(e)}")
-    INFLUX_CONNECTED = False
+
+def _enqueue(records):
+    """
+    把数据点交给批量写入器，InfluxDB未连接或写入器缓冲区已满时写入磁盘缓冲
+    :param records: 单个数据点或数据点列表
+    :return: 是否已入队或写入缓冲
+    """
+    if not isinstance(records, list):
+        records = [records]
+    if batch_writer is not None and batch_writer.write(records):
+        return True
+    spool = start_write_spool()
+    if spool is not None:
+        return spool.append(records)
+    return False
+
+def get_batch_writer():
+    """获取批量写入器，未启用批量写入时返回None"""
+    return batch_writer
+
+def get_write_metrics():
+    """
+    获取InfluxDB写入指标
+    :return: 待写入数量、写入/失败/重试计数和刷新延迟，未启用批量写入时返回None
+    """
+    if batch_writer is None:
+        return None
+    return batch_writer.get_metrics()
+
+def get_spool_metrics():
+    """
+    获取磁盘写入缓冲指标
+    :return: 缓冲大小、待重放数量和重放进度，未启用缓冲时返回None
+    """
+    if write_spool is None:
+        return None
+    return write_spool.get_metrics()
+
+# 行协议序列化器，缓存每个设备的标签前缀
+line_serializer = LineProtocolSerializer(INFLUXDB_CONFIG["measurement"])
+
+# 字段类型注册表，写入前按登记的类型转换字段值
+field_schema = None
+if INFLUXDB_CONFIG["schema_enabled"]:
+    try:
+        field_schema = FieldSchemaRegistry(
+            declared=parse_field_types(INFLUXDB_CONFIG["schema_field_types"]),
+            numeric_as_float=INFLUXDB_CONFIG["schema_numeric_as_float"],
+            allow_strings=INFLUXDB_CONFIG["schema_allow_strings"],
+            nested_mode=INFLUXDB_CONFIG["schema_nested_mode"],
+            max_depth=INFLUXDB_CONFIG["schema_max_depth"],
+            max_string_length=INFLUXDB_CONFIG["schema_max_string_length"],
+            max_fields=INFLUXDB_CONFIG["schema_max_fields"]
+        )
+    except ValueError as e:
+        logger.error(f"字段类型注册表配置无效，不检查字段类型: {str(e)}")
+
+def get_field_schema():
+    """获取字段类型注册表，未启用时返回None"""
+    return field_schema
+
+def normalize_fields(data):
+    """
+    按字段类型注册表转换设备数据中的字段
+    :param data: 设备数据字典
+    :return: 转换后的数据字典，未启用注册表时返回原数据
+    """
+    if field_schema is None:
+        return data
+    return field_schema.normalize(INFLUXDB_CONFIG["measurement"], data)
+
+# 设备最新值存储，接收数据时更新，query_latest_data优先从这里返回
+last_value_store = None
+if INFLUXDB_CONFIG["last_value_enabled"]:
+    last_value_store = LastValueStore(
+        max_devices=INFLUXDB_CONFIG["last_value_max_devices"],
+        query_ttl=INFLUXDB_CONFIG["last_value_query_ttl"]
+    )
+
+def get_last_value_store():
+    """获取设备最新值存储，未启用时返回None"""
+    return last_value_store
+
+def record_latest_data(device_id, data):
+    """
+    记录接收到的设备数据，供query_latest_data使用
+    :param device_id: 设备ID
+    :param data: 设备数据字典
+    """
+    if last_value_store is not None:
+        last_value_store.update(device_id, data)
+
+# 异步客户端（依赖aiohttp），在事件循环中首次使用时创建
+async_influx_client = None
+async_write_api = None
+
+def build_data_point(device_id, data):
+    """
+    根据设备数据构建InfluxDB数据点
+    :param device_id: 设备ID
+    :param data: 设备数据字典
+    :return: Point对象
+    """
+    data = normalize_fields(data)
+    
+    # 创建数据点
+    point = Point(INFLUXDB_CONFIG["measurement"])
+    
+    # 添加标签
+    point.tag("device_id", device_id)
+    
+    # 如果数据中包含设备类型，也添加为标签
+    if "device_type" in data:
+        point.tag("device_type", data["device_type"])
+        
+    # 如果数据中包含位置信息，添加为标签
+    if "location" in data:
+        point.tag("location", data["location"])
+        
+    # 添加字段（测量值）
+    for key, value in data.items():
+        # 跳过不作为字段的键
+        if key in ["device_id", "device_type", "location", "timestamp"]:
+            continue
+            
+        # 根据数据类型添加字段，bool是int的子类，需要先判断
+        if isinstance(value, bool):
+            point.field(key, value)
+        elif isinstance(value, (int, float)):
+            point.field(key, value)
+        else:
+            point.field(key, str(value))
+            
+    # 添加时间戳
+    timestamp = data.get("timestamp")
+    if timestamp:
+        if isinstance(timestamp, (int, float)):
+            # 将Unix时间戳转换为纳秒精度
+            point.time(int(timestamp * 1_000_000_000), WritePrecision.NS)
+        elif isinstance(timestamp, str):
+            # 尝试解析字符串时间戳
+            try:
+                dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+                point.time(int(dt.timestamp() * 1_000_000_000), WritePrecision.NS)
+            except ValueError:
+                # 使用当前时间
+                point.time(datetime.utcnow())
+    else:
+        # 使用当前时间
+        point.time(datetime.utcnow())
+        
+    return point
+
+def serialize_data_point(device_id, data):
+    """
+    把设备数据直接序列化为行协议，结果与build_data_point相同但不创建Point对象
+    :param device_id: 设备ID
+    :param data: 设备数据字典
+    :return: 行协议bytes，没有可写入的字段时返回None
+    """
+    return line_serializer.serialize(device_id, normalize_fields(data))
+
+def _write_local(records):
+    """
+    写入嵌入式存储，启用批量写入时只入队
+    :param records: [(device_id, data), ...]
+    :return: 是否写入成功
+    """
+    records = [(device_id, normalize_fields(data)) for device_id, data in records]
+    try:
+        if batch_writer is not None and batch_writer.write(records):
+            return True
+        local_store.write_records(records)
+        return True
+    except Exception as e:
+        logger.error(f"写入数据到SQLite时出错: {str(e)}")
+        return False
+
+def _write_local_event(event_type, device_id, description, severity):
+    """写入事件到嵌入式存储"""
+    try:
+        local_store.write_event(device_id, event_type, description, severity)
+        logger.info(f"成功写入事件数据到SQLite: {event_type} - {description}")
+        return True
+    except Exception as e:
+        logger.error(f"写入事件数据到SQLite时出错: {str(e)}")
+        return False
 
 def write_to_influxdb(device_id, data):
     """
@@ -34,70 +357,74 @@ def write_to_influxdb(device_id, data):
     :param data: 设备数据字典
     :return: 是否写入成功
     """
-    if not INFLUX_CONNECTED:
+    record_latest_data(device_id, data)
+    
+    if local_store is not None:
+        return _write_local([(device_id, data)])
+    
+    if not INFLUX_CONNECTED and not spool_enabled:
         logger.warning("InfluxDB未连接，无法写入数据")
         return False
     
+    point = None
     try:
-        # 创建数据点
-        point = Point(INFLUXDB_CONFIG["measurement"])
-        
-        # 添加标签
-        point.tag("device_id", device_id)
+        point = serialize_data_point(device_id, data)
+        if point is None:
+            logger.debug(f"设备 {device_id} 的数据没有可写入的字段")
+            return True
         
-        # 如果数据中包含设备类型，也添加为标签
-        if "device_type" in data:
-            point.tag("device_type", data["device_type"])
-            
-        # 如果数据中包含位置信息，添加为标签
-        if "location" in data:
-            point.tag("location", data["location"])
-            
-        # 添加字段（测量值）
-        for key, value in data.items():
-            # 跳过不作为字段的键
-            if key in ["device_id", "device_type", "location", "timestamp"]:
-                continue
-                
-            # 根据数据类型添加字段
-            if isinstance(value, (int, float)):
-                point.field(key, value)
-            elif isinstance(value, bool):
-                point.field(key, 1 if value else 0)
-            else:
-                point.field(key, str(value))
-                
-        # 添加时间戳
-        timestamp = data.get("timestamp")
-        if timestamp:
-            if isinstance(timestamp, (int, float)):
-                # 将Unix时间戳转换为纳秒精度
-                point.time(int(timestamp * 1_000_000_000), WritePrecision.NS)
-            elif isinstance(timestamp, str):
-                # 尝试解析字符串时间戳
-                try:
-                    dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                    point.time(int(dt.timestamp() * 1_000_000_000), WritePrecision.NS)
-                except ValueError:
-                    # 使用当前时间
-                    point.time(datetime.utcnow())
-        else:
-            # 使用当前时间
-            point.time(datetime.utcnow())
+        # 启用批量写入时只入队，InfluxDB未连接时写入磁盘缓冲
+        if batch_writer is not None or not INFLUX_CONNECTED:
+            return _enqueue(point)
             
         # 写入数据
-        write_api.write(
-            bucket=INFLUXDB_CONFIG["bucket"],
-            org=INFLUXDB_CONFIG["org"],
-            record=point
-        )
+        _write_records(point)
         
         logger.debug(f"成功写入设备 {device_id} 数据到InfluxDB")
         return True
         
     except Exception as e:
         logger.error(f"写入数据到InfluxDB时出错: {str(e)}")
+        return point is not None and _spool_on_error([point], e)
+
+def write_batch_to_influxdb(records):
+    """
+    批量写入多个设备数据，一次请求写入全部数据点
+    :param records: [(device_id, data), ...]
+    :return: 是否写入成功
+    """
+    if not records:
+        return True
+        
+    for device_id, data in records:
+        record_latest_data(device_id, data)
+    
+    if local_store is not None:
+        return _write_local(records)
+        
+    if not INFLUX_CONNECTED and not spool_enabled:
+        logger.warning("InfluxDB未连接，无法写入数据")
         return False
+    
+    points = None
+    try:
+        points = [serialize_data_point(device_id, data) for device_id, data in records]
+        points = [point for point in points if point is not None]
+        if not points:
+            return True
+        
+        if batch_writer is not None or not INFLUX_CONNECTED:
+            return _enqueue(points)
+        
+        # 一次写入所有数据点
+        _write_records(points)
+        
+        logger.debug(f"成功批量写入 {len(points)} 条数据到InfluxDB")
+        return True
+        
+    except Exception as e:
+        logger.error(f"批量写入数据到InfluxDB时出错: {str(e)}")
+        return points is not None and _spool_on_error(points, e)
 
 def write_event_to_influxdb(event_type, device_id, description, severity="info"):
     """
@@ -108,53 +435,284 @@ def write_event_to_influxdb(event_type, device_id, description, severity="info")
     :param severity: 事件严重性
     :return: 是否写入成功
     """
-    if not INFLUX_CONNECTED:
+    if local_store is not None:
+        return _write_local_event(event_type, device_id, description, severity)
+    
+    if not INFLUX_CONNECTED and not spool_enabled:
         logger.warning("InfluxDB未连接，无法写入事件数据")
         return False
     
+    point = None
     try:
-        # 创建事件数据点
-        point = Point("events")
+        point = build_event_point(event_type, device_id, description, severity)
         
-        # 添加标签
-        point.tag("device_id", device_id)
-        point.tag("event_type", event_type)
-        point.tag("severity", severity)
+        if batch_writer is not None or not INFLUX_CONNECTED:
+            logger.info(f"事件数据已提交写入InfluxDB: {event_type} - {description}")
+            return _enqueue(point)
         
-        # 添加字段
-        point.field("description", description)
+        # 写入数据
+        _write_records(point)
         
-        # 使用当前时间
-        point.time(datetime.utcnow())
+        logger.info(f"成功写入事件数据到InfluxDB: {event_type} - {description}")
+        return True
         
-        # 写入数据
-        write_api.write(
+    except Exception as e:
+        logger.error(f"写入事件数据到InfluxDB时出错: {str(e)}")
+        return point is not None and _spool_on_error([point], e)
+
+def build_event_point(event_type, device_id, description, severity="info"):
+    """
+    构建事件数据点
+    :param event_type: 事件类型
+    :param device_id: 设备ID
+    :param description: 事件描述
+    :param severity: 事件严重性
+    :return: Point对象
+    """
+    # 创建事件数据点
+    point = Point("events")
+    
+    # 添加标签
+    point.tag("device_id", device_id)
+    point.tag("event_type", event_type)
+    point.tag("severity", severity)
+    
+    # 添加字段
+    point.field("description", description)
+    
+    # 使用当前时间
+    point.time(datetime.utcnow())
+    
+    return point
+
+def build_record_point(measurement, device_id, fields, tags=None, timestamp=None):
+    """
+    构建命令结果、告警等记录的数据点
+    :param measurement: measurement名称
+    :param device_id: 设备ID
+    :param fields: 字段字典，列表和字典按JSON字符串写入，None跳过
+    :param tags: 额外的标签
+    :param timestamp: Unix时间戳（秒），为空时使用当前时间
+    :return: Point对象
+    """
+    point = Point(measurement)
+    point.tag("device_id", device_id)
+    for key, value in (tags or {}).items():
+        if value is not None and value != "":
+            point.tag(key, str(value))
+    for key, value in fields.items():
+        if value is None:
+            continue
+        if not isinstance(value, (bool, int, float, str)):
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        point.field(key, value)
+    point.time(int((timestamp or time.time()) * 1_000_000_000), WritePrecision.NS)
+    return point
+
+def write_record_to_influxdb(measurement, device_id, fields, tags=None):
+    """
+    写入命令结果、告警等记录，与设备数据共用批量写入器和磁盘缓冲
+    :param measurement: measurement名称，例如 command_results、alerts
+    :param device_id: 设备ID
+    :param fields: 字段字典
+    :param tags: 额外的标签
+    :return: 是否写入成功
+    """
+    if local_store is not None:
+        try:
+            local_store.write_record(measurement, device_id, tags or {}, fields)
+            return True
+        except Exception as e:
+            logger.error(f"写入{measurement}记录到SQLite时出错: {str(e)}")
+            return False
+    
+    if not INFLUX_CONNECTED and not spool_enabled:
+        logger.warning(f"InfluxDB未连接，无法写入{measurement}记录")
+        return False
+    
+    point = None
+    try:
+        point = build_record_point(measurement, device_id, fields, tags)
+        
+        if batch_writer is not None or not INFLUX_CONNECTED:
+            return _enqueue(point)
+        
+        _write_records(point)
+        logger.debug(f"成功写入设备 {device_id} 的{measurement}记录到InfluxDB")
+        return True
+        
+    except Exception as e:
+        logger.error(f"写入{measurement}记录到InfluxDB时出错: {str(e)}")
+        return point is not None and _spool_on_error([point], e)
+
+def get_async_write_api():
+    """
+    获取异步写入API，必须在事件循环中调用
+    :return: WriteApiAsync对象
+    """
+    global async_influx_client, async_write_api
+    if async_write_api is None:
+        from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+        async_influx_client = InfluxDBClientAsync(
+            url=INFLUXDB_CONFIG["url"],
+            token=INFLUXDB_CONFIG["token"],
+            org=INFLUXDB_CONFIG["org"],
+            timeout=INFLUXDB_CONFIG["read_timeout_ms"],
+            enable_gzip=INFLUXDB_CONFIG["enable_gzip"]
+        )
+        async_write_api = async_influx_client.write_api()
+        logger.info("InfluxDB异步客户端初始化成功")
+    return async_write_api
+
+async def _write_records_async(records):
+    """异步写入数据点，与同步写入共用熔断器"""
+    breaker = influx_connection.breaker
+    if not breaker.allow():
+        raise CircuitOpenError("InfluxDB熔断器已打开，请求未发送")
+    try:
+        await get_async_write_api().write(
             bucket=INFLUXDB_CONFIG["bucket"],
             org=INFLUXDB_CONFIG["org"],
-            record=point
+            record=records
         )
+    except Exception as e:
+        if is_retryable(e):
+            breaker.record_failure(e)
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+
+async def write_to_influxdb_async(device_id, data):
+    """
+    异步写入设备数据到InfluxDB，等待写入时不占用线程
+    :param device_id: 设备ID
+    :param data: 设备数据字典
+    :return: 是否写入成功
+    """
+    record_latest_data(device_id, data)
+    
+    # SQLite写入是本地操作，启用批量写入时只入队
+    if local_store is not None:
+        return _write_local([(device_id, data)])
+    
+    if not INFLUX_CONNECTED and not spool_enabled:
+        logger.warning("InfluxDB未连接，无法写入数据")
+        return False
+    
+    point = None
+    try:
+        point = serialize_data_point(device_id, data)
+        if point is None:
+            logger.debug(f"设备 {device_id} 的数据没有可写入的字段")
+            return True
         
-        logger.info(f"成功写入事件数据到InfluxDB: {event_type} - {description}")
+        # 批量写入器入队和写入磁盘缓冲都不阻塞，不需要异步客户端
+        if batch_writer is not None or not INFLUX_CONNECTED:
+            return _enqueue(point)
+            
+        await _write_records_async(point)
+        
+        logger.debug(f"成功异步写入设备 {device_id} 数据到InfluxDB")
         return True
         
     except Exception as e:
-        logger.error(f"写入事件数据到InfluxDB时出错: {str(e)}")
+        logger.error(f"异步写入数据到InfluxDB时出错: {str(e)}")
+        return point is not None and _spool_on_error([point], e)
+
+async def write_event_to_influxdb_async(event_type, device_id, description, severity="info"):
+    """
+    异步写入事件数据到InfluxDB
+    :param event_type: 事件类型
+    :param device_id: 设备ID
+    :param description: 事件描述
+    :param severity: 事件严重性
+    :return: 是否写入成功
+    """
+    if local_store is not None:
+        return _write_local_event(event_type, device_id, description, severity)
+    
+    if not INFLUX_CONNECTED and not spool_enabled:
+        logger.warning("InfluxDB未连接，无法写入事件数据")
         return False
+    
+    point = None
+    try:
+        point = build_event_point(event_type, device_id, description, severity)
+        
+        if batch_writer is not None or not INFLUX_CONNECTED:
+            logger.info(f"事件数据已提交写入InfluxDB: {event_type} - {description}")
+            return _enqueue(point)
+            
+        await _write_records_async(point)
+        
+        logger.info(f"成功异步写入事件数据到InfluxDB: {event_type} - {description}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"异步写入事件数据到InfluxDB时出错: {str(e)}")
+        return point is not None and _spool_on_error([point], e)
+
+async def close_async_connection():
+    """关闭InfluxDB异步客户端"""
+    global async_influx_client, async_write_api
+    if async_influx_client is not None:
+        await async_influx_client.close()
+        async_influx_client = None
+        async_write_api = None
+        logger.info("InfluxDB异步连接已关闭")
+
+# Flux时长单位对应的秒数
+_DURATION_UNITS = {
+    "ns": 1e-9, "us": 1e-6, "µs": 1e-6, "ms": 1e-3, "s": 1,
+    "m": 60, "h": 3600, "d": 86400, "w": 604800, "mo": 2592000, "y": 31536000
+}
+_DURATION_PATTERN = re.compile(r"(\d+)(ns|us|µs|ms|mo|s|m|h|d|w|y)")
+
+def parse_flux_duration(duration):
+    """
+    把Flux时长转换为秒数
+    :param duration: 例如 10m、1h、1h30m
+    :return: 秒数，格式无效时返回None
+    """
+    text = str(duration).strip()
+    parts = _DURATION_PATTERN.findall(text)
+    if not parts or "".join(number + unit for number, unit in parts) != text:
+        return None
+    return sum(int(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+def _since_ns(time_range):
+    """把时间范围转换为起始纳秒时间戳，格式无效时不限制"""
+    seconds = parse_flux_duration(time_range)
+    return time.time_ns() - int(seconds * 1_000_000_000) if seconds else 0
 
 def query_latest_data(device_id, fields=None, time_range="1h"):
     """
     查询设备最新数据
+    优先从最新值存储返回，本进程没有该设备时间范围内的数据时才查询InfluxDB
     :param device_id: 设备ID
     :param fields: 要查询的字段列表
     :param time_range: 时间范围（例如：1h, 1d）
     :return: 查询结果
     """
+    if last_value_store is not None:
+        data = last_value_store.get(device_id, fields, parse_flux_duration(time_range))
+        if data is not None:
+            return data
+    
+    if local_store is not None:
+        try:
+            values = local_store.query_latest(device_id, since_ns=_since_ns(time_range))
+        except Exception as e:
+            logger.error(f"查询SQLite数据时出错: {str(e)}")
+            return None
+        return _latest_from_values(device_id, values, fields) if values else {}
+    
     if not INFLUX_CONNECTED:
         logger.warning("InfluxDB未连接，无法查询数据")
         return None
     
     try:
-        query_api = influx_client.query_api()
         
         fields_clause = "*"
         if fields:
@@ -168,15 +726,21 @@ def query_latest_data(device_id, fields=None, time_range="1h"):
             |> last()
         '''
         
-        result = query_api.query(org=INFLUXDB_CONFIG["org"], query=query)
+        result = influx_connection.call(influx_connection.query_api.query, query=query, org=INFLUXDB_CONFIG["org"])
         
         # 处理结果
         data = {}
+        values = {}
         for table in result:
             for record in table.records:
                 field = record.get_field()
                 value = record.get_value()
                 data[field] = value
+                values[field] = (value, record.get_time().timestamp())
+        
+        # 记录查询结果，有效期内的重复查询不再访问InfluxDB
+        if last_value_store is not None and values:
+            last_value_store.seed(device_id, values)
                 
         return data
         
@@ -184,11 +748,568 @@ def query_latest_data(device_id, fields=None, time_range="1h"):
         logger.error(f"查询InfluxDB数据时出错: {str(e)}")
         return None
 
+def flux_string(value):
+    """把值转换为Flux字符串字面量"""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def build_latest_query(time_range, device_ids=None):
+    """
+    构建按设备分组的最新值查询
+    :param time_range: 时间范围（例如：10m）
+    :param device_ids: 设备ID列表，为None时查询时间范围内的所有设备
+    :return: Flux查询语句，结果每个设备一张表
+    """
+    device_filter = ""
+    if device_ids is not None:
+        device_set = ", ".join(flux_string(device_id) for device_id in device_ids)
+        device_filter = f"""
+            |> filter(fn: (r) => contains(value: r["device_id"], set: [{device_set}]))"""
+    return f'''
+        from(bucket: "{INFLUXDB_CONFIG["bucket"]}")
+            |> range(start: -{time_range})
+            |> filter(fn: (r) => r["_measurement"] == "{INFLUXDB_CONFIG["measurement"]}"){device_filter}
+            |> last()
+            |> group(columns: ["device_id"])
+        '''
+
+def _stream_latest(query):
+    """
+    执行最新值查询，按设备逐个产出结果
+    :param query: build_latest_query生成的查询
+    :return: 生成器，产出 (device_id, {字段名: (值, 时间戳秒)})
+    """
+    records = _query_stream(query)
+    current_id = None
+    values = {}
+    for record in records:
+        device_id = record.values.get("device_id")
+        if device_id != current_id:
+            if values:
+                yield current_id, values
+            current_id = device_id
+            values = {}
+        values[record.get_field()] = (record.get_value(), record.get_time().timestamp())
+    if values:
+        yield current_id, values
+
+def _latest_from_values(device_id, values, fields):
+    """记录查询结果并转换为 {字段名: 值}"""
+    if last_value_store is not None:
+        last_value_store.seed(device_id, values)
+    return {field: value for field, (value, _) in values.items() if not fields or field in fields}
+
+def query_latest_data_batch(device_ids=None, fields=None, time_range="1h", shard_size=500, max_workers=4):
+    """
+    批量查询多个设备的最新数据
+    最新值存储中有数据的设备直接返回，其余设备按分片合并为少量Flux查询并发执行，
+    结果按设备逐个产出，调用方可以边接收边处理
+    :param device_ids: 设备ID列表，为None时查询时间范围内上报过数据的所有设备
+    :param fields: 要返回的字段列表，为空时返回全部字段
+    :param time_range: 时间范围（例如：10m, 1h）
+    :param shard_size: 每个查询包含的设备数
+    :param max_workers: 并发查询数
+    :return: 生成器，产出 (device_id, 数据字典)；没有数据或查询失败的设备不产出
+    """
+    pending = None
+    if device_ids is not None:
+        pending = []
+        max_age = parse_flux_duration(time_range)
+        for device_id in dict.fromkeys(device_ids):
+            data = last_value_store.get(device_id, fields, max_age) if last_value_store is not None else None
+            if data is not None:
+                yield device_id, data
+            else:
+                pending.append(device_id)
+        if not pending:
+            return
+    
+    if local_store is not None:
+        try:
+            for device_id, values in local_store.query_latest_batch(pending, since_ns=_since_ns(time_range)):
+                yield device_id, _latest_from_values(device_id, values, fields)
+        except Exception as e:
+            logger.error(f"批量查询SQLite数据时出错: {str(e)}")
+        return
+    
+    if not INFLUX_CONNECTED:
+        logger.warning("InfluxDB未连接，无法查询数据")
+        return
+    
+    if pending is None:
+        # 全部设备一次查询，流式读取结果
+        try:
+            for device_id, values in _stream_latest(build_latest_query(time_range)):
+                yield device_id, _latest_from_values(device_id, values, fields)
+        except Exception as e:
+            logger.error(f"批量查询InfluxDB数据时出错: {str(e)}")
+        return
+    
+    shard_size = max(1, int(shard_size))
+    shards = [pending[i:i + shard_size] for i in range(0, len(pending), shard_size)]
+    logger.debug(f"批量查询 {len(pending)} 个设备的最新数据，分为 {len(shards)} 个查询")
+    
+    def run_shard(shard):
+        return list(_stream_latest(build_latest_query(time_range, shard)))
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(shards)))) as executor:
+        futures = {executor.submit(run_shard, shard): shard for shard in shards}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                logger.error(f"批量查询 {len(futures[future])} 个设备的最新数据时出错: {str(e)}")
+                continue
+            for device_id, values in results:
+                yield device_id, _latest_from_values(device_id, values, fields)
+
+# 历史查询支持的聚合函数
+HISTORY_FUNCTIONS = ("mean", "max", "min", "last")
+
+# 自动选择的聚合窗口（秒），从小到大
+HISTORY_WINDOWS = (
+    (1, "1s"), (5, "5s"), (10, "10s"), (30, "30s"),
+    (60, "1m"), (300, "5m"), (600, "10m"), (900, "15m"), (1800, "30m"),
+    (3600, "1h"), (7200, "2h"), (21600, "6h"), (43200, "12h"),
+    (86400, "1d"), (604800, "7d"), (2592000, "30d")
+)
+
+def parse_time_bound(value, default=None):
+    """
+    解析历史查询的起止时间
+    :param value: 相对时长（-1h或1h，表示1小时前）、now、Unix时间戳（秒）或ISO 8601时间
+    :param default: value为空时使用的值
+    :return: (Flux时间表达式, Unix时间戳秒)
+    :raises ValueError: 格式无效
+    """
+    if value is None or value == "":
+        value = default
+    text = str(value).strip()
+    now = time.time()
+    if text == "now":
+        return "now()", now
+    
+    seconds = parse_flux_duration(text.lstrip("-"))
+    if seconds is not None:
+        return f"-{text.lstrip('-')}", now - seconds
+    
+    try:
+        timestamp = float(text)
+    except ValueError:
+        try:
+            dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError(f"无效的时间: {value}")
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        timestamp = dt.timestamp()
+    
+    dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), timestamp
+
+def choose_window(range_seconds, max_points, every=None):
+    """
+    选择聚合窗口，使每个字段的点数不超过上限
+    :param range_seconds: 查询的时间范围（秒）
+    :param max_points: 每个字段的点数上限
+    :param every: 请求指定的窗口，点数超过上限时会被放大
+    :return: (Flux时长, 秒数)
+    :raises ValueError: every格式无效
+    """
+    min_seconds = range_seconds / max(1, max_points)
+    if every:
+        every_seconds = parse_flux_duration(every)
+        if not every_seconds:
+            raise ValueError(f"无效的聚合窗口: {every}")
+        if every_seconds >= min_seconds:
+            return every, every_seconds
+    for seconds, duration in HISTORY_WINDOWS:
+        if seconds >= min_seconds:
+            return duration, seconds
+    # 超过最大的预设窗口时按天数取整
+    days = int(min_seconds // 86400) + 1
+    return f"{days}d", days * 86400
+
+# 降采样管理器，首次查询历史数据时创建并启动后台维护线程，维护完成前的查询读取原始数据
+rollup_manager = None
+_rollup_lock = threading.Lock()
+
+def get_rollup_manager():
+    """获取降采样管理器，未启用降采样或InfluxDB未连接时返回None"""
+    global rollup_manager
+    if rollup_manager is not None or not ROLLUP_CONFIG["enabled"] or not INFLUX_CONNECTED:
+        return rollup_manager
+    with _rollup_lock:
+        if rollup_manager is not None:
+            return rollup_manager
+        manager = RollupManager(
+            influx_client,
+            INFLUXDB_CONFIG["org"],
+            INFLUXDB_CONFIG["bucket"],
+            INFLUXDB_CONFIG["measurement"],
+            ROLLUP_CONFIG["tiers"],
+            parse_flux_duration,
+            task_prefix=ROLLUP_CONFIG["task_prefix"],
+            offset=ROLLUP_CONFIG["offset"],
+            maintain_interval=ROLLUP_CONFIG["maintain_interval"]
+        )
+        manager.start()
+        rollup_manager = manager
+    return rollup_manager
+
+def ensure_rollups():
+    """
+    创建或更新降采样bucket和任务
+    :return: 是否全部就绪，未启用降采样时返回False
+    """
+    manager = get_rollup_manager()
+    if manager is None:
+        return False
+    try:
+        return manager.ensure()
+    except Exception as e:
+        logger.error(f"创建降采样任务时出错: {str(e)}")
+        return False
+
+def route_history_bucket(every_seconds, start_ts):
+    """
+    为历史查询选择数据来源
+    :param every_seconds: 聚合窗口（秒）
+    :param start_ts: 起始时间（Unix时间戳）
+    :return: 能满足精度的最粗降采样bucket，应查询原始数据时返回None
+    """
+    manager = get_rollup_manager()
+    if manager is None:
+        return None
+    tier = manager.route(every_seconds, start_ts)
+    return tier.bucket if tier is not None else None
+
+def build_rollup_mean(every):
+    """
+    从降采样数据计算按count加权的mean：每个窗口 sum(mean×count) / sum(count)
+    降采样点的时间是其窗口的起始时间，结果的时间取窗口结束时间，与aggregateWindow一致
+    :param every: 聚合窗口
+    :return: Flux管道片段，输入为降采样数据，输出每个窗口一行_value
+    """
+    return f"""
+            |> filter(fn: (r) => r[{flux_string(STAT_TAG)}] == "mean" or r[{flux_string(STAT_TAG)}] == "count")
+            |> pivot(rowKey: ["_time"], columnKey: [{flux_string(STAT_TAG)}], valueColumn: "_value")
+            |> filter(fn: (r) => exists r.mean and exists r.count)
+            |> window(every: {every}, createEmpty: false)
+            |> reduce(
+                fn: (r, accumulator) => ({{
+                    total: accumulator.total + float(v: r.mean) * float(v: r.count),
+                    count: accumulator.count + float(v: r.count)
+                }}),
+                identity: {{total: 0.0, count: 0.0}}
+            )
+            |> map(fn: (r) => ({{r with _time: r._stop, _value: r.total / r.count}}))
+            |> drop(columns: ["total", "count"])"""
+
+def build_history_query(device_id, start, stop, every, fn="mean", fields=None, bucket=None, rollup=False):
+    """
+    构建设备历史数据的聚合查询
+    :param device_id: 设备ID
+    :param start: 起始时间的Flux表达式
+    :param stop: 结束时间的Flux表达式
+    :param every: 聚合窗口
+    :param fn: 聚合函数
+    :param fields: 字段列表，为空时查询全部数值字段
+    :param bucket: 查询的bucket，为空时使用原始数据bucket
+    :param rollup: bucket是否为降采样bucket，是时mean按count加权，max/min/last读取同一聚合方式的降采样数据再聚合
+    :return: Flux查询语句
+    """
+    field_filter = ""
+    aggregate = f"""
+            |> aggregateWindow(every: {every}, fn: {fn}, createEmpty: false)"""
+    if rollup and fn == "mean":
+        aggregate = build_rollup_mean(every) + """
+            |> group(columns: ["_field"])
+            |> sort(columns: ["_time"])"""
+    elif rollup:
+        # 降采样数据的max/min/last按窗口再做一次同样的聚合
+        field_filter += f"""
+            |> filter(fn: (r) => r[{flux_string(STAT_TAG)}] == {flux_string(fn)})"""
+    if fields:
+        condition = " or ".join(f'r["_field"] == {flux_string(field)}' for field in fields)
+        field_filter += f"""
+            |> filter(fn: (r) => {condition})"""
+    
+    type_filter = ""
+    header = ""
+    if fn != "last" and not rollup:
+        # mean/max/min只能作用于数值字段
+        header = 'import "types"\n'
+        type_filter = """
+            |> filter(fn: (r) => types.isType(v: r._value, type: "float") or types.isType(v: r._value, type: "int") or types.isType(v: r._value, type: "uint"))"""
+    
+    return f'''{header}
+        from(bucket: {flux_string(bucket or INFLUXDB_CONFIG["bucket"])})
+            |> range(start: {start}, stop: {stop})
+            |> filter(fn: (r) => r["_measurement"] == {flux_string(INFLUXDB_CONFIG["measurement"])})
+            |> filter(fn: (r) => r["device_id"] == {flux_string(device_id)}){field_filter}{type_filter}{aggregate}
+            |> keep(columns: ["_time", "_field", "_value"])
+        '''
+
+def query_history(device_id, start="-1h", stop="now", every=None, fn="mean", fields=None, max_points=None):
+    """
+    查询设备历史数据，按时间窗口在InfluxDB中聚合后返回
+    聚合窗口是降采样间隔的整数倍时读取最粗的可用降采样数据，否则读取原始数据
+    :param device_id: 设备ID
+    :param start: 起始时间，相对时长（-1h）、Unix时间戳或ISO 8601时间
+    :param stop: 结束时间，格式同start
+    :param every: 聚合窗口（例如：1m），为空或点数超过上限时自动选择
+    :param fn: 聚合函数，mean/max/min/last
+    :param fields: 字段列表，为空时查询全部字段
+    :param max_points: 每个字段的点数上限，为空时使用配置的默认值
+    :return: {"device_id", "start", "stop", "every", "fn", "source", "series": {字段名: [[毫秒时间戳, 值], ...]}}，
+             InfluxDB未连接时返回None
+    :raises ValueError: 参数无效
+    """
+    if fn not in HISTORY_FUNCTIONS:
+        raise ValueError(f"不支持的聚合函数: {fn}，可选: {', '.join(HISTORY_FUNCTIONS)}")
+    
+    max_points = min(
+        int(max_points or INFLUXDB_CONFIG["history_max_points"]),
+        INFLUXDB_CONFIG["history_points_limit"]
+    )
+    start_expr, start_ts = parse_time_bound(start, "-1h")
+    stop_expr, stop_ts = parse_time_bound(stop, "now")
+    if stop_ts <= start_ts:
+        raise ValueError("结束时间必须晚于起始时间")
+    every, every_seconds = choose_window(stop_ts - start_ts, max_points, every)
+    
+    if local_store is not None:
+        source = "sqlite"
+        series = local_store.query_history(
+            device_id, int(start_ts * 1e9), int(stop_ts * 1e9), int(every_seconds * 1e9), fn, fields
+        )
+    else:
+        if not INFLUX_CONNECTED:
+            logger.warning("InfluxDB未连接，无法查询历史数据")
+            return None
+        
+        rollup_bucket = route_history_bucket(every_seconds, start_ts)
+        source = rollup_bucket or INFLUXDB_CONFIG["bucket"]
+        query = build_history_query(
+            device_id, start_expr, stop_expr, every, fn, fields,
+            bucket=rollup_bucket, rollup=rollup_bucket is not None
+        )
+        records = _query_stream(query)
+        
+        series = {}
+        for record in records:
+            points = series.get(record.get_field())
+            if points is None:
+                points = series[record.get_field()] = []
+            points.append([int(record.get_time().timestamp() * 1000), record.get_value()])
+    
+    return {
+        "device_id": device_id,
+        "start": start_ts,
+        "stop": stop_ts,
+        "every": every,
+        "fn": fn,
+        "source": source,
+        "series": series
+    }
+
+def build_frame_query(start, stop, every, fields=None, device_ids=None, bucket=None, rollup=False):
+    """
+    构建列式查询：按设备聚合到every精度后把字段转为列，所有设备合并为一张表
+    :param start: 起始时间的Flux表达式
+    :param stop: 结束时间的Flux表达式
+    :param every: 每个设备的聚合精度
+    :param fields: 字段列表，为空时查询全部数值字段
+    :param device_ids: 设备ID列表，为空时查询全部设备
+    :param bucket: 查询的bucket，为空时使用原始数据bucket
+    :param rollup: bucket是否为降采样bucket，是时使用按count加权的mean
+    :return: Flux查询语句
+    """
+    filters = ""
+    aggregate = f"""
+            |> aggregateWindow(every: {every}, fn: mean, createEmpty: false)"""
+    if rollup:
+        aggregate = build_rollup_mean(every)
+    if fields:
+        condition = " or ".join(f'r["_field"] == {flux_string(field)}' for field in fields)
+        filters += f"""
+            |> filter(fn: (r) => {condition})"""
+    if device_ids:
+        device_set = ", ".join(flux_string(device_id) for device_id in device_ids)
+        filters += f"""
+            |> filter(fn: (r) => contains(value: r["device_id"], set: [{device_set}]))"""
+    
+    return f'''import "types"
+
+        from(bucket: {flux_string(bucket or INFLUXDB_CONFIG["bucket"])})
+            |> range(start: {start}, stop: {stop})
+            |> filter(fn: (r) => r["_measurement"] == {flux_string(INFLUXDB_CONFIG["measurement"])}){filters}
+            |> filter(fn: (r) => types.isType(v: r._value, type: "float") or types.isType(v: r._value, type: "int") or types.isType(v: r._value, type: "uint")){aggregate}
+            |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+            |> drop(columns: ["_start", "_stop", "_measurement", "{STAT_TAG}"])
+            |> group()
+        '''
+
+def query_frame(start="-1h", stop="now", fields=None, device_ids=None, every=None, max_points=None):
+    """
+    列式查询多个设备的数据，返回pandas DataFrame，供向量化分析使用
+    每个设备先在InfluxDB中按every聚合（为空时按点数上限自动选择，可使用降采样数据），
+    再把字段转为列，返回的行数为 设备数 × 时间窗口数
+    :param start: 起始时间，相对时长（-1h）、Unix时间戳或ISO 8601时间
+    :param stop: 结束时间，格式同start
+    :param fields: 字段列表，为空时查询全部数值字段
+    :param device_ids: 设备ID列表，为空时查询全部设备
+    :param every: 每个设备的聚合精度
+    :param max_points: 每个设备的点数上限，为空时使用配置的默认值
+    :return: DataFrame，列为 _time、device_id、location等标签和各字段；没有数据时为空DataFrame
+    :raises ValueError: 参数无效
+    :raises ConnectionError: InfluxDB未连接
+    """
+    import pandas as pd
+    
+    max_points = min(
+        int(max_points or INFLUXDB_CONFIG["history_max_points"]),
+        INFLUXDB_CONFIG["history_points_limit"]
+    )
+    start_expr, start_ts = parse_time_bound(start, "-1h")
+    stop_expr, stop_ts = parse_time_bound(stop, "now")
+    if stop_ts <= start_ts:
+        raise ValueError("结束时间必须晚于起始时间")
+    every, every_seconds = choose_window(stop_ts - start_ts, max_points, every)
+    if local_store is not None:
+        return local_store.query_frame(
+            int(start_ts * 1e9), int(stop_ts * 1e9), int(every_seconds * 1e9), fields, device_ids
+        )
+    if not INFLUX_CONNECTED:
+        raise ConnectionError("InfluxDB未连接")
+    
+    rollup_bucket = route_history_bucket(every_seconds, start_ts)
+    query = build_frame_query(
+        start_expr, stop_expr, every, fields, device_ids,
+        bucket=rollup_bucket, rollup=rollup_bucket is not None
+    )
+    frames = influx_connection.call(
+        influx_connection.query_api.query_data_frame, query=query, org=INFLUXDB_CONFIG["org"]
+    )
+    # 结果包含多种表结构时返回多个DataFrame
+    if isinstance(frames, list):
+        frames = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return frames.drop(columns=["result", "table"], errors="ignore")
+
+def stream_device_data(device_id, start="-1h", stop="now", fields=None, measurement=None):
+    """
+    流式查询设备原始数据，边从InfluxDB读取边产出，内存占用与时间范围无关
+    :param device_id: 设备ID
+    :param start: 起始时间，相对时长（-1h）、Unix时间戳或ISO 8601时间
+    :param stop: 结束时间，格式同start
+    :param fields: 字段列表，为空时导出全部字段
+    :param measurement: measurement名称，为空时使用设备数据的measurement
+    :return: 生成器，产出 (datetime时间, 字段名, 值)
+    :raises ValueError: 参数无效
+    """
+    start_expr, start_ts = parse_time_bound(start, "-1h")
+    stop_expr, stop_ts = parse_time_bound(stop, "now")
+    if stop_ts <= start_ts:
+        raise ValueError("结束时间必须晚于起始时间")
+    if local_store is not None:
+        if measurement == "events":
+            yield from local_store.stream_events(device_id, int(start_ts * 1e9), int(stop_ts * 1e9))
+        else:
+            yield from local_store.stream(device_id, int(start_ts * 1e9), int(stop_ts * 1e9), fields)
+        return
+    if not INFLUX_CONNECTED:
+        raise ConnectionError("InfluxDB未连接")
+    
+    field_filter = ""
+    if fields:
+        condition = " or ".join(f'r["_field"] == {flux_string(field)}' for field in fields)
+        field_filter = f"""
+            |> filter(fn: (r) => {condition})"""
+    
+    query = f'''
+        from(bucket: {flux_string(INFLUXDB_CONFIG["bucket"])})
+            |> range(start: {start_expr}, stop: {stop_expr})
+            |> filter(fn: (r) => r["_measurement"] == {flux_string(measurement or INFLUXDB_CONFIG["measurement"])})
+            |> filter(fn: (r) => r["device_id"] == {flux_string(device_id)}){field_filter}
+            |> keep(columns: ["_time", "_field", "_value"])
+        '''
+    
+    for record in _query_stream(query):
+        yield record.get_time(), record.get_field(), record.get_value()
+
+# 查询记录时去掉的InfluxDB内部列
+_RECORD_INTERNAL_COLUMNS = frozenset(("result", "table", "_start", "_stop", "_measurement", "_time"))
+
+def build_records_query(measurement, device_id, start, limit):
+    """
+    构建最近记录查询：每个序列先取最后limit个点，再按时间把字段合并为一行，全部序列合并后取最新的limit行
+    同一时间写入的字段属于同一条记录，最新的limit条记录一定在每个序列的最后limit个点之中
+    :param measurement: measurement名称
+    :param device_id: 设备ID
+    :param start: 起始时间的Flux表达式
+    :param limit: 记录数
+    :return: Flux查询语句
+    """
+    return f'''
+        from(bucket: {flux_string(INFLUXDB_CONFIG["bucket"])})
+            |> range(start: {start})
+            |> filter(fn: (r) => r["_measurement"] == {flux_string(measurement)})
+            |> filter(fn: (r) => r["device_id"] == {flux_string(device_id)})
+            |> tail(n: {limit})
+            |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+            |> group()
+            |> sort(columns: ["_time"], desc: true)
+            |> limit(n: {limit})
+        '''
+
+def query_records(measurement, device_id, start="-1h", limit=100):
+    """
+    查询设备最近的记录，时间范围和条数限制在InfluxDB中执行
+    :param measurement: measurement名称，device_data表示设备数据
+    :param device_id: 设备ID
+    :param start: 起始时间，相对时长（-1h）、Unix时间戳或ISO 8601时间
+    :param limit: 最多返回的记录数
+    :return: 记录列表，按时间从新到旧，每条记录包含time（ISO 8601）、标签和字段
+    :raises ValueError: 参数无效
+    :raises ConnectionError: InfluxDB未连接
+    """
+    limit = int(limit)
+    if limit <= 0:
+        raise ValueError("limit必须大于0")
+    limit = min(limit, INFLUXDB_CONFIG["history_points_limit"])
+    if measurement in (None, "", "device_data"):
+        measurement = INFLUXDB_CONFIG["measurement"]
+    start_expr, start_ts = parse_time_bound(start, "-1h")
+    
+    if local_store is not None:
+        start_ns = int(start_ts * 1e9)
+        if measurement == INFLUXDB_CONFIG["measurement"]:
+            return local_store.query_recent(device_id, start_ns, limit)
+        return local_store.query_records(measurement, device_id, start_ns, limit)
+    if not INFLUX_CONNECTED:
+        raise ConnectionError("InfluxDB未连接")
+    
+    records = []
+    for record in _query_stream(build_records_query(measurement, device_id, start_expr, limit)):
+        row = {"time": record.get_time().isoformat()}
+        for key, value in record.values.items():
+            if key not in _RECORD_INTERNAL_COLUMNS and value is not None:
+                row[key] = value
+        records.append(row)
+    return records
+
 def close_connection():
-    """关闭InfluxDB连接"""
+    """关闭InfluxDB连接，先写完批量写入器中的数据，写不进去的数据留在磁盘缓冲中"""
+    if batch_writer is not None:
+        batch_writer.close(INFLUXDB_CONFIG["close_timeout"])
+    if write_spool is not None:
+        write_spool.close()
+    if rollup_manager is not None:
+        rollup_manager.stop()
+    if local_store is not None:
+        local_store.close()
     if INFLUX_CONNECTED:
-        influx_client.close()
-        logger.info("InfluxDB连接已关闭")
+        close_influx_connection()
 
 if __name__ == "__main__":
     # 测试代码
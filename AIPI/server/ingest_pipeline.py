@@ -0,0 +1,508 @@
+"""
+消息接入流水线 - 将MQTT网络线程与数据处理解耦
+
+MQTT回调只负责解码并入队，由工作线程池执行InfluxDB写入、告警检查和LLM分析，
+避免慢速的下游调用阻塞paho的网络循环。工作线程池是按设备ID分片的执行器，
+同一设备的消息按到达顺序处理，不同设备的消息并行处理。
+
+微批处理模式下改用MicroBatchPipeline，按条数或时间窗口攒批后整批交给下游，
+摊薄每条消息的InfluxDB写入、规则评估和LLM调用开销。
+
+PriorityIngestPipeline按订阅主题把消息分到不同优先级类别，每个类别有独立的队列、
+处理线程和负载削减策略，命令结果和控制消息不会排在大量遥测数据后面。
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import PIPELINE_CONFIG, MQTT_CONFIG, LOG_CONFIG
+from sharded_executor import ShardedExecutor
+from topic_router import TopicRouter
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("ingest_pipeline")
+
+class StageStats:
+    """单个处理阶段的耗时统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+            "last_ms": round(self.last * 1000, 3)
+        }
+
+class PipelineMetrics:
+    """流水线计数器和各阶段延迟统计，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.stages = {}
+
+    def incr(self, name, value=1):
+        """增加计数器"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        """记录某个阶段的耗时（秒）"""
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.record(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """统计代码块耗时的上下文管理器"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        """获取当前指标快照"""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "stages": {name: stats.snapshot() for name, stats in self.stages.items()}
+            }
+
+# 进程内共享的指标实例，处理函数可以用它记录各阶段耗时
+pipeline_metrics = PipelineMetrics()
+
+def get_pipeline_metrics():
+    """获取流水线指标单例"""
+    return pipeline_metrics
+
+class LoadShedder:
+    """
+    负载削减策略
+    drop   - 队列满时丢弃新消息
+    block  - 队列满时由调用方等待enqueue_timeout，超时后丢弃
+    sample - 队列深度超过水位线后只保留1/sample_rate的消息，队列满时丢弃
+    """
+
+    def __init__(self, policy="drop", sample_rate=10, watermark=0.8):
+        self.policy = policy or "drop"
+        self.sample_rate = max(1, int(sample_rate or 1))
+        self.watermark = watermark if watermark is not None else 0.8
+        self._counter = 0
+
+    def admit(self, depth, capacity):
+        """
+        判断是否接收一条新消息（队列满的情况由调用方处理）
+        :param depth: 当前队列深度
+        :param capacity: 队列容量
+        :return: 是否接收
+        """
+        if self.policy != "sample" or depth < self.watermark * capacity:
+            return True
+        self._counter += 1
+        return self._counter % self.sample_rate == 0
+
+def message_key(topic, data):
+    """
+    获取消息的分片键：优先使用数据中的设备ID，其次是主题中的设备ID
+    :param topic: MQTT主题
+    :param data: 消息数据
+    :return: 分片键
+    """
+    if isinstance(data, dict) and data.get("device_id"):
+        return data["device_id"]
+    parts = topic.split("/")
+    if len(parts) >= 3 and parts[0] == "device":
+        return parts[1]
+    return topic
+
+class IngestPipeline:
+    """有界队列 + 按设备分片的工作线程池的消息接入流水线"""
+
+    def __init__(self, handler, queue_size=None, worker_count=None,
+                 enqueue_timeout=None, name="ingest", metrics=None, executor=None,
+                 shedder=None):
+        """
+        :param handler: 处理函数，签名为 handler(topic, data)
+        :param queue_size: 队列总容量，平均分配到各分片
+        :param worker_count: 分片数（每个分片一个工作线程）
+        :param enqueue_timeout: 队列满时最长等待时间（秒），0表示立即丢弃
+        :param name: 流水线名称，用于线程命名和日志
+        :param metrics: 指标实例，默认使用共享的pipeline_metrics
+        :param executor: 使用已有的分片执行器，默认按配置新建
+        :param shedder: 负载削减策略，默认队列满时丢弃
+        """
+        self.handler = handler
+        self.shedder = shedder or LoadShedder()
+        self.queue_size = queue_size or PIPELINE_CONFIG["queue_size"]
+        self.worker_count = worker_count or PIPELINE_CONFIG["worker_count"]
+        if enqueue_timeout is None:
+            enqueue_timeout = PIPELINE_CONFIG["enqueue_timeout"]
+        self.enqueue_timeout = enqueue_timeout
+        self.name = name
+        self.metrics = metrics or pipeline_metrics
+
+        if executor is None:
+            executor = ShardedExecutor(
+                num_lanes=self.worker_count,
+                lane_queue_size=max(1, self.queue_size // self.worker_count),
+                name=name
+            )
+        self.executor = executor
+        self.worker_count = executor.num_lanes
+        self.queue_size = executor.num_lanes * executor.lane_queue_size
+        self.running = False
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动工作线程，重复调用不会重复启动"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self.executor.start()
+        logger.info(f"消息流水线 {self.name} 已启动，工作线程: {self.worker_count}，队列容量: {self.queue_size}")
+
+    def submit(self, topic, data, received_at=None, key=None):
+        """
+        将消息放入对应设备的分片队列，在MQTT网络线程中调用
+        :param topic: MQTT主题
+        :param data: 已解码的消息数据
+        :param received_at: 消息接收时间（perf_counter），用于统计端到端延迟
+        :param key: 分片键，默认从消息中提取设备ID
+        :return: 是否成功入队
+        """
+        if received_at is None:
+            received_at = time.perf_counter()
+        if key is None:
+            key = message_key(topic, data)
+
+        if not self.shedder.admit(self.executor.depth(), self.queue_size):
+            self.metrics.incr("shed")
+            return False
+
+        future = self.executor.try_submit(
+            key, self._process, topic, data, received_at, time.perf_counter(),
+            timeout=self.enqueue_timeout
+        )
+        if future is None:
+            self.metrics.incr("dropped")
+            logger.debug(f"消息队列已满，丢弃消息，主题: {topic}")
+            return False
+
+        self.metrics.incr("enqueued")
+        depth = self.executor.depth()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def _process(self, topic, data, received_at, enqueued_at):
+        """在分片线程中处理单条消息"""
+        started_at = time.perf_counter()
+        self.metrics.observe("queue_wait", started_at - enqueued_at)
+
+        try:
+            self.handler(topic, data)
+            self.metrics.incr("processed")
+        except Exception as e:
+            self.metrics.incr("failed")
+            logger.error(f"处理消息时出错，主题: {topic}，错误: {str(e)}")
+
+        finished_at = time.perf_counter()
+        self.metrics.observe("process", finished_at - started_at)
+        self.metrics.observe("end_to_end", finished_at - received_at)
+
+    def stop(self, timeout=5.0):
+        """
+        停止工作线程，已入队的消息会先处理完
+        :param timeout: 每个线程的最长等待时间（秒）
+        """
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+        self.executor.shutdown(wait=True, timeout=timeout)
+        logger.info(f"消息流水线 {self.name} 已停止")
+
+    def get_metrics(self):
+        """获取流水线状态和指标"""
+        snapshot = self.metrics.snapshot()
+        executor_stats = self.executor.stats()
+        snapshot["queue"] = {
+            "depth": executor_stats["depth"],
+            "max_depth": self.max_depth,
+            "capacity": self.queue_size,
+            "workers": self.worker_count if self.running else 0,
+            "lanes": executor_stats["per_lane"]
+        }
+        return snapshot
+
+class MicroBatchPipeline:
+    """
+    微批处理流水线，接口与IngestPipeline一致
+    消息先进入有界缓冲区，满max_batch_size条或最早一条等待超过max_wait_ms时，
+    由刷新线程整批调用批处理函数。批内顺序即到达顺序，因此同一设备的数据仍然有序。
+    """
+
+    def __init__(self, batch_handler, max_batch_size=None, max_wait_ms=None,
+                 queue_size=None, name="batch", metrics=None, shedder=None):
+        """
+        :param batch_handler: 批处理函数，签名为 batch_handler(messages)，messages为[(topic, data), ...]
+        :param max_batch_size: 每批最大消息数
+        :param max_wait_ms: 批次最长等待时间（毫秒）
+        :param queue_size: 缓冲区容量，超过后丢弃新消息
+        :param name: 流水线名称，用于线程命名和日志
+        :param metrics: 指标实例，默认使用共享的pipeline_metrics
+        :param shedder: 负载削减策略，默认缓冲区满时丢弃
+        """
+        self.batch_handler = batch_handler
+        self.shedder = shedder or LoadShedder()
+        self.max_batch_size = max_batch_size or PIPELINE_CONFIG["batch_max_size"]
+        if max_wait_ms is None:
+            max_wait_ms = PIPELINE_CONFIG["batch_max_wait_ms"]
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue_size = queue_size or PIPELINE_CONFIG["queue_size"]
+        self.name = name
+        self.metrics = metrics or pipeline_metrics
+
+        self.buffer = deque()
+        self.running = False
+        self.max_depth = 0
+        self.flush_thread = None
+        self._cond = threading.Condition()
+
+    def start(self):
+        """启动刷新线程，重复调用不会重复启动"""
+        with self._cond:
+            if self.running:
+                return
+            self.running = True
+            self.flush_thread = threading.Thread(target=self._flush_loop, name=f"{self.name}-flush")
+            self.flush_thread.daemon = True
+            self.flush_thread.start()
+        logger.info(f"微批流水线 {self.name} 已启动，批大小: {self.max_batch_size}，时间窗口: {self.max_wait * 1000:.0f}ms")
+
+    def submit(self, topic, data, received_at=None):
+        """
+        将消息放入缓冲区，在MQTT网络线程中调用
+        :param topic: MQTT主题
+        :param data: 已解码的消息数据
+        :param received_at: 消息接收时间（perf_counter），用于统计端到端延迟
+        :return: 是否成功入队
+        """
+        if received_at is None:
+            received_at = time.perf_counter()
+
+        with self._cond:
+            if not self.shedder.admit(len(self.buffer), self.queue_size):
+                self.metrics.incr("shed")
+                return False
+            if len(self.buffer) >= self.queue_size:
+                self.metrics.incr("dropped")
+                logger.debug(f"批处理缓冲区已满，丢弃消息，主题: {topic}")
+                return False
+            self.buffer.append((topic, data, received_at))
+            depth = len(self.buffer)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if depth == 1 or depth >= self.max_batch_size:
+                self._cond.notify()
+
+        self.metrics.incr("enqueued")
+        return True
+
+    def _next_batch(self):
+        """等待并取出下一批消息，停止且缓冲区为空时返回None"""
+        with self._cond:
+            while not self.buffer:
+                if not self.running:
+                    return None
+                self._cond.wait()
+
+            # 从最早一条消息开始计时，攒够一批或超时
+            deadline = self.buffer[0][2] + self.max_wait
+            while self.running and len(self.buffer) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            count = min(len(self.buffer), self.max_batch_size)
+            return [self.buffer.popleft() for _ in range(count)]
+
+    def _flush_loop(self):
+        """刷新线程主循环"""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            started_at = time.perf_counter()
+            self.metrics.observe("queue_wait", started_at - batch[0][2])
+
+            try:
+                self.batch_handler([(topic, data) for topic, data, _ in batch])
+                self.metrics.incr("processed", len(batch))
+                self.metrics.incr("batches")
+            except Exception as e:
+                self.metrics.incr("failed", len(batch))
+                logger.error(f"批处理消息时出错，批大小: {len(batch)}，错误: {str(e)}")
+
+            finished_at = time.perf_counter()
+            self.metrics.observe("process", finished_at - started_at)
+            for _, _, received_at in batch:
+                self.metrics.observe("end_to_end", finished_at - received_at)
+
+    def stop(self, timeout=5.0):
+        """
+        停止刷新线程，缓冲区中剩余的消息会先处理完
+        :param timeout: 最长等待时间（秒）
+        """
+        with self._cond:
+            if not self.running:
+                return
+            self.running = False
+            self._cond.notify_all()
+        if self.flush_thread:
+            self.flush_thread.join(timeout=timeout)
+        logger.info(f"微批流水线 {self.name} 已停止")
+
+    def get_metrics(self):
+        """获取流水线状态和指标"""
+        snapshot = self.metrics.snapshot()
+        with self._cond:
+            depth = len(self.buffer)
+        snapshot["queue"] = {
+            "depth": depth,
+            "max_depth": self.max_depth,
+            "capacity": self.queue_size,
+            "workers": 1 if self.running else 0,
+            "batch_max_size": self.max_batch_size,
+            "batch_max_wait_ms": self.max_wait * 1000
+        }
+        return snapshot
+
+class PriorityIngestPipeline:
+    """
+    按主题优先级分类的流水线，接口与IngestPipeline一致
+    每个优先级类别有独立的队列和处理线程，遥测数据积压时最先被采样或丢弃，
+    命令结果和控制消息最后才会被丢弃。
+    """
+
+    def __init__(self, handler, batch_handler=None, executor=None,
+                 classes=None, topic_priorities=None, bulk_class=None):
+        """
+        :param handler: 逐条处理函数，签名为 handler(topic, data)
+        :param batch_handler: 批处理函数，启用微批模式时用于大流量类别
+        :param executor: 大流量类别使用的分片执行器
+        :param classes: 优先级类别配置，默认使用PIPELINE_CONFIG["priority_classes"]
+        :param topic_priorities: 主题过滤器到类别的映射，默认使用MQTT_CONFIG["topic_priorities"]
+        :param bulk_class: 大流量类别名称，未匹配的主题也归入该类别
+        """
+        self.metrics = pipeline_metrics
+        topic_priorities = topic_priorities or MQTT_CONFIG.get("topic_priorities", {})
+        self.bulk_class = bulk_class or PIPELINE_CONFIG.get("bulk_class", "telemetry")
+        classes = dict(classes or PIPELINE_CONFIG.get("priority_classes", {}))
+        classes.setdefault(self.bulk_class, {})
+
+        self.pipelines = {}
+        for class_name, class_config in classes.items():
+            shedder = LoadShedder(
+                policy=class_config.get("shed_policy", "drop"),
+                sample_rate=class_config.get("sample_rate"),
+                watermark=class_config.get("shed_watermark")
+            )
+            class_metrics = PipelineMetrics()
+
+            if class_name == self.bulk_class and batch_handler and PIPELINE_CONFIG["batch_enabled"]:
+                pipeline = MicroBatchPipeline(
+                    batch_handler,
+                    queue_size=class_config.get("queue_size"),
+                    name=class_name,
+                    metrics=class_metrics,
+                    shedder=shedder
+                )
+            else:
+                enqueue_timeout = class_config.get("enqueue_timeout")
+                if enqueue_timeout is None and class_config.get("shed_policy") != "block":
+                    enqueue_timeout = 0
+                pipeline = IngestPipeline(
+                    handler,
+                    queue_size=class_config.get("queue_size"),
+                    worker_count=class_config.get("workers"),
+                    enqueue_timeout=enqueue_timeout,
+                    name=class_name,
+                    metrics=class_metrics,
+                    executor=executor if class_name == self.bulk_class else None,
+                    shedder=shedder
+                )
+            self.pipelines[class_name] = pipeline
+
+        # 主题过滤器按配置顺序注册，匹配多个时取第一个
+        self.router = TopicRouter()
+        for topic_filter, class_name in topic_priorities.items():
+            if class_name in self.pipelines:
+                self.router.add(topic_filter, class_name)
+
+    def classify(self, topic):
+        """
+        获取主题对应的优先级类别
+        :param topic: MQTT主题
+        :return: 类别名称
+        """
+        class_name, _ = self.router.first(topic)
+        return class_name or self.bulk_class
+
+    def start(self):
+        """启动所有类别的流水线"""
+        for pipeline in self.pipelines.values():
+            pipeline.start()
+
+    def submit(self, topic, data, received_at=None):
+        """
+        按主题类别放入对应队列，在MQTT网络线程中调用
+        :param topic: MQTT主题
+        :param data: 已解码的消息数据
+        :param received_at: 消息接收时间（perf_counter）
+        :return: 是否成功入队
+        """
+        return self.pipelines[self.classify(topic)].submit(topic, data, received_at)
+
+    def stop(self, timeout=5.0):
+        """停止所有类别的流水线"""
+        for pipeline in self.pipelines.values():
+            pipeline.stop(timeout=timeout)
+
+    def get_metrics(self):
+        """获取各类别的队列、入队、削减和丢弃计数，以及共享的处理阶段耗时"""
+        classes = {name: pipeline.get_metrics() for name, pipeline in self.pipelines.items()}
+        totals = {}
+        for class_metrics in classes.values():
+            for name, value in class_metrics["counters"].items():
+                totals[name] = totals.get(name, 0) + value
+        snapshot = self.metrics.snapshot()
+        snapshot["counters"].update(totals)
+        snapshot["classes"] = classes
+        return snapshot
@@ -0,0 +1,289 @@
+"""
+多进程数据接入
+
+单个MQTT客户端进程受GIL限制只能用满一个CPU核心。多进程模式下启动K个接入进程，
+每个进程使用独立的客户端ID并通过MQTT v5共享订阅($share/<group>/<topic>)订阅设备主题，
+由代理服务器在组内分摊消息，每条消息只会投递给其中一个进程。
+代理服务器按消息分摊，不按设备分摊：同一设备的连续消息可能由不同进程处理，处理完成的先后顺序不再保证
+（按时间戳写入的时序数据不受影响）。依赖到达顺序的遥测增量帧在多进程模式下不启用，设备发送完整数据。
+告警冷却期记录在各进程共用的SQLite文件（INGEST_CONFIG["alert_cooldown_db"]）中，同一告警不会被多个进程重复发送。
+监督进程负责拉起退出的接入进程，并汇总各进程上报的流水线指标。
+"""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from config import MQTT_CONFIG, INGEST_CONFIG, LOG_CONFIG
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("ingest_supervisor")
+
+def shared_topic(group, topic):
+    """
+    生成共享订阅主题
+    :param group: 共享订阅组名
+    :param topic: 原始主题过滤器
+    :return: $share/<group>/<topic>
+    """
+    return f"$share/{group}/{topic}"
+
+def run_ingest_worker(index, metrics_queue, group=None, client_id_prefix=None, report_interval=None):
+    """
+    接入进程入口：以共享订阅连接MQTT代理服务器，并定期上报流水线指标
+    :param index: 进程编号
+    :param metrics_queue: 上报指标的进程间队列
+    :param group: 共享订阅组名，默认使用INGEST_CONFIG["share_group"]
+    :param client_id_prefix: 客户端ID前缀，默认使用INGEST_CONFIG["client_id_prefix"]
+    :param report_interval: 指标上报间隔（秒），默认使用INGEST_CONFIG["metrics_interval"]
+    """
+    import paho.mqtt.client as mqtt
+    from mqtt_client import init_mqtt_client
+
+    group = group or INGEST_CONFIG["share_group"]
+    client_id_prefix = client_id_prefix or INGEST_CONFIG["client_id_prefix"]
+    report_interval = report_interval or INGEST_CONFIG["metrics_interval"]
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+    # 同一设备的消息会分到不同进程，告警冷却期使用共享记录
+    from alert_manager import use_shared_cooldown
+    use_shared_cooldown(INGEST_CONFIG["alert_cooldown_db"])
+
+    # 工作进程替换MQTT客户端单例，控制动作等模块通过get_mqtt_client()使用同一个连接
+    broadcast_topics = INGEST_CONFIG.get("broadcast_topics", [])
+    client = init_mqtt_client(
+        client_id=f"{client_id_prefix}-{index}",
+        subscribe_topics=[
+            topic if topic in broadcast_topics else shared_topic(group, topic)
+            for topic in MQTT_CONFIG["subscribe_topics"]
+        ],
+        protocol=mqtt.MQTTv5,
+        # 增量帧需要按到达顺序合并，共享订阅下同一设备的帧会分到不同进程
+        # （通过 --ingest-workers 启动时INGEST_CONFIG["workers"]可能为0，这里明确关闭）
+        delta_enabled=False
+    )
+    if not client.connect():
+        logger.error(f"接入进程 {index} 无法连接MQTT代理服务器")
+        raise SystemExit(1)
+
+    logger.info(f"接入进程 {index} 已启动，PID: {os.getpid()}，共享订阅组: {group}")
+    try:
+        while not stop_event.wait(report_interval):
+            try:
+                metrics_queue.put_nowait({
+                    "worker": index,
+                    "pid": os.getpid(),
+                    "connected": client.connected,
+                    "timestamp": time.time(),
+                    "pipeline": client.pipeline.get_metrics()
+                })
+            except queue.Full:
+                pass
+    finally:
+        client.disconnect()
+        logger.info(f"接入进程 {index} 已停止")
+
+def aggregate_metrics(worker_metrics):
+    """
+    汇总各接入进程的流水线指标
+    计数器按进程求和，阶段耗时按次数加权平均，最大值取各进程最大值
+    :param worker_metrics: {进程编号: 该进程最近一次上报的指标}
+    :return: 汇总后的指标字典
+    """
+    counters = {}
+    stages = {}
+    for report in worker_metrics.values():
+        pipeline = report["pipeline"]
+        for name, value in pipeline.get("counters", {}).items():
+            counters[name] = counters.get(name, 0) + value
+        for name, stage in pipeline.get("stages", {}).items():
+            total = stages.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            total["count"] += stage["count"]
+            total["total_ms"] += stage["avg_ms"] * stage["count"]
+            total["max_ms"] = max(total["max_ms"], stage["max_ms"])
+
+    return {
+        "counters": counters,
+        "stages": {
+            name: {
+                "count": stage["count"],
+                "avg_ms": round(stage["total_ms"] / stage["count"], 3) if stage["count"] else 0.0,
+                "max_ms": stage["max_ms"]
+            }
+            for name, stage in stages.items()
+        }
+    }
+
+class IngestSupervisor:
+    """启动并监督多个接入进程"""
+
+    def __init__(self, num_workers=None, restart_delay=None, metrics_file=None):
+        """
+        :param num_workers: 接入进程数，默认使用INGEST_CONFIG["workers"]，至少为1
+        :param restart_delay: 进程退出后重启前的等待时间（秒）
+        :param metrics_file: 汇总指标输出文件，为空时不写文件
+        """
+        self.num_workers = max(1, int(num_workers or INGEST_CONFIG["workers"] or 1))
+        self.restart_delay = restart_delay if restart_delay is not None else INGEST_CONFIG["restart_delay"]
+        self.metrics_file = metrics_file if metrics_file is not None else INGEST_CONFIG["metrics_file"]
+
+        # paho的网络线程和分片线程不能安全地fork，统一使用spawn启动子进程
+        self.context = multiprocessing.get_context("spawn")
+        self.metrics_queue = self.context.Queue(maxsize=self.num_workers * 100)
+        self.workers = {}
+        self.restarts = {}
+        self.restart_at = {}
+        self.worker_metrics = {}
+        self.running = False
+        self._monitor_thread = None
+        self._lock = threading.Lock()
+
+    def _spawn(self, index):
+        """启动编号为index的接入进程"""
+        process = self.context.Process(
+            target=run_ingest_worker,
+            args=(index, self.metrics_queue),
+            name=f"ingest-worker-{index}"
+        )
+        process.daemon = True
+        process.start()
+        self.workers[index] = process
+        logger.info(f"接入进程 {index} 已启动，PID: {process.pid}")
+
+    def start(self):
+        """启动所有接入进程和监督线程"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            for index in range(self.num_workers):
+                self.restarts[index] = 0
+                self._spawn(index)
+
+        self._monitor_thread = threading.Thread(target=self._monitor, name="ingest-supervisor")
+        self._monitor_thread.daemon = True
+        self._monitor_thread.start()
+        logger.info(f"多进程接入已启动，进程数: {self.num_workers}")
+
+    def _monitor(self):
+        """检查进程存活状态并收集指标"""
+        last_write = 0
+        while self.running:
+            self._collect_metrics(timeout=1.0)
+
+            with self._lock:
+                if not self.running:
+                    break
+                now = time.time()
+                for index, process in list(self.workers.items()):
+                    if process.is_alive():
+                        continue
+                    # 首次发现退出时记录重启时间，等待restart_delay后再拉起
+                    if index not in self.restart_at:
+                        logger.warning(f"接入进程 {index} 已退出，退出码: {process.exitcode}，"
+                                       f"{self.restart_delay}秒后重启")
+                        self.restart_at[index] = now + self.restart_delay
+                        self.worker_metrics.pop(index, None)
+                    elif now >= self.restart_at[index]:
+                        del self.restart_at[index]
+                        self.restarts[index] += 1
+                        self._spawn(index)
+
+            if self.metrics_file and time.time() - last_write >= INGEST_CONFIG["metrics_interval"]:
+                self._write_metrics_file()
+                last_write = time.time()
+
+    def _collect_metrics(self, timeout):
+        """读取进程上报的指标，每个进程只保留最近一次"""
+        try:
+            report = self.metrics_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            self.worker_metrics[report["worker"]] = report
+            try:
+                report = self.metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _write_metrics_file(self):
+        """把汇总指标写入文件，供Web服务的指标接口读取"""
+        try:
+            directory = os.path.dirname(self.metrics_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_file = f"{self.metrics_file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self.get_metrics(), f, ensure_ascii=False)
+            os.replace(tmp_file, self.metrics_file)
+        except OSError as e:
+            logger.error(f"写入接入指标文件失败: {str(e)}")
+
+    def get_metrics(self):
+        """获取各接入进程的状态和汇总指标"""
+        with self._lock:
+            workers = [
+                {
+                    "worker": index,
+                    "pid": process.pid,
+                    "alive": process.is_alive(),
+                    "restarts": self.restarts.get(index, 0),
+                    "connected": self.worker_metrics.get(index, {}).get("connected", False),
+                    "last_report": self.worker_metrics.get(index, {}).get("timestamp")
+                }
+                for index, process in sorted(self.workers.items())
+            ]
+            worker_metrics = dict(self.worker_metrics)
+
+        return {
+            "workers": workers,
+            "aggregate": aggregate_metrics(worker_metrics),
+            "timestamp": time.time()
+        }
+
+    def stop(self, timeout=10):
+        """
+        停止所有接入进程
+        :param timeout: 每个进程的最长等待时间（秒），超时后强制结束
+        """
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            workers = list(self.workers.values())
+
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        for process in workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+
+        if self._monitor_thread:
+            self._monitor_thread.join(timeout=2)
+        logger.info("多进程接入已停止")
+
+def load_ingest_metrics(metrics_file=None):
+    """
+    读取监督进程写出的汇总指标
+    :param metrics_file: 指标文件路径，默认使用INGEST_CONFIG["metrics_file"]
+    :return: 指标字典，未启用多进程接入时返回None
+    """
+    metrics_file = metrics_file or INGEST_CONFIG["metrics_file"]
+    try:
+        with open(metrics_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -15,6 +15,9 @@ from langchain.schema import AgentAction, AgentFinish, LLMResult
 
 import paho.mqtt.client as mqtt
 
+from topic_router import TopicRouter
+from codec import decode_json
+
 class MQTTCommandExecutor:
     """MQTT命令执行器，负责发送命令到设备并获取结果"""
     
@@ -40,6 +43,11 @@ class MQTTCommandExecutor:
         # 设备状态
         self.device_status = {}
         
+        # 消息路由，设备ID从主题中解析一次后作为参数传给处理函数
+        self.router = TopicRouter()
+        self.router.add("device/{device_id}/result", self._handle_result)
+        self.router.add("device/{device_id}/status", self._handle_status)
+        
         # 创建MQTT客户端
         self.client_id = f"langchain_agent_{int(time.time())}"
         self.client = mqtt.Client(client_id=self.client_id)
@@ -88,25 +96,23 @@ class MQTTCommandExecutor:
         """MQTT消息回调函数"""
         topic = msg.topic
         try:
-            payload = json.loads(msg.payload.decode('utf-8'))
-            
-            # 处理命令结果
-            if "/result" in topic:
-                device_id = topic.split("/")[1]
-                command_id = payload.get("command_id")
-                
-                if command_id and command_id in self.waiting_commands:
-                    self.command_results[command_id] = payload
-                    self.waiting_commands.remove(command_id)
-                    
-            # 处理设备状态
-            elif "/status" in topic:
-                device_id = topic.split("/")[1]
-                self.device_status[device_id] = payload
-                
+            payload = decode_json(msg.payload)
+            self.router.dispatch(topic, payload)
         except Exception as e:
             print(f"处理MQTT消息出错: {e}")
     
+    def _handle_result(self, payload, device_id):
+        """处理命令结果"""
+        command_id = payload.get("command_id")
+        
+        if command_id and command_id in self.waiting_commands:
+            self.command_results[command_id] = payload
+            self.waiting_commands.remove(command_id)
+    
+    def _handle_status(self, payload, device_id):
+        """处理设备状态"""
+        self.device_status[device_id] = payload
+    
     def subscribe_to_device(self, device_id: str):
         """订阅设备的结果和状态主题"""
         if not self.connected:
@@ -1,15 +1,19 @@
 import os
 import re
 import json
+import asyncio
 import logging
 import time
-from config import LOG_CONFIG, LLM_CONFIG, DEVICE_CONFIG
+import threading
+from config import LOG_CONFIG, LLM_CONFIG, DEVICE_CONFIG, DEVICE_RULES, PIPELINE_CONFIG
 from langchain_community.llms import OpenAI
 from langchain_community.chat_models import ChatOpenAI
 from langchain.chains import LLMChain
 from langchain.prompts.chat import ChatPromptTemplate
-from influx_writer import write_to_influxdb
-from alert_manager import check_and_send_alert
+from influx_writer import write_to_influxdb, write_batch_to_influxdb, write_to_influxdb_async
+from alert_manager import check_and_send_alert, check_and_send_alerts_batch, check_and_send_alert_async
+from ingest_pipeline import get_pipeline_metrics
+from sharded_executor import ShardedExecutor
 
 # 配置日志
 logging.basicConfig(
@@ -63,8 +67,47 @@ DEVICE_ANALYSIS_TEMPLATE = """
 }}
 """
 
+# 多设备批量分析提示模板
+BATCH_ANALYSIS_TEMPLATE = """
+你是一个智能设备监控和控制系统的AI分析师。
+请分析以下多个设备的最新数据，分别判断每个设备的状态，并给出相应的控制指令。
+
+设备数据（JSON数组，每项包含设备数据和该设备适用的参考规则）:
+{devices}
+
+参考规则说明:
+1. 如果温度超过temp_high°C，需要开启降温设备
+2. 如果温度低于temp_low°C，需要开启加热设备
+3. 如果湿度超过humidity_high%，需要开启除湿设备
+4. 如果湿度低于humidity_low%，需要开启加湿设备
+5. additional_rules中的其他规则
+
+请为每个设备给出分析，按以下JSON格式响应:
+{{
+  "devices": [
+    {{
+      "device_id": "设备ID",
+      "analysis": "对设备状态的分析",
+      "device_status": "正常/警告/危险",
+      "recommendations": ["建议1", "建议2"],
+      "control_actions": [
+        {{
+          "device_id": "需要控制的设备ID",
+          "action": "控制动作(on/off/adjust)",
+          "parameters": {{
+            "param1": "值1",
+            "param2": "值2"
+          }}
+        }}
+      ]
+    }}
+  ]
+}}
+"""
+
 # 创建分析提示模板
 device_analysis_prompt = ChatPromptTemplate.from_template(DEVICE_ANALYSIS_TEMPLATE)
+batch_analysis_prompt = ChatPromptTemplate.from_template(BATCH_ANALYSIS_TEMPLATE)
 
 # 创建分析链
 analysis_chain = LLMChain(
@@ -73,6 +116,34 @@ analysis_chain = LLMChain(
     verbose=LLM_CONFIG.get("verbose", False)
 )
 
+# 创建批量分析链
+batch_analysis_chain = LLMChain(
+    llm=llm,
+    prompt=batch_analysis_prompt,
+    verbose=LLM_CONFIG.get("verbose", False)
+)
+
+# 各处理阶段的耗时统计
+metrics = get_pipeline_metrics()
+
+# 按设备ID分片的执行器：同一设备的数据按顺序处理（告警冷却和控制动作依赖顺序），
+# 不同设备的数据并行处理
+_device_executor = None
+_device_executor_lock = threading.Lock()
+
+def get_device_executor():
+    """获取设备数据分片执行器单例"""
+    global _device_executor
+    with _device_executor_lock:
+        if _device_executor is None:
+            lanes = PIPELINE_CONFIG["worker_count"]
+            _device_executor = ShardedExecutor(
+                num_lanes=lanes,
+                lane_queue_size=max(1, PIPELINE_CONFIG["queue_size"] // lanes),
+                name="device"
+            )
+        return _device_executor
+
 def process_device_data(topic, data):
     """
     处理设备数据
@@ -82,36 +153,22 @@ def process_device_data(topic, data):
     """
     try:
         device_id = data.get("device_id", "unknown")
-        timestamp = data.get("timestamp", time.time())
         
         # 记录数据到InfluxDB
-        write_to_influxdb(device_id, data)
+        with metrics.timer("influx_write"):
+            write_to_influxdb(device_id, data)
         
         # 检查是否需要发送警报
-        check_and_send_alert(device_id, data)
-        
-        # 获取设备类型和规则
-        device_type = get_device_type(device_id)
-        rules = DEVICE_RULES.get(device_type, DEVICE_RULES["default"])
+        with metrics.timer("alert_check"):
+            check_and_send_alert(device_id, data)
         
         # 准备LLM分析参数
-        analysis_inputs = {
-            "device_id": device_id,
-            "temperature": data.get("temperature", "N/A"),
-            "humidity": data.get("humidity", "N/A"),
-            "additional_data": json.dumps({k: v for k, v in data.items() 
-                                        if k not in ["device_id", "temperature", "humidity", "timestamp"]}),
-            "timestamp": timestamp,
-            "temp_high": rules["temp_high"],
-            "temp_low": rules["temp_low"],
-            "humidity_high": rules["humidity_high"],
-            "humidity_low": rules["humidity_low"],
-            "additional_rules": rules.get("additional_rules", "无其他规则")
-        }
+        analysis_inputs = build_analysis_inputs(device_id, data)
         
         # 使用LLM分析数据
         logger.info(f"分析设备 {device_id} 数据")
-        analysis_result = analysis_chain.run(**analysis_inputs)
+        with metrics.timer("llm_analysis"):
+            analysis_result = analysis_chain.run(**analysis_inputs)
         
         # 解析LLM输出
         try:
@@ -132,6 +189,132 @@ def process_device_data(topic, data):
         logger.error(f"处理设备数据时出错: {str(e)}")
         return {"error": str(e)}
 
+async def process_device_data_async(topic, data):
+    """
+    process_device_data的异步版本：InfluxDB写入、告警通知和LLM分析都以协程执行，
+    大量进行中的处理只占用协程而不占用线程
+    :param topic: MQTT主题
+    :param data: 设备数据字典
+    :return: 处理结果
+    """
+    try:
+        device_id = data.get("device_id", "unknown")
+        
+        # 记录数据到InfluxDB
+        with metrics.timer("influx_write"):
+            await write_to_influxdb_async(device_id, data)
+        
+        # 检查是否需要发送警报
+        with metrics.timer("alert_check"):
+            await check_and_send_alert_async(device_id, data)
+        
+        # 准备LLM分析参数
+        analysis_inputs = build_analysis_inputs(device_id, data)
+        
+        # 使用LLM分析数据
+        logger.info(f"分析设备 {device_id} 数据")
+        with metrics.timer("llm_analysis"):
+            analysis_result = await analysis_chain.arun(**analysis_inputs)
+        
+        # 解析LLM输出
+        try:
+            result_json = json.loads(analysis_result)
+            logger.info(f"设备状态分析结果: {result_json['device_status']}")
+            
+            # 设备控制涉及GPIO等阻塞操作，放到线程池中执行
+            if "control_actions" in result_json and result_json["control_actions"]:
+                await asyncio.to_thread(handle_control_actions, result_json["control_actions"])
+                
+            return result_json
+            
+        except json.JSONDecodeError:
+            logger.error(f"无法解析LLM输出为JSON: {analysis_result}")
+            return {"error": "解析LLM输出失败", "raw_output": analysis_result}
+            
+    except Exception as e:
+        logger.error(f"处理设备数据时出错: {str(e)}")
+        return {"error": str(e)}
+
+def process_device_data_batch(messages):
+    """
+    批量处理设备数据：整批只做一次InfluxDB写入、一次规则评估和一次LLM分析
+    :param messages: [(topic, data), ...]，同一设备的数据按到达顺序排列
+    :return: {device_id: 分析结果}
+    """
+    try:
+        records = [(data.get("device_id", "unknown"), data) for _, data in messages]
+        if not records:
+            return {}
+        
+        # 一次写入所有数据点
+        with metrics.timer("influx_write"):
+            write_batch_to_influxdb(records)
+        
+        # 一次评估所有告警规则
+        with metrics.timer("alert_check"):
+            check_and_send_alerts_batch(records)
+        
+        # 每个设备只分析批内最新的一条数据
+        latest_data = {}
+        for device_id, data in records:
+            latest_data[device_id] = data
+        devices_inputs = [build_analysis_inputs(device_id, data) for device_id, data in latest_data.items()]
+        
+        # 一次LLM请求分析所有设备
+        logger.info(f"批量分析 {len(devices_inputs)} 个设备数据（共 {len(records)} 条）")
+        with metrics.timer("llm_analysis"):
+            analysis_result = batch_analysis_chain.run(devices=json.dumps(devices_inputs, ensure_ascii=False))
+        
+        # 解析LLM输出
+        try:
+            result_json = json.loads(analysis_result)
+        except json.JSONDecodeError:
+            logger.error(f"无法解析LLM批量输出为JSON: {analysis_result}")
+            return {"error": "解析LLM输出失败", "raw_output": analysis_result}
+        
+        results = {}
+        for device_result in result_json.get("devices", []):
+            device_id = device_result.get("device_id")
+            if device_id not in latest_data:
+                continue
+            results[device_id] = device_result
+            logger.info(f"设备 {device_id} 状态分析结果: {device_result.get('device_status')}")
+            
+            # 处理控制动作
+            if device_result.get("control_actions"):
+                handle_control_actions(device_result["control_actions"])
+                
+        return results
+        
+    except Exception as e:
+        logger.error(f"批量处理设备数据时出错: {str(e)}")
+        return {"error": str(e)}
+
+def build_analysis_inputs(device_id, data):
+    """
+    根据设备数据和设备类型规则构建LLM分析参数
+    :param device_id: 设备ID
+    :param data: 设备数据字典
+    :return: 分析参数字典
+    """
+    # 获取设备类型和规则
+    device_type = get_device_type(device_id)
+    rules = DEVICE_RULES.get(device_type, DEVICE_RULES["default"])
+    
+    return {
+        "device_id": device_id,
+        "temperature": data.get("temperature", "N/A"),
+        "humidity": data.get("humidity", "N/A"),
+        "additional_data": json.dumps({k: v for k, v in data.items() 
+                                    if k not in ["device_id", "temperature", "humidity", "timestamp"]}),
+        "timestamp": data.get("timestamp", time.time()),
+        "temp_high": rules["temp_high"],
+        "temp_low": rules["temp_low"],
+        "humidity_high": rules["humidity_high"],
+        "humidity_low": rules["humidity_low"],
+        "additional_rules": rules.get("additional_rules", "无其他规则")
+    }
+
 def get_device_type(device_id):
     """
     根据设备ID获取设备类型
@@ -0,0 +1,139 @@
+"""
+设备最新值存储
+
+服务端收到每条遥测数据时按设备、按字段记录最新的值和时间戳，
+查询设备最新数据时直接从内存返回，不再每次向InfluxDB发送 last() 查询。
+本进程没有收到过某设备的数据时（冷启动或数据由其他进程接收），
+由调用方从InfluxDB查询后写入存储，这类数据只在较短的有效期内使用。
+"""
+import threading
+import time
+from collections import OrderedDict
+from line_protocol import NON_FIELD_KEYS, timestamp_to_ns
+
+# 数据来源
+SOURCE_INGEST = "ingest"
+SOURCE_QUERY = "query"
+
+_SCALAR_TYPES = (bool, int, float, str)
+
+class _DeviceValues:
+    """一个设备的各字段最新值"""
+    __slots__ = ("fields", "source", "refreshed_at")
+
+    def __init__(self, source):
+        self.fields = {}          # 字段名 -> (值, 时间戳秒)
+        self.source = source
+        self.refreshed_at = time.time()
+
+class LastValueStore:
+    """按设备、按字段保存最新值和时间戳，线程安全"""
+
+    def __init__(self, max_devices=100000, query_ttl=60.0):
+        """
+        :param max_devices: 保存的设备数上限，超过后淘汰最久未更新的设备
+        :param query_ttl: 从InfluxDB查询得到的数据的有效期（秒），过期后需要重新查询
+        """
+        self.max_devices = max_devices
+        self.query_ttl = query_ttl
+        self.devices = OrderedDict()
+        self.counters = {"updates": 0, "seeds": 0, "hits": 0, "misses": 0, "evicted": 0}
+        self._lock = threading.Lock()
+
+    def _device(self, device_id, source):
+        """获取或创建设备条目，并移到最近更新的位置"""
+        entry = self.devices.get(device_id)
+        if entry is None:
+            entry = self.devices[device_id] = _DeviceValues(source)
+            if len(self.devices) > self.max_devices:
+                self.devices.popitem(last=False)
+                self.counters["evicted"] += 1
+        else:
+            self.devices.move_to_end(device_id)
+        return entry
+
+    def update(self, device_id, data):
+        """
+        记录一条接收到的遥测数据
+        :param device_id: 设备ID
+        :param data: 设备数据字典，timestamp为数据时间，缺失时使用当前时间
+        """
+        if not device_id or not isinstance(data, dict):
+            return
+        timestamp = timestamp_to_ns(data.get("timestamp")) / 1_000_000_000
+        with self._lock:
+            entry = self._device(device_id, SOURCE_INGEST)
+            entry.source = SOURCE_INGEST
+            entry.refreshed_at = time.time()
+            fields = entry.fields
+            for key, value in data.items():
+                if key in NON_FIELD_KEYS or value is None:
+                    continue
+                current = fields.get(key)
+                # 乱序到达的旧数据不覆盖较新的值
+                if current is not None and current[1] > timestamp:
+                    continue
+                if not isinstance(value, _SCALAR_TYPES):
+                    # 与写入InfluxDB时一致，嵌套对象按字符串保存
+                    value = str(value)
+                fields[key] = (value, timestamp)
+            self.counters["updates"] += 1
+
+    def seed(self, device_id, values):
+        """
+        写入从InfluxDB查询得到的最新值
+        :param device_id: 设备ID
+        :param values: {字段名: (值, 时间戳秒)}
+        """
+        if not device_id:
+            return
+        with self._lock:
+            entry = self.devices.get(device_id)
+            if entry is not None and entry.source == SOURCE_INGEST:
+                # 本进程已经在接收该设备的数据，只补充没有的或更旧的字段
+                for key, (value, timestamp) in values.items():
+                    current = entry.fields.get(key)
+                    if current is None or current[1] < timestamp:
+                        entry.fields[key] = (value, timestamp)
+                return
+            entry = self._device(device_id, SOURCE_QUERY)
+            entry.source = SOURCE_QUERY
+            entry.refreshed_at = time.time()
+            entry.fields = dict(values)
+            self.counters["seeds"] += 1
+
+    def get(self, device_id, fields=None, max_age=None):
+        """
+        获取设备最新数据
+        :param device_id: 设备ID
+        :param fields: 要返回的字段列表，为空时返回全部字段
+        :param max_age: 只返回时间戳在最近max_age秒内的字段，为空时不限制
+        :return: {字段名: 值}；没有该设备的数据、查询数据已过期或没有符合条件的字段时返回None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self.devices.get(device_id)
+            if entry is None or (entry.source == SOURCE_QUERY and now - entry.refreshed_at > self.query_ttl):
+                self.counters["misses"] += 1
+                return None
+
+            cutoff = now - max_age if max_age is not None else None
+            items = entry.fields.items()
+            if fields:
+                items = ((key, entry.fields[key]) for key in fields if key in entry.fields)
+            data = {
+                key: value for key, (value, timestamp) in items
+                if cutoff is None or timestamp >= cutoff
+            }
+            if not data:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            return data
+
+    def stats(self):
+        """获取设备数和命中/未命中计数"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["devices"] = len(self.devices)
+        return stats
@@ -0,0 +1,184 @@
+"""
+InfluxDB行协议序列化
+
+把遥测数据字典直接转换为行协议字节串，不再为每条数据创建Point对象。
+measurement和标签部分按 (device_id, device_type, location) 缓存转义后的前缀，
+字段的排序和转义结果按数据的键集合缓存，每条数据只需要格式化字段值和时间戳。
+输出与 build_data_point(...).to_line_protocol() 完全一致（字段和标签按名称排序）。
+"""
+import math
+import time
+from datetime import datetime
+
+# 行协议转义规则，与influxdb_client保持一致
+_ESCAPE_MEASUREMENT = str.maketrans({
+    ",": r"\,",
+    " ": r"\ ",
+    "\n": r"\n",
+    "\t": r"\t",
+    "\r": r"\r"
+})
+_ESCAPE_KEY = str.maketrans({
+    ",": r"\,",
+    "=": r"\=",
+    " ": r"\ ",
+    "\n": r"\n",
+    "\t": r"\t",
+    "\r": r"\r"
+})
+_ESCAPE_STRING = str.maketrans({
+    '"': r"\"",
+    "\\": r"\\"
+})
+
+# 作为标签或时间戳、不写入字段的键
+TAG_KEYS = ("device_id", "device_type", "location")
+NON_FIELD_KEYS = frozenset(TAG_KEYS + ("timestamp",))
+
+# 可以直接格式化的字段值类型
+_FIELD_TYPES = frozenset((float, int, bool, str))
+
+def escape_tag_value(value):
+    """转义标签值，以反斜杠结尾时补一个空格"""
+    escaped = str(value).translate(_ESCAPE_KEY)
+    if escaped.endswith("\\"):
+        escaped += " "
+    return escaped
+
+def format_field_value(value):
+    """
+    格式化字段值
+    :param value: 字段值
+    :return: 行协议中的值文本，无法写入的值（NaN、无穷大）返回None
+    """
+    value_type = type(value)
+    if value_type is float:
+        if not math.isfinite(value):
+            return None
+        text = repr(value)
+        # 整数值的浮点数去掉末尾的.0
+        return text[:-2] if text.endswith(".0") else text
+    if value_type is bool:
+        return "true" if value else "false"
+    if value_type is int:
+        return f"{value}i"
+    return '"' + str(value).translate(_ESCAPE_STRING) + '"'
+
+def timestamp_to_ns(timestamp):
+    """
+    把遥测数据中的时间戳转换为纳秒
+    :param timestamp: Unix时间戳（秒）或ISO 8601字符串
+    :return: 纳秒时间戳，无法解析或为空时使用当前时间
+    """
+    if not timestamp:
+        return time.time_ns()
+    timestamp_type = type(timestamp)
+    if timestamp_type is float or timestamp_type is int:
+        return int(timestamp * 1_000_000_000)
+    if timestamp_type is str:
+        try:
+            dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+            return int(dt.timestamp() * 1_000_000_000)
+        except ValueError:
+            pass
+    return time.time_ns()
+
+class LineProtocolSerializer:
+    """把设备遥测数据序列化为行协议，缓存标签前缀和字段名"""
+
+    def __init__(self, measurement, cache_size=10000):
+        """
+        :param measurement: measurement名称
+        :param cache_size: 标签前缀和字段名缓存的条数上限
+        """
+        self.measurement = measurement
+        self.escaped_measurement = str(measurement).translate(_ESCAPE_MEASUREMENT)
+        self.cache_size = cache_size
+        self._prefixes = {}
+        # 数据的键集合 -> 按名称排序的 [(字段名, 转义后的"字段名=")]
+        self._layouts = {}
+
+    def prefix(self, device_id, device_type=None, location=None):
+        """
+        获取measurement和标签部分（以空格结尾）
+        :param device_id: 设备ID
+        :param device_type: 设备类型
+        :param location: 位置
+        :return: 转义后的前缀
+        """
+        key = (device_id, device_type, location)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            parts = [self.escaped_measurement]
+            for tag_key, tag_value in zip(TAG_KEYS, key):
+                if tag_value is None:
+                    continue
+                escaped = escape_tag_value(tag_value)
+                if escaped:
+                    parts.append(f"{tag_key}={escaped}")
+            prefix = ",".join(parts) + " "
+            if len(self._prefixes) >= self.cache_size:
+                self._prefixes.clear()
+            self._prefixes[key] = prefix
+        return prefix
+
+    def _layout(self, data):
+        """获取字段的排序和转义结果，同一设备每次上报的键相同，只需计算一次"""
+        keys = tuple(data)
+        layout = self._layouts.get(keys)
+        if layout is None:
+            layout = [
+                (key, str(key).translate(_ESCAPE_KEY) + "=")
+                for key in sorted(keys) if key not in NON_FIELD_KEYS
+            ]
+            if len(self._layouts) >= self.cache_size:
+                self._layouts.clear()
+            self._layouts[keys] = layout
+        return layout
+
+    def serialize_line(self, device_id, data):
+        """
+        把一条设备数据序列化为一行行协议
+        :param device_id: 设备ID
+        :param data: 设备数据字典
+        :return: 行协议文本，没有可写入的字段时返回None
+        """
+        fields = []
+        for key, escaped_key in self._layout(data):
+            value = data[key]
+            value_type = type(value)
+            if value_type is float:
+                if math.isfinite(value):
+                    text = repr(value)
+                    fields.append(escaped_key + (text[:-2] if text.endswith(".0") else text))
+            elif value_type is int:
+                fields.append(f"{escaped_key}{value}i")
+            elif value_type is str:
+                fields.append(escaped_key + '"' + value.translate(_ESCAPE_STRING) + '"')
+            else:
+                if value_type not in _FIELD_TYPES:
+                    if isinstance(value, float):
+                        value = float(value)
+                    elif isinstance(value, int):
+                        value = int(value)
+                    else:
+                        # 嵌套对象、None等其他类型按字符串写入
+                        value = str(value)
+                text = format_field_value(value)
+                if text is not None:
+                    fields.append(escaped_key + text)
+        if not fields:
+            return None
+
+        prefix = self.prefix(device_id, data.get("device_type"), data.get("location"))
+        return f"{prefix}{','.join(fields)} {timestamp_to_ns(data.get('timestamp'))}"
+
+    def serialize(self, device_id, data):
+        """
+        把一条设备数据序列化为行协议字节串
+        :param device_id: 设备ID
+        :param data: 设备数据字典
+        :return: bytes，没有可写入的字段时返回None
+        """
+        line = self.serialize_line(device_id, data)
+        return line.encode("utf-8") if line is not None else None
@@ -1,9 +1,12 @@
 import paho.mqtt.client as mqtt
-import json
 import time
 import logging
-from config import MQTT_CONFIG, LOG_CONFIG
-from langchain_processor import process_device_data
+from config import MQTT_CONFIG, PIPELINE_CONFIG, INGEST_CONFIG, LOG_CONFIG
+from codec import decode_message, encode_json, CodecError
+from langchain_processor import process_device_data, process_device_data_batch, get_device_executor
+from ingest_pipeline import PriorityIngestPipeline
+from topic_router import TopicRouter
+from telemetry_delta import DeltaReassembler
 
 # 配置日志
 logging.basicConfig(
@@ -14,8 +17,17 @@ logging.basicConfig(
 logger = logging.getLogger("mqtt_client")
 
 class MQTTClient:
-    def __init__(self):
-        self.client = mqtt.Client()
+    def __init__(self, client_id="", subscribe_topics=None, protocol=mqtt.MQTTv311, delta_enabled=None):
+        """
+        :param client_id: MQTT客户端ID，为空时由代理服务器分配
+        :param subscribe_topics: 订阅的主题列表，默认使用MQTT_CONFIG["subscribe_topics"]
+        :param protocol: MQTT协议版本，共享订阅需要mqtt.MQTTv5
+        :param delta_enabled: 是否允许设备发送增量帧，默认按INGEST_CONFIG["workers"]决定：配置了多进程接入时
+                              同一设备的帧会分到不同进程，无法按序号合并，所有进程（包括Web服务的客户端）都不启用，
+                              否则设备收到的字段字典确认互相矛盾
+        """
+        self.client = mqtt.Client(client_id=client_id, protocol=protocol)
+        self.subscribe_topics = subscribe_topics or MQTT_CONFIG["subscribe_topics"]
         self.client.username_pw_set(
             MQTT_CONFIG["username"], 
             MQTT_CONFIG["password"]
@@ -24,10 +36,35 @@ class MQTTClient:
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         self.connected = False
+        # 字段字典确认中告知设备的服务端功能
+        if delta_enabled is None:
+            delta_enabled = INGEST_CONFIG["workers"] == 0
+        self.features = ["delta"] if delta_enabled else []
+        
+        # 消息处理流水线，网络线程只负责解码和入队。
+        # 按主题优先级分类，遥测数据与process_device_data共用按设备分片的执行器，
+        # 启用微批模式时遥测数据按批处理
+        self.pipeline = PriorityIngestPipeline(
+            process_device_data,
+            batch_handler=process_device_data_batch,
+            executor=get_device_executor()
+        )
+        
+        # 在网络线程中直接处理、不进入流水线的主题
+        self.local_routes = TopicRouter()
+        self.local_routes.add("device/{device_id}/schema", self.on_device_schema)
+        
+        # 增量帧合并，在网络线程中按到达顺序执行
+        self.reassembler = DeltaReassembler(
+            self.request_keyframe,
+            PIPELINE_CONFIG["keyframe_request_interval"],
+            metrics=self.pipeline.metrics
+        )
         
     def connect(self):
         """连接到MQTT代理服务器"""
         try:
+            self.pipeline.start()
             self.client.connect(
                 MQTT_CONFIG["broker_host"],
                 MQTT_CONFIG["broker_port"],
@@ -40,13 +77,13 @@ class MQTTClient:
             logger.error(f"MQTT连接失败: {str(e)}")
             return False
             
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         """连接回调函数"""
         if rc == 0:
             logger.info("已连接到MQTT代理服务器")
             self.connected = True
             # 订阅设备数据主题
-            for topic in MQTT_CONFIG["subscribe_topics"]:
+            for topic in self.subscribe_topics:
                 self.client.subscribe(topic)
                 logger.info(f"已订阅主题: {topic}")
         else:
@@ -54,23 +91,51 @@ class MQTTClient:
             
     def on_message(self, client, userdata, msg):
         """消息接收回调函数"""
+        received_at = time.perf_counter()
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
-            logger.debug(f"收到消息，主题: {topic}，内容: {payload}")
+            logger.debug("收到消息，主题: %s，内容: %s", topic, msg.payload)
             
-            # 解析JSON数据
+            # 直接从bytes解析JSON并按主题校验负载结构
             try:
-                data = json.loads(payload)
-                # 将消息传递给LangChain处理器进行处理
-                process_device_data(topic, data)
-            except json.JSONDecodeError:
-                logger.warning(f"无法解析JSON数据: {payload}")
+                data = decode_message(topic, msg.payload)
+                self.pipeline.metrics.observe("decode", time.perf_counter() - received_at)
+                if self.local_routes.dispatch(topic, data):
+                    return
+                data = self.reassembler.apply(data)
+                # 放入处理队列，由工作线程交给LangChain处理器处理
+                self.pipeline.submit(topic, data, received_at)
+            except CodecError as e:
+                self.pipeline.metrics.incr("decode_errors")
+                logger.warning(f"消息解码失败，主题: {topic}，{str(e)}")
                 
         except Exception as e:
             logger.error(f"处理消息时出错: {str(e)}")
             
-    def on_disconnect(self, client, userdata, rc):
+    def on_device_schema(self, schema, device_id):
+        """
+        设备发布了二进制遥测字段字典，解码器已在解码时记录，回复确认后设备改用二进制发送
+        :param schema: 字段字典负载
+        :param device_id: 设备ID
+        """
+        logger.info(f"已记录设备 {device_id} 的二进制字段字典 {schema['schema_id']}，字段数: {len(schema['fields'])}")
+        self.publish(
+            MQTT_CONFIG["publish_topics"]["schema_ack"].format(device_id=device_id),
+            {"schema_id": schema["schema_id"], "encoding": schema.get("encoding", "struct"), "features": self.features}
+        )
+        
+    def request_keyframe(self, device_id):
+        """
+        请求设备在下一帧发送关键帧
+        :param device_id: 设备ID
+        """
+        logger.info(f"设备 {device_id} 的增量帧序号不连续，请求关键帧")
+        self.publish(
+            MQTT_CONFIG["publish_topics"]["keyframe_request"].format(device_id=device_id),
+            {"device_id": device_id, "timestamp": time.time()}
+        )
+        
+    def on_disconnect(self, client, userdata, rc, properties=None):
         """断开连接回调函数"""
         self.connected = False
         if rc != 0:
@@ -85,7 +150,7 @@ class MQTTClient:
         """发布消息到指定主题"""
         try:
             if isinstance(message, dict):
-                message = json.dumps(message)
+                message = encode_json(message)
                 
             result = self.client.publish(topic, message)
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
@@ -102,6 +167,7 @@ class MQTTClient:
         """断开MQTT连接"""
         self.client.loop_stop()
         self.client.disconnect()
+        self.pipeline.stop()
         logger.info("MQTT客户端已停止")
 
 # 单例模式实现
@@ -111,6 +177,16 @@ def get_mqtt_client():
     """获取MQTT客户端单例"""
     return mqtt_client
 
+def init_mqtt_client(**kwargs):
+    """
+    用指定参数重新创建MQTT客户端单例，供多进程接入的工作进程在连接前调用
+    :param kwargs: 传给MQTTClient的参数
+    :return: 新的MQTT客户端单例
+    """
+    global mqtt_client
+    mqtt_client = MQTTClient(**kwargs)
+    return mqtt_client
+
 if __name__ == "__main__":
     # 测试代码
     client = get_mqtt_client()
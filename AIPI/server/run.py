@@ -5,7 +5,7 @@ import time
 import logging
 import threading
 import argparse
-from config import LOG_CONFIG
+from config import LOG_CONFIG, INGEST_CONFIG
 
 # 配置日志
 logging.basicConfig(
@@ -30,6 +30,30 @@ def start_mqtt_client():
         logger.error("MQTT客户端启动失败")
         return None
 
+def start_ingest_workers(num_workers):
+    """
+    启动多进程数据接入，每个进程通过MQTT v5共享订阅分摊设备消息
+    :param num_workers: 接入进程数
+    :return: 监督器对象
+    """
+    from ingest_supervisor import IngestSupervisor
+    
+    logger.info(f"正在启动多进程数据接入，进程数: {num_workers}...")
+    supervisor = IngestSupervisor(num_workers)
+    supervisor.start()
+    return supervisor
+
+def start_async_mqtt_service():
+    """以asyncio模式启动MQTT数据接入（在主线程运行事件循环）"""
+    import asyncio
+    from async_mqtt_client import run_async_ingest
+    
+    logger.info("正在以asyncio模式启动MQTT数据接入...")
+    try:
+        asyncio.run(run_async_ingest())
+    except KeyboardInterrupt:
+        logger.info("接收到退出信号")
+
 def start_web_server(background=True):
     """
     启动Web服务器
@@ -95,6 +119,18 @@ def start_alert_checker(background=True):
         run_scheduled_checks()
         return None
 
+def start_rollup_maintenance():
+    """启动降采样维护线程，在后台创建或更新InfluxDB降采样bucket和任务并定期检查"""
+    from influx_writer import get_rollup_manager
+    
+    return get_rollup_manager()
+
+def start_write_spool():
+    """启动InfluxDB磁盘写入缓冲，重放上次运行留下的数据（包括已不存在的进程留下的槽位）"""
+    from influx_writer import start_write_spool as start_spool
+    
+    return start_spool()
+
 def cleanup():
     """清理资源"""
     from device_controller import cleanup as device_cleanup
@@ -113,11 +149,16 @@ def cleanup():
 def run_all_services():
     """运行所有服务"""
     try:
-        # 启动MQTT客户端
-        mqtt_client = start_mqtt_client()
-        if not mqtt_client:
-            logger.error("无法启动MQTT客户端，程序退出")
-            return False
+        # 启动MQTT客户端，配置了多个接入进程时改用多进程接入
+        mqtt_client = None
+        ingest_supervisor = None
+        if INGEST_CONFIG["workers"] > 0:
+            ingest_supervisor = start_ingest_workers(INGEST_CONFIG["workers"])
+        else:
+            mqtt_client = start_mqtt_client()
+            if not mqtt_client:
+                logger.error("无法启动MQTT客户端，程序退出")
+                return False
             
         # 启动Web服务器（后台）
         web_thread = start_web_server(background=True)
@@ -128,6 +169,12 @@ def run_all_services():
         # 启动告警检查（后台）
         alert_thread = start_alert_checker(background=True)
         
+        # 维护降采样任务（后台）
+        start_rollup_maintenance()
+        
+        # 重放磁盘写入缓冲中的数据（后台线程）
+        start_write_spool()
+        
         logger.info("所有服务已启动，按Ctrl+C退出")
         
         # 保持主线程运行
@@ -149,6 +196,8 @@ def run_all_services():
         # 断开MQTT连接
         if mqtt_client:
             mqtt_client.disconnect()
+        if ingest_supervisor:
+            ingest_supervisor.stop()
             
         return True
         
@@ -159,6 +208,9 @@ def run_all_services():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="AI MQTT LangChain平台启动器")
     parser.add_argument("--mqtt", action="store_true", help="只启动MQTT客户端")
+    parser.add_argument("--async-mqtt", action="store_true", help="只启动asyncio模式的MQTT数据接入")
+    parser.add_argument("--ingest-workers", type=int, metavar="K",
+                        help="以K个进程启动MQTT数据接入（MQTT v5共享订阅）")
     parser.add_argument("--web", action="store_true", help="只启动Web服务器")
     parser.add_argument("--api", action="store_true", help="只启动API服务器")
     parser.add_argument("--alert", action="store_true", help="只启动告警检查服务")
@@ -173,6 +225,7 @@ if __name__ == "__main__":
             if not mqtt_client:
                 logger.error("无法启动MQTT客户端，程序退出")
                 sys.exit(1)
+            start_write_spool()
                 
             try:
                 while True:
@@ -183,6 +236,23 @@ if __name__ == "__main__":
             if mqtt_client:
                 mqtt_client.disconnect()
                 
+        elif args.ingest_workers:
+            # 只启动多进程MQTT数据接入
+            ingest_supervisor = start_ingest_workers(args.ingest_workers)
+            start_write_spool()
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                logger.info("接收到退出信号")
+                
+            ingest_supervisor.stop()
+                
+        elif args.async_mqtt:
+            # 只启动asyncio模式的MQTT数据接入
+            start_write_spool()
+            start_async_mqtt_service()
+                
         elif args.web:
             # 只启动Web服务器
             start_web_server(background=False)
@@ -0,0 +1,177 @@
+"""
+分片执行器 - 同一个键的任务按提交顺序串行执行，不同键的任务并行执行
+
+每个分片(lane)是一个单线程工作者和一个有界队列，任务按键的哈希值分配到分片，
+因此同一设备的数据始终由同一个线程按顺序处理。
+"""
+import logging
+import queue
+import threading
+import zlib
+from concurrent.futures import Future
+from config import LOG_CONFIG
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("sharded_executor")
+
+# 分片线程退出标记
+_STOP = object()
+
+class _Lane:
+    """单个分片：一个有界队列和一个工作线程"""
+
+    def __init__(self, index, queue_size, name):
+        self.index = index
+        self.name = f"{name}-lane-{index}"
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.submitted = 0
+        self.completed = 0
+        self.max_depth = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+
+                future, fn, args, kwargs = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+                finally:
+                    self.completed += 1
+            finally:
+                self.queue.task_done()
+
+class ShardedExecutor:
+    """按键分片的执行器，保证同一键内有序、不同键之间并行"""
+
+    def __init__(self, num_lanes=4, lane_queue_size=1000, name="shard"):
+        """
+        :param num_lanes: 分片数量（即并行线程数）
+        :param lane_queue_size: 每个分片的队列容量
+        :param name: 执行器名称，用于线程命名和日志
+        """
+        self.num_lanes = max(1, int(num_lanes))
+        self.lane_queue_size = max(1, int(lane_queue_size))
+        self.name = name
+        self.lanes = [_Lane(i, self.lane_queue_size, name) for i in range(self.num_lanes)]
+        self.running = False
+        self._lock = threading.Lock()
+
+    def lane_for(self, key):
+        """
+        计算键对应的分片编号
+        使用crc32而不是hash()，保证在不同进程和重启之间分配结果一致
+        """
+        return zlib.crc32(str(key).encode("utf-8")) % self.num_lanes
+
+    def start(self):
+        """启动所有分片线程，重复调用不会重复启动"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            for lane in self.lanes:
+                lane.start()
+        logger.info(f"分片执行器 {self.name} 已启动，分片数: {self.num_lanes}")
+
+    def try_submit(self, key, fn, *args, timeout=0, **kwargs):
+        """
+        提交任务，分片队列已满时返回None
+        :param key: 分片键（例如设备ID）
+        :param fn: 要执行的函数
+        :param timeout: 队列满时最长等待时间（秒），0表示不等待
+        :return: Future对象，提交失败返回None
+        """
+        if not self.running:
+            self.start()
+
+        lane = self.lanes[self.lane_for(key)]
+        future = Future()
+        item = (future, fn, args, kwargs)
+        try:
+            if timeout and timeout > 0:
+                lane.queue.put(item, timeout=timeout)
+            else:
+                lane.queue.put_nowait(item)
+        except queue.Full:
+            return None
+
+        lane.submitted += 1
+        depth = lane.queue.qsize()
+        if depth > lane.max_depth:
+            lane.max_depth = depth
+        return future
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        提交任务，分片队列已满时阻塞等待
+        :param key: 分片键（例如设备ID）
+        :param fn: 要执行的函数
+        :return: Future对象
+        """
+        if not self.running:
+            self.start()
+
+        lane = self.lanes[self.lane_for(key)]
+        future = Future()
+        lane.queue.put((future, fn, args, kwargs))
+        lane.submitted += 1
+        return future
+
+    def shutdown(self, wait=True, timeout=5.0):
+        """
+        停止所有分片线程，已入队的任务会先执行完
+        :param wait: 是否等待线程退出
+        :param timeout: 每个线程的最长等待时间（秒）
+        """
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+
+        for lane in self.lanes:
+            lane.queue.put(_STOP)
+        if wait:
+            for lane in self.lanes:
+                if lane.thread:
+                    lane.thread.join(timeout=timeout)
+        logger.info(f"分片执行器 {self.name} 已停止")
+
+    def depth(self):
+        """所有分片中等待执行的任务总数"""
+        return sum(lane.queue.qsize() for lane in self.lanes)
+
+    def stats(self):
+        """获取各分片的队列深度和执行计数"""
+        return {
+            "lanes": self.num_lanes,
+            "lane_capacity": self.lane_queue_size,
+            "depth": self.depth(),
+            "per_lane": [
+                {
+                    "lane": lane.index,
+                    "depth": lane.queue.qsize(),
+                    "max_depth": lane.max_depth,
+                    "submitted": lane.submitted,
+                    "completed": lane.completed
+                }
+                for lane in self.lanes
+            ]
+        }
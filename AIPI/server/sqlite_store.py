@@ -0,0 +1,599 @@
+"""
+嵌入式时序存储（SQLite）
+
+不部署InfluxDB时（边缘节点、CI）使用的本地存储，写入和查询接口与influx_writer中的函数对应。
+数据库使用WAL模式，写入不阻塞读取；设备数据按时间分区存放在 points_YYYYMMDDHH 表中，
+每个分区表建有 (device_id, time) 索引，超过保留期的分区直接删除整张表。
+每条数据的每个字段一行，时间为纳秒时间戳；latest表记录每个设备各字段的最新值，查询最新数据不扫描分区表。
+多个进程可以同时打开同一个数据库（接入进程写入，API进程查询）：查询时从partitions表读取分区列表，
+能看到其他进程之后创建的分区；分区表在查询期间被其他进程清理删除时跳过该分区或重新获取分区后重试。
+"""
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from config import LOG_CONFIG
+from line_protocol import NON_FIELD_KEYS, timestamp_to_ns
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("sqlite_store")
+
+# 历史查询支持的聚合函数对应的SQL
+_AGGREGATES = {
+    "mean": "avg(value)",
+    "max": "max(value)",
+    "min": "min(value)",
+    "last": "value"
+}
+
+# 数值字段的条件，聚合时跳过字符串字段
+_NUMERIC_CONDITION = "typeof(value) IN ('integer', 'real')"
+
+# 一条IN查询包含的设备数
+_IN_CHUNK = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS partitions (
+    name TEXT PRIMARY KEY,
+    start_ns INTEGER NOT NULL,
+    end_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS latest (
+    device_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    value,
+    PRIMARY KEY (device_id, field)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    device_type TEXT,
+    location TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    time INTEGER NOT NULL,
+    device_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_device_time ON events (device_id, time);
+CREATE TABLE IF NOT EXISTS records (
+    time INTEGER NOT NULL,
+    measurement TEXT NOT NULL,
+    device_id TEXT NOT NULL,
+    tags TEXT,
+    fields TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_records_device_time ON records (measurement, device_id, time);
+"""
+
+def _field_value(value):
+    """转换为SQLite可保存的字段值，无法保存的值返回None"""
+    value_type = type(value)
+    if value_type is float:
+        return value if math.isfinite(value) else None
+    if value_type is int or value_type is str:
+        return value
+    if value_type is bool:
+        return int(value)
+    if isinstance(value, (int, float)):
+        return _field_value(float(value) if isinstance(value, float) else int(value))
+    if value is None:
+        return None
+    # 与行协议序列化一致，其他类型按字符串保存
+    return str(value)
+
+def _to_datetime(time_ns):
+    return datetime.fromtimestamp(time_ns / 1e9, tz=timezone.utc)
+
+def _is_missing_table(error):
+    """分区表已被删除（例如其他进程清理了过期数据）"""
+    return isinstance(error, sqlite3.OperationalError) and "no such table" in str(error)
+
+class SQLiteStore:
+    """按时间分区的SQLite时序存储"""
+
+    def __init__(self, path, partition_hours=24, retention_days=30, prune_interval=3600, synchronous="NORMAL"):
+        """
+        :param path: 数据库文件路径
+        :param partition_hours: 每个分区表覆盖的小时数
+        :param retention_days: 数据保留天数，0表示不删除
+        :param prune_interval: 两次清理过期数据的最短间隔（秒）
+        :param synchronous: SQLite的synchronous设置，WAL模式下NORMAL只在检查点时fsync
+        """
+        self.path = path
+        self.partition_ns = max(1, int(partition_hours)) * 3600 * 1_000_000_000
+        self.retention_ns = int(retention_days * 86400 * 1_000_000_000) if retention_days else 0
+        self.prune_interval = prune_interval
+        self.synchronous = synchronous
+        self.last_prune = 0
+        self.written = 0
+        self.pruned_partitions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.executescript(_SCHEMA)
+        # 分区表名 -> (起始纳秒, 结束纳秒)
+        self._partitions = self._load_partitions()
+        logger.info(f"SQLite时序存储已打开: {path}，分区 {len(self._partitions)} 个")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={self.synchronous}")
+        connection.execute("PRAGMA busy_timeout=5000")
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+
+    def _load_partitions(self):
+        return {
+            name: (start_ns, end_ns)
+            for name, start_ns, end_ns in self._writer.execute("SELECT name, start_ns, end_ns FROM partitions")
+        }
+
+    def _reader(self):
+        """每个线程使用自己的读连接，WAL模式下读取不等待写入"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    # ---------------- 写入 ----------------
+
+    def _partition(self, time_ns):
+        """获取时间所在的分区表，不存在时创建（调用方持有写锁）"""
+        start_ns = time_ns - time_ns % self.partition_ns
+        name = "points_" + _to_datetime(start_ns).strftime("%Y%m%d%H")
+        if name not in self._partitions:
+            end_ns = start_ns + self.partition_ns
+            self._writer.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} (time INTEGER NOT NULL, device_id TEXT NOT NULL, field TEXT NOT NULL, value)"
+            )
+            self._writer.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_device_time ON {name} (device_id, time)")
+            self._writer.execute(
+                "INSERT OR REPLACE INTO partitions (name, start_ns, end_ns) VALUES (?, ?, ?)",
+                (name, start_ns, end_ns)
+            )
+            self._partitions[name] = (start_ns, end_ns)
+        return name
+
+    def write_records(self, records):
+        """
+        在一个事务中写入多条设备数据
+        :param records: [(device_id, data), ...]
+        :raises sqlite3.Error: 写入失败
+        """
+        rows_by_partition = {}
+        latest_rows = []
+        device_rows = {}
+        for device_id, data in records:
+            time_ns = timestamp_to_ns(data.get("timestamp"))
+            rows = None
+            for key, value in data.items():
+                if key in NON_FIELD_KEYS:
+                    continue
+                value = _field_value(value)
+                if value is None:
+                    continue
+                if rows is None:
+                    rows = rows_by_partition.setdefault(time_ns - time_ns % self.partition_ns, [])
+                rows.append((time_ns, device_id, key, value))
+                latest_rows.append((device_id, key, time_ns, value))
+            if "device_type" in data or "location" in data:
+                device_rows[device_id] = (device_id, data.get("device_type"), data.get("location"))
+        if not latest_rows:
+            return
+
+        with self._write_lock:
+            try:
+                self._write_transaction(rows_by_partition, latest_rows, device_rows)
+            except sqlite3.OperationalError as e:
+                if not _is_missing_table(e):
+                    raise
+                # 缓存中的分区表已被其他进程删除，按数据库中的分区重新创建后重试
+                self._write_transaction(rows_by_partition, latest_rows, device_rows)
+            self.written += len(latest_rows)
+        self.prune_once()
+
+    def _write_transaction(self, rows_by_partition, latest_rows, device_rows):
+        """在一个事务中写入数据点、最新值和设备标签（调用方持有写锁），失败时回滚"""
+        self._writer.execute("BEGIN")
+        try:
+            for start_ns, rows in rows_by_partition.items():
+                name = self._partition(start_ns)
+                self._writer.executemany(
+                    f"INSERT INTO {name} (time, device_id, field, value) VALUES (?, ?, ?, ?)", rows
+                )
+            self._writer.executemany(
+                "INSERT INTO latest (device_id, field, time, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (device_id, field) DO UPDATE SET time = excluded.time, value = excluded.value "
+                "WHERE excluded.time >= latest.time",
+                latest_rows
+            )
+            if device_rows:
+                self._writer.executemany(
+                    "INSERT INTO devices (device_id, device_type, location) VALUES (?, ?, ?) "
+                    "ON CONFLICT (device_id) DO UPDATE SET "
+                    "device_type = coalesce(excluded.device_type, devices.device_type), "
+                    "location = coalesce(excluded.location, devices.location)",
+                    list(device_rows.values())
+                )
+            self._writer.execute("COMMIT")
+        except Exception:
+            self._writer.execute("ROLLBACK")
+            # 回滚会撤销本事务中创建的分区表
+            self._partitions = self._load_partitions()
+            raise
+
+    def write_event(self, device_id, event_type, description, severity="info", time_ns=None):
+        """
+        写入事件
+        :param device_id: 设备ID
+        :param event_type: 事件类型
+        :param description: 事件描述
+        :param severity: 事件严重性
+        :param time_ns: 纳秒时间戳，为空时使用当前时间
+        """
+        with self._write_lock:
+            self._writer.execute(
+                "INSERT INTO events (time, device_id, event_type, severity, description) VALUES (?, ?, ?, ?, ?)",
+                (time_ns or time.time_ns(), device_id, event_type, severity, description)
+            )
+
+    def write_record(self, measurement, device_id, tags, fields, time_ns=None):
+        """
+        写入命令结果、告警等记录，标签和字段按JSON保存
+        :param measurement: measurement名称
+        :param device_id: 设备ID
+        :param tags: 标签字典
+        :param fields: 字段字典
+        :param time_ns: 纳秒时间戳，为空时使用当前时间
+        """
+        with self._write_lock:
+            self._writer.execute(
+                "INSERT INTO records (time, measurement, device_id, tags, fields) VALUES (?, ?, ?, ?, ?)",
+                (
+                    time_ns or time.time_ns(), measurement, device_id,
+                    json.dumps(tags, ensure_ascii=False, default=str),
+                    json.dumps(fields, ensure_ascii=False, default=str)
+                )
+            )
+
+    # ---------------- 保留期 ----------------
+
+    def prune(self, now_ns=None):
+        """
+        删除超过保留期的数据：整个分区都已过期时删除分区表，latest和events按时间删除
+        :param now_ns: 当前纳秒时间戳，为空时使用当前时间
+        :return: 删除的分区数
+        """
+        self.last_prune = time.time()
+        if not self.retention_ns:
+            return 0
+        cutoff_ns = (now_ns or time.time_ns()) - self.retention_ns
+        with self._write_lock:
+            # 其他进程可能创建或删除了分区
+            self._partitions = self._load_partitions()
+            expired = [name for name, (_, end_ns) in self._partitions.items() if end_ns <= cutoff_ns]
+            for name in expired:
+                self._writer.execute(f"DROP TABLE IF EXISTS {name}")
+                self._writer.execute("DELETE FROM partitions WHERE name = ?", (name,))
+                del self._partitions[name]
+            self._writer.execute("DELETE FROM latest WHERE time < ?", (cutoff_ns,))
+            self._writer.execute("DELETE FROM events WHERE time < ?", (cutoff_ns,))
+            self._writer.execute("DELETE FROM records WHERE time < ?", (cutoff_ns,))
+        if expired:
+            self.pruned_partitions += len(expired)
+            logger.info(f"已删除 {len(expired)} 个过期的数据分区")
+        return len(expired)
+
+    def prune_once(self):
+        """距离上次清理超过prune_interval时清理一次过期数据"""
+        if time.time() - self.last_prune < self.prune_interval:
+            return
+        try:
+            self.prune()
+        except sqlite3.Error as e:
+            logger.error(f"清理过期数据时出错: {str(e)}")
+
+    # ---------------- 查询 ----------------
+
+    def _partitions_between(self, start_ns, stop_ns):
+        """获取与时间范围重叠的分区表，按时间排序；每次从partitions表读取，能看到其他进程创建的分区"""
+        rows = self._reader().execute(
+            "SELECT name FROM partitions WHERE start_ns < ? AND end_ns > ? ORDER BY start_ns",
+            (stop_ns, start_ns)
+        )
+        return [name for name, in rows]
+
+    def _execute_union(self, start_ns, stop_ns, conditions, params, build):
+        """
+        执行跨分区查询，分区表在查询前被其他进程删除时重新获取分区后重试一次
+        :param build: build(子查询SQL, 子查询参数)，返回 (SQL, 参数)
+        :return: 游标，没有重叠的分区时返回None
+        """
+        for attempt in range(2):
+            source, source_params = self._union(start_ns, stop_ns, conditions, params)
+            if source is None:
+                return None
+            sql, sql_params = build(source, source_params)
+            try:
+                return self._reader().execute(sql, sql_params)
+            except sqlite3.OperationalError as e:
+                if attempt or not _is_missing_table(e):
+                    raise
+                logger.debug(f"分区表已被删除，重新获取分区: {str(e)}")
+
+    def _execute_partition(self, sql, params):
+        """查询单个分区表，分区表已被其他进程删除（数据已过期）时返回空列表"""
+        try:
+            return self._reader().execute(sql, params)
+        except sqlite3.OperationalError as e:
+            if not _is_missing_table(e):
+                raise
+            return []
+
+    def _union(self, start_ns, stop_ns, conditions, params, columns="time, device_id, field, value"):
+        """
+        生成跨分区查询的子查询
+        :return: (SQL, 参数)，没有重叠的分区时返回 (None, None)
+        """
+        names = self._partitions_between(start_ns, stop_ns)
+        if not names:
+            return None, None
+        where = " AND ".join(["time >= ?", "time < ?"] + conditions)
+        sql = " UNION ALL ".join(f"SELECT {columns} FROM {name} WHERE {where}" for name in names)
+        return sql, [start_ns, stop_ns, *params] * len(names)
+
+    @staticmethod
+    def _field_condition(fields):
+        if not fields:
+            return [], []
+        return [f"field IN ({', '.join('?' * len(fields))})"], list(fields)
+
+    def query_latest(self, device_id, fields=None, since_ns=0):
+        """
+        查询设备各字段的最新值
+        :param device_id: 设备ID
+        :param fields: 字段列表，为空时返回全部字段
+        :param since_ns: 只返回此时间之后的值
+        :return: {字段名: (值, 时间戳秒)}
+        """
+        field_conditions, field_params = self._field_condition(fields)
+        sql = " AND ".join(["SELECT field, value, time FROM latest WHERE device_id = ?", "time >= ?"] + field_conditions)
+        rows = self._reader().execute(sql, [device_id, since_ns, *field_params])
+        return {field: (value, time_ns / 1e9) for field, value, time_ns in rows}
+
+    def query_latest_batch(self, device_ids=None, fields=None, since_ns=0):
+        """
+        批量查询多个设备的最新值
+        :param device_ids: 设备ID列表，为None时返回时间范围内有数据的所有设备
+        :param fields: 字段列表，为空时返回全部字段
+        :param since_ns: 只返回此时间之后的值
+        :return: 生成器，产出 (device_id, {字段名: (值, 时间戳秒)})
+        """
+        field_conditions, field_params = self._field_condition(fields)
+        if device_ids is None:
+            chunks = [None]
+        else:
+            device_ids = list(device_ids)
+            chunks = [device_ids[i:i + _IN_CHUNK] for i in range(0, len(device_ids), _IN_CHUNK)]
+        for chunk in chunks:
+            conditions = ["time >= ?"] + field_conditions
+            params = [since_ns, *field_params]
+            if chunk is not None:
+                conditions.append(f"device_id IN ({', '.join('?' * len(chunk))})")
+                params.extend(chunk)
+            sql = f"SELECT device_id, field, value, time FROM latest WHERE {' AND '.join(conditions)} ORDER BY device_id"
+            current_id = None
+            values = {}
+            for device_id, field, value, time_ns in self._reader().execute(sql, params):
+                if device_id != current_id:
+                    if values:
+                        yield current_id, values
+                    current_id = device_id
+                    values = {}
+                values[field] = (value, time_ns / 1e9)
+            if values:
+                yield current_id, values
+
+    def query_history(self, device_id, start_ns, stop_ns, every_ns, fn="mean", fields=None):
+        """
+        按时间窗口聚合设备历史数据，窗口按Unix纪元对齐，时间为窗口结束时间（与InfluxDB的aggregateWindow一致）
+        :param device_id: 设备ID
+        :param start_ns: 起始纳秒时间戳
+        :param stop_ns: 结束纳秒时间戳
+        :param every_ns: 聚合窗口（纳秒）
+        :param fn: 聚合函数，mean/max/min/last
+        :param fields: 字段列表，为空时查询全部字段
+        :return: {字段名: [[毫秒时间戳, 值], ...]}
+        """
+        if fn not in _AGGREGATES:
+            raise ValueError(f"不支持的聚合函数: {fn}")
+        conditions, params = self._field_condition(fields)
+        conditions = ["device_id = ?"] + conditions
+        params = [device_id] + params
+        if fn != "last":
+            conditions.append(_NUMERIC_CONDITION)
+
+        # last使用SQLite的max()裸列规则，value取自时间最大的行
+        aggregate = _AGGREGATES[fn]
+        extra = ", max(time)" if fn == "last" else ""
+
+        def build(source, source_params):
+            sql = (
+                f"SELECT field, (time / ?) * ? + ? AS window, {aggregate}{extra} FROM ({source}) "
+                f"GROUP BY field, window ORDER BY field, window"
+            )
+            return sql, [every_ns, every_ns, every_ns, *source_params]
+
+        cursor = self._execute_union(start_ns, stop_ns, conditions, params, build)
+        if cursor is None:
+            return {}
+        series = {}
+        for row in cursor:
+            points = series.get(row[0])
+            if points is None:
+                points = series[row[0]] = []
+            points.append([row[1] // 1_000_000, row[2]])
+        return series
+
+    def query_frame(self, start_ns, stop_ns, every_ns, fields=None, device_ids=None):
+        """
+        按设备和时间窗口求平均后把字段转为列
+        :param start_ns: 起始纳秒时间戳
+        :param stop_ns: 结束纳秒时间戳
+        :param every_ns: 聚合窗口（纳秒）
+        :param fields: 字段列表，为空时查询全部数值字段
+        :param device_ids: 设备ID列表，为空时查询全部设备
+        :return: DataFrame，列为 _time、device_id、device_type、location 和各字段
+        """
+        import pandas as pd
+
+        conditions, params = self._field_condition(fields)
+        conditions.append(_NUMERIC_CONDITION)
+        if device_ids:
+            conditions.append(f"device_id IN ({', '.join('?' * len(device_ids))})")
+            params.extend(device_ids)
+
+        def build(source, source_params):
+            sql = (
+                f"SELECT device_id, field, (time / ?) * ? + ? AS window, avg(value) AS value FROM ({source}) "
+                f"GROUP BY device_id, field, window"
+            )
+            return sql, [every_ns, every_ns, every_ns, *source_params]
+
+        cursor = self._execute_union(start_ns, stop_ns, conditions, params, build)
+        if cursor is None:
+            return pd.DataFrame()
+        rows = pd.DataFrame(cursor.fetchall(), columns=["device_id", "field", "window", "value"])
+        if rows.empty:
+            return pd.DataFrame()
+        frame = rows.pivot_table(index=["device_id", "window"], columns="field", values="value", aggfunc="first")
+        frame.columns.name = None
+        frame = frame.reset_index()
+        frame.insert(0, "_time", pd.to_datetime(frame.pop("window"), unit="ns", utc=True))
+
+        tags = pd.read_sql_query("SELECT device_id, device_type, location FROM devices", self._reader())
+        return frame.merge(tags, on="device_id", how="left")
+
+    def stream(self, device_id, start_ns, stop_ns, fields=None):
+        """
+        按时间顺序逐条读取设备原始数据
+        :param device_id: 设备ID
+        :param start_ns: 起始纳秒时间戳
+        :param stop_ns: 结束纳秒时间戳
+        :param fields: 字段列表，为空时读取全部字段
+        :return: 生成器，产出 (datetime时间, 字段名, 值)
+        """
+        conditions, params = self._field_condition(fields)
+        conditions = ["time >= ?", "time < ?", "device_id = ?"] + conditions
+        where = " AND ".join(conditions)
+        for name in self._partitions_between(start_ns, stop_ns):
+            cursor = self._execute_partition(
+                f"SELECT time, field, value FROM {name} WHERE {where} ORDER BY time",
+                [start_ns, stop_ns, device_id, *params]
+            )
+            for time_ns, field, value in cursor:
+                yield _to_datetime(time_ns), field, value
+
+    def stream_events(self, device_id, start_ns, stop_ns):
+        """
+        按时间顺序读取设备事件
+        :return: 生成器，产出 (datetime时间, 字段名, 值)，每个事件产出event_type、severity和description
+        """
+        cursor = self._reader().execute(
+            "SELECT time, event_type, severity, description FROM events "
+            "WHERE device_id = ? AND time >= ? AND time < ? ORDER BY time",
+            (device_id, start_ns, stop_ns)
+        )
+        for time_ns, event_type, severity, description in cursor:
+            moment = _to_datetime(time_ns)
+            yield moment, "event_type", event_type
+            yield moment, "severity", severity
+            yield moment, "description", description
+
+    def query_records(self, measurement, device_id, start_ns, limit):
+        """
+        查询设备最近的命令结果、告警等记录
+        :return: 记录列表，按时间从新到旧，每条记录包含time（ISO 8601）、device_id、标签和字段
+        """
+        cursor = self._reader().execute(
+            "SELECT time, tags, fields FROM records WHERE measurement = ? AND device_id = ? AND time >= ? "
+            "ORDER BY time DESC LIMIT ?",
+            (measurement, device_id, start_ns, limit)
+        )
+        records = []
+        for time_ns, tags, fields in cursor:
+            record = {"time": _to_datetime(time_ns).isoformat(), "device_id": device_id}
+            record.update(json.loads(tags or "{}"))
+            record.update(json.loads(fields or "{}"))
+            records.append(record)
+        return records
+
+    def query_recent(self, device_id, start_ns, limit):
+        """
+        查询设备最近的数据，同一时间的字段合并为一条记录
+        :return: 记录列表，按时间从新到旧，每条记录包含time（ISO 8601）、device_id、device_type、location和字段
+        """
+        tags = self._reader().execute(
+            "SELECT device_type, location FROM devices WHERE device_id = ?", (device_id,)
+        ).fetchone() or (None, None)
+        records = []
+        current_time = None
+        for name in reversed(self._partitions_between(start_ns, 2 ** 63 - 1)):
+            cursor = self._execute_partition(
+                f"SELECT time, field, value FROM {name} WHERE device_id = ? AND time >= ? ORDER BY time DESC",
+                (device_id, start_ns)
+            )
+            for time_ns, field, value in cursor:
+                if time_ns != current_time:
+                    if len(records) >= limit:
+                        return records
+                    current_time = time_ns
+                    record = {"time": _to_datetime(time_ns).isoformat(), "device_id": device_id}
+                    for key, tag in zip(("device_type", "location"), tags):
+                        if tag is not None:
+                            record[key] = tag
+                    records.append(record)
+                records[-1][field] = value
+        return records
+
+    def stats(self):
+        """获取存储统计"""
+        return {
+            "path": self.path,
+            "partitions": self._reader().execute("SELECT count(*) FROM partitions").fetchone()[0],
+            "written": self.written,
+            "pruned_partitions": self.pruned_partitions,
+            "last_prune": self.last_prune or None
+        }
+
+    def close(self):
+        """关闭所有连接"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+        logger.info("SQLite时序存储已关闭")
@@ -0,0 +1,140 @@
+"""
+遥测增量帧
+
+设备周期性发送包含全部字段的关键帧，中间只发送发生变化的字段（增量帧），
+每帧带递增的序号。内存总量、磁盘总量、开机时间等很少变化的字段只在关键帧中出现。
+服务端按设备把增量帧合并成完整快照；发现序号不连续时只输出该帧实际携带的字段，
+并请求设备尽快发送关键帧。
+"""
+import time
+
+# 帧元数据字段，合并后的快照中不包含这些字段
+SEQ_FIELD = "_seq"
+KEYFRAME_FIELD = "_keyframe"
+
+# 每一帧都携带的字段
+ALWAYS_SEND_FIELDS = ("device_id", "timestamp")
+
+_MISSING = object()
+
+class DeltaEncoder:
+    """设备端：把完整的遥测数据转换为关键帧或增量帧"""
+
+    def __init__(self, keyframe_interval=10, always_send=ALWAYS_SEND_FIELDS):
+        """
+        :param keyframe_interval: 每隔多少帧发送一次关键帧
+        :param always_send: 每一帧都携带的字段
+        """
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.always_send = set(always_send)
+        self.seq = 0
+        self.last_keyframe_seq = None
+        self.last_values = None
+        self.force_keyframe = False
+
+    def request_keyframe(self):
+        """下一帧发送关键帧（服务端请求或重新连接后调用）"""
+        self.force_keyframe = True
+
+    def encode(self, data):
+        """
+        :param data: 完整的遥测数据字典
+        :return: 带序号的关键帧或增量帧
+        """
+        self.seq += 1
+        keyframe = (
+            self.force_keyframe
+            or self.last_values is None
+            or self.seq - self.last_keyframe_seq >= self.keyframe_interval
+        )
+
+        if keyframe:
+            frame = dict(data)
+            self.last_values = dict(data)
+            self.last_keyframe_seq = self.seq
+            self.force_keyframe = False
+        else:
+            last_values = self.last_values
+            frame = {
+                key: value for key, value in data.items()
+                if key in self.always_send or last_values.get(key, _MISSING) != value
+            }
+            last_values.update(frame)
+
+        frame[SEQ_FIELD] = self.seq
+        frame[KEYFRAME_FIELD] = keyframe
+        return frame
+
+class DeltaReassembler:
+    """服务端：按设备把关键帧和增量帧合并成完整快照，需要按到达顺序调用"""
+
+    def __init__(self, request_keyframe=None, request_interval=10.0, metrics=None):
+        """
+        :param request_keyframe: 请求关键帧的回调，签名为 request_keyframe(device_id)
+        :param request_interval: 同一设备两次请求关键帧的最短间隔（秒）
+        :param metrics: 计数器对象（需要incr方法），为空时只在stats()中统计
+        """
+        self.request_keyframe = request_keyframe
+        self.request_interval = request_interval
+        self.metrics = metrics
+        # 设备ID -> [最后序号, 快照]
+        self.devices = {}
+        self._last_request = {}
+        self.counters = {"keyframes": 0, "deltas": 0, "gaps": 0, "stale": 0, "keyframe_requests": 0}
+
+    def _count(self, name):
+        self.counters[name] += 1
+        if self.metrics is not None:
+            self.metrics.incr(f"delta_{name}")
+
+    def apply(self, data):
+        """
+        合并一帧遥测数据
+        :param data: 解码后的数据，不带序号的数据原样返回
+        :return: 合并后的完整快照（不含帧元数据）；序号不连续时只包含该帧携带的字段
+        """
+        if not isinstance(data, dict) or SEQ_FIELD not in data:
+            return data
+
+        seq = data.pop(SEQ_FIELD)
+        keyframe = data.pop(KEYFRAME_FIELD, False)
+        device_id = data.get("device_id")
+        state = self.devices.get(device_id)
+
+        if keyframe:
+            self._count("keyframes")
+            self.devices[device_id] = [seq, dict(data)]
+            return data
+
+        self._count("deltas")
+        if state is not None and seq == state[0] + 1:
+            state[0] = seq
+            state[1].update(data)
+            return dict(state[1])
+
+        if state is not None and seq <= state[0]:
+            # 重复或乱序到达的旧帧，不更新快照
+            self._count("stale")
+        else:
+            # 丢帧或还没有收到关键帧，快照可能已过期，等待下一个关键帧
+            self._count("gaps")
+            self.devices.pop(device_id, None)
+            self._request_keyframe(device_id)
+        return data
+
+    def _request_keyframe(self, device_id):
+        if self.request_keyframe is None:
+            return
+        now = time.monotonic()
+        last = self._last_request.get(device_id)
+        if last is not None and now - last < self.request_interval:
+            return
+        self._last_request[device_id] = now
+        self._count("keyframe_requests")
+        self.request_keyframe(device_id)
+
+    def stats(self):
+        """获取合并计数和跟踪的设备数"""
+        stats = dict(self.counters)
+        stats["devices"] = len(self.devices)
+        return stats
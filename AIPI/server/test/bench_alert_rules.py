@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+告警规则评估基准测试
+比较逐条评估（原来的 get_device_alert_rules + evaluate_rule、编译后的规则）和按字段数组比较的批量评估，并检查结果一致
+用法: python test/bench_alert_rules.py [批大小]
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import ALERT_CONFIG
+from alert_manager import get_device_alert_rules
+from alert_rules import AlertRuleEngine
+
+# 配置
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+device_count = 2000
+prefixes = ("temp_", "hum_", "env_", "rpi_")
+
+random.seed(42)
+
+def make_reading(index):
+    """生成一条遥测数据，少数数据超过阈值或缺少字段"""
+    reading = {
+        "device_id": f"{prefixes[index % len(prefixes)]}{index % device_count:04d}",
+        "timestamp": 1700000000.0 + index,
+        "temperature": round(random.gauss(22, 3), 2),
+        "humidity": round(random.gauss(55, 8), 1),
+        "co2": random.randint(400, 1200),
+        "cpu_usage": 12.5,
+        "status": "normal"
+    }
+    if index % 7 == 0:
+        del reading["humidity"]
+    if index % 11 == 0:
+        reading["temperature"] = str(reading["temperature"])
+    return reading
+
+records = [(reading["device_id"], reading) for reading in map(make_reading, range(batch_size))]
+
+def evaluate_rule(device_id, rule, data):
+    """
+    原来的单条规则评估（引入AlertRuleEngine之前alert_manager中的实现），作为对照基准
+    :param device_id: 设备ID
+    :param rule: 告警规则
+    :param data: 设备数据
+    :return: 触发时返回告警消息，否则返回None
+    """
+    field = rule.get("field")
+    condition = rule.get("condition")
+    threshold = rule.get("threshold")
+    
+    # 检查数据中是否包含要监控的字段
+    if field not in data:
+        return None
+        
+    value = data[field]
+    
+    # 检查条件
+    if condition == "greater_than" and float(value) > float(threshold):
+        return f"设备 {device_id} 的 {field} 值 ({value}) 超过阈值 {threshold}"
+    elif condition == "less_than" and float(value) < float(threshold):
+        return f"设备 {device_id} 的 {field} 值 ({value}) 低于阈值 {threshold}"
+    elif condition == "equals" and str(value) == str(threshold):
+        return f"设备 {device_id} 的 {field} 值等于 {threshold}"
+    elif condition == "not_equals" and str(value) != str(threshold):
+        return f"设备 {device_id} 的 {field} 值 ({value}) 不等于期望值 {threshold}"
+    return None
+
+# 数组比较和逐条评估分别使用各自的引擎，批大小阈值为0时总是使用数组比较
+engine = AlertRuleEngine(dict(ALERT_CONFIG, vectorize_min_batch=0))
+
+def legacy_path():
+    fired = []
+    for index, (device_id, data) in enumerate(records):
+        for rule in get_device_alert_rules(device_id):
+            message = evaluate_rule(device_id, rule, data)
+            if message:
+                fired.append((index, device_id, rule, message))
+    return fired
+
+def compiled_path():
+    return [
+        (index, device_id, rule, message)
+        for index, (device_id, data) in enumerate(records)
+        for rule, message in engine.evaluate(device_id, data)
+    ]
+
+def vectorized_path():
+    return engine.evaluate_batch(records)
+
+# 检查结果一致
+expected = legacy_path()
+assert compiled_path() == expected, "编译后的规则与原来的评估结果不一致"
+assert vectorized_path() == expected, "数组比较与逐条评估的结果不一致"
+print(f"结果一致性检查通过，{batch_size} 条数据触发 {len(expected)} 条告警")
+
+def bench(name, func):
+    loops = max(1, 50000 // batch_size)
+    elapsed = min(timeit.repeat(func, number=loops, repeat=3))
+    per_item = elapsed / (loops * batch_size) * 1_000_000
+    print(f"{name:<40} {per_item:8.2f} µs/条")
+    return per_item
+
+print()
+legacy_us = bench("get_device_alert_rules + evaluate_rule", legacy_path)
+compiled_us = bench("AlertRuleEngine.evaluate()", compiled_path)
+vectorized_us = bench("AlertRuleEngine.evaluate_batch()", vectorized_path)
+print(f"{'提升（相对逐条编译规则）':<40} {compiled_us / vectorized_us:8.1f} 倍")
+print(f"{'提升（相对原来的评估）':<40} {legacy_us / vectorized_us:8.1f} 倍")
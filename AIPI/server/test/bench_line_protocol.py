@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+行协议序列化基准测试
+比较 build_data_point(...).to_line_protocol() 和 LineProtocolSerializer 的耗时，并检查两者输出一致
+用法: python test/bench_line_protocol.py [次数]
+"""
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from influx_writer import build_data_point, serialize_data_point
+
+# 配置
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+device_count = 50
+
+def make_reading(index):
+    """生成一条与树莓派上报格式相同的遥测数据"""
+    return {
+        "device_id": f"rpi_{index % device_count:03d}",
+        "device_type": "raspberry_pi",
+        "location": "机房 A",
+        "timestamp": time.time(),
+        "temperature": 25.5 + index % 10,
+        "humidity": 60,
+        "cpu_usage": 12.5,
+        "cpu_freq": 1500.0,
+        "cpu_load": 0.35,
+        "cpu_temperature": 48.3,
+        "memory_total": 4096000000,
+        "memory_used": 1024000000,
+        "memory_percent": 25.0,
+        "disk_total": 32000000000,
+        "disk_used": 8000000000,
+        "disk_percent": 25.0,
+        "net_bytes_sent": 123456789,
+        "net_bytes_recv": 987654321,
+        "boot_time": 1700000000.0,
+        "uptime_seconds": 86400,
+        "status": "normal \"ok\""
+    }
+
+readings = [make_reading(i) for i in range(1000)]
+iso_readings = [dict(reading, timestamp="2024-05-01T12:00:00.123456Z") for reading in readings]
+
+# 检查输出一致
+for reading in readings + iso_readings:
+    expected = build_data_point(reading["device_id"], reading).to_line_protocol().encode("utf-8")
+    actual = serialize_data_point(reading["device_id"], reading)
+    assert actual == expected, f"输出不一致:\n{expected}\n{actual}"
+print(f"输出一致性检查通过，共 {len(readings) + len(iso_readings)} 条")
+
+def bench(name, func, data):
+    count = len(data)
+    loops = max(1, iterations // count)
+    elapsed = min(timeit.repeat(lambda: [func(r["device_id"], r) for r in data], number=loops, repeat=3))
+    per_item = elapsed / (loops * count) * 1_000_000
+    print(f"{name:<40} {per_item:8.2f} µs/条")
+    return per_item
+
+for label, data in (("Unix时间戳", readings), ("ISO时间戳", iso_readings)):
+    print(f"\n[{label}]")
+    point_us = bench("Point.to_line_protocol()", lambda d, r: build_data_point(d, r).to_line_protocol(), data)
+    serializer_us = bench("LineProtocolSerializer.serialize()", serialize_data_point, data)
+    print(f"{'提升':<40} {point_us / serializer_us:8.1f} 倍")
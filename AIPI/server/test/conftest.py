@@ -0,0 +1,16 @@
+"""
+pytest配置
+
+测试直接导入server目录下的模块；日志只输出到控制台。
+langchain_processor在导入时创建LLM客户端，需要设置API密钥（测试不会调用LLM）。
+test_send_command.py 和 run_test.py 是需要MQTT代理的手动测试脚本，不由pytest收集。
+"""
+import os
+import sys
+
+os.environ.setdefault("LOG_FILE", "")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+collect_ignore = ["test_send_command.py", "run_test.py"]
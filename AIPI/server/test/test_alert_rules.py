@@ -0,0 +1,95 @@
+"""
+告警规则引擎测试：批量数组比较与逐条评估结果一致
+"""
+import random
+import pytest
+from alert_rules import AlertRuleEngine
+
+ALERT_CONFIG = {
+    "default_rules": [
+        {"name": "温度过高", "field": "temperature", "condition": "greater_than", "threshold": 30.0},
+        {"name": "温度过低", "field": "temperature", "condition": "less_than", "threshold": 5.0},
+        {"name": "湿度过高", "field": "humidity", "condition": "greater_than", "threshold": "80"},
+        {"name": "状态异常", "field": "status", "condition": "not_equals", "threshold": "normal"}
+    ],
+    "type_rules": {
+        "temperature_sensor": [
+            {"name": "温度过高", "field": "temperature", "condition": "greater_than", "threshold": 28},
+            {"name": "离线", "field": "online", "condition": "equals", "threshold": "False"}
+        ]
+    },
+    "device_rules": {
+        "env_0007": [
+            # 规则顺序与字段顺序不同
+            {"name": "CO2过高", "field": "co2", "condition": "greater_than", "threshold": 1000},
+            {"name": "温度过高", "field": "temperature", "condition": "greater_than", "threshold": 25}
+        ]
+    }
+}
+
+def make_records(count, seed=7):
+    """生成设备数据，包含缺失字段、字符串数值和无法转换的值"""
+    rng = random.Random(seed)
+    prefixes = ("temp_", "env_", "rpi_")
+    records = []
+    for index in range(count):
+        device_id = f"{prefixes[index % len(prefixes)]}{index % 10:04d}"
+        data = {
+            "device_id": device_id,
+            "temperature": round(rng.uniform(0, 40), 1),
+            "humidity": round(rng.uniform(40, 95), 1),
+            "co2": rng.randint(400, 1500),
+            "status": rng.choice(["normal", "normal", "error"]),
+            "online": rng.choice([True, False])
+        }
+        if index % 5 == 0:
+            del data["humidity"]
+        if index % 6 == 0:
+            del data["status"]
+        if index % 7 == 0:
+            data["temperature"] = str(data["temperature"])
+        if index % 13 == 0:
+            data["temperature"] = "n/a"
+        records.append((device_id, data))
+    return records
+
+def single_path(engine, records):
+    return [
+        (index, device_id, rule, message)
+        for index, (device_id, data) in enumerate(records)
+        for rule, message in engine.evaluate(device_id, data)
+    ]
+
+@pytest.mark.parametrize("count", [1, 50, 500])
+def test_batch_matches_single(count):
+    records = make_records(count)
+    engine = AlertRuleEngine(dict(ALERT_CONFIG, vectorize_min_batch=0))
+    expected = single_path(engine, records)
+    assert engine.evaluate_batch(records) == expected
+    if count >= 50:
+        assert expected
+
+def test_small_batches_evaluated_one_by_one():
+    records = make_records(20)
+    engine = AlertRuleEngine(dict(ALERT_CONFIG, vectorize_min_batch=64))
+    assert engine.evaluate_batch(records) == single_path(engine, records)
+
+def test_rule_sources():
+    engine = AlertRuleEngine(ALERT_CONFIG)
+    assert engine.evaluator("env_0007").source == "device:env_0007"
+    assert engine.evaluator("temp_0001").source == "type:temperature_sensor"
+    assert engine.evaluator("rpi_0001").source == "default"
+
+def test_alerts_in_config_order():
+    engine = AlertRuleEngine(ALERT_CONFIG)
+    fired = engine.evaluate("env_0007", {"temperature": 26, "co2": 1200})
+    assert [rule["name"] for rule, _ in fired] == ["CO2过高", "温度过高"]
+
+def test_invalid_rule_skipped():
+    config = {"default_rules": [
+        {"name": "无效阈值", "field": "temperature", "condition": "greater_than", "threshold": "hot"},
+        {"name": "未知条件", "field": "temperature", "condition": "between", "threshold": 1},
+        {"name": "温度过高", "field": "temperature", "condition": "greater_than", "threshold": 30}
+    ]}
+    engine = AlertRuleEngine(config)
+    assert [rule["name"] for rule, _ in engine.evaluate("rpi_0001", {"temperature": 31})] == ["温度过高"]
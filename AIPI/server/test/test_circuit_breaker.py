@@ -0,0 +1,72 @@
+"""
+熔断器测试：打开、半开探测和恢复
+"""
+import pytest
+from influx_connection import CircuitBreaker, CircuitOpenError, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN
+
+class ServerError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+def fail(status=503):
+    raise ServerError(status)
+
+def expire(breaker):
+    """跳过冷却时间"""
+    breaker.opened_at -= breaker.reset_timeout
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+    for _ in range(2):
+        breaker.record_failure(ServerError(503))
+    assert breaker.state == STATE_CLOSED
+    # 成功后重新计数
+    breaker.record_success()
+    for _ in range(3):
+        with pytest.raises(ServerError):
+            breaker.call(fail)
+    assert breaker.state == STATE_OPEN
+    assert breaker.status()["trips"] == 1
+
+def test_open_breaker_rejects_without_calling():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+    breaker.record_failure(ServerError(503))
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        breaker.call(calls.append, 1)
+    assert calls == []
+    assert breaker.status()["rejected"] == 1
+
+def test_half_open_allows_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+    breaker.record_failure(ServerError(503))
+    expire(breaker)
+    assert breaker.allow() is True
+    assert breaker.state == STATE_HALF_OPEN
+    # 探测请求完成前拒绝其他请求
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow() is True
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.0)
+    breaker.record_failure(ServerError(503))
+    breaker.record_failure(ServerError(503))
+    expire(breaker)
+    with pytest.raises(ServerError):
+        breaker.call(fail)
+    assert breaker.state == STATE_OPEN
+    assert breaker.allow() is False
+    assert breaker.status()["trips"] == 1
+
+def test_client_errors_count_as_success():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+    with pytest.raises(ServerError):
+        breaker.call(fail, 400)
+    assert breaker.state == STATE_CLOSED
+    # 429 表示服务过载，计为失败
+    with pytest.raises(ServerError):
+        breaker.call(fail, 429)
+    assert breaker.state == STATE_OPEN
@@ -0,0 +1,63 @@
+"""
+字段类型注册表测试：类型推断、转换和丢弃
+"""
+from field_schema import (FieldSchemaRegistry, FIELD_FLOAT, FIELD_INT, FIELD_BOOL, FIELD_STRING,
+                          REJECT_TYPE_CONFLICT, REJECT_NON_FINITE, REJECT_STRING_NOT_ALLOWED, parse_field_types)
+
+def test_first_value_decides_type():
+    registry = FieldSchemaRegistry()
+    registry.normalize("sensors", {"device_id": "env_001", "humidity": 60, "temperature": 25.5, "online": True})
+    assert registry.field_type("sensors", "humidity") == FIELD_INT
+    assert registry.field_type("sensors", "temperature") == FIELD_FLOAT
+    assert registry.field_type("sensors", "online") == FIELD_BOOL
+    # 标签和时间戳不登记
+    assert registry.field_type("sensors", "device_id") is None
+
+def test_values_coerced_to_registered_type():
+    registry = FieldSchemaRegistry()
+    registry.normalize("sensors", {"temperature": 25.5, "humidity": 60, "relay": False})
+    result = registry.normalize("sensors", {"temperature": 26, "humidity": "61", "relay": 1})
+    assert result == {"temperature": 26.0, "humidity": 61, "relay": True}
+    assert type(result["temperature"]) is float
+    assert registry.stats()["coerced"] == 3
+
+def test_unconvertible_values_dropped():
+    registry = FieldSchemaRegistry()
+    registry.normalize("sensors", {"temperature": 25.5, "humidity": 60})
+    result = registry.normalize("sensors", {"device_id": "env_001", "temperature": "hot", "humidity": 60.5})
+    assert result == {"device_id": "env_001"}
+    assert registry.normalize("sensors", {"temperature": float("nan")}) == {}
+    stats = registry.stats()
+    assert stats["rejected"] == 3
+    assert stats["rejected_by_reason"] == {REJECT_TYPE_CONFLICT: 2, REJECT_NON_FINITE: 1}
+
+def test_numeric_as_float():
+    registry = FieldSchemaRegistry(numeric_as_float=True)
+    assert registry.normalize("sensors", {"humidity": 60}) == {"humidity": 60.0}
+    assert registry.field_type("sensors", "humidity") == FIELD_FLOAT
+
+def test_declared_types_and_numeric_strings():
+    registry = FieldSchemaRegistry(declared=parse_field_types("rssi:int,gpio.level:bool"))
+    assert registry.normalize("sensors", {"rssi": -60.0, "level": "on", "pressure": "1013.2"}) == {
+        "rssi": -60, "level": "on", "pressure": 1013.2
+    }
+    assert registry.normalize("gpio", {"level": "on"}) == {"level": True}
+    assert registry.field_type("sensors", "level") == FIELD_STRING
+
+def test_strings_not_allowed():
+    registry = FieldSchemaRegistry(allow_strings=False)
+    assert registry.normalize("sensors", {"status": "ok", "temperature": "25"}) == {"temperature": 25.0}
+    assert registry.stats()["rejected_by_reason"] == {REJECT_STRING_NOT_ALLOWED: 1}
+
+def test_nested_objects_flattened():
+    registry = FieldSchemaRegistry()
+    result = registry.normalize("sensors", {"system_info": {"cpu_percent": 12.5, "disk": {"free": 10}}})
+    assert result == {"system_info_cpu_percent": 12.5, "system_info_disk_free": 10}
+
+def test_learn_from_influx_conflict():
+    registry = FieldSchemaRegistry()
+    registry.normalize("sensors", {"humidity": 60})
+    message = ('field type conflict: input field "humidity" on measurement "sensors" is type integer, '
+               'already exists as type float')
+    assert registry.learn_from_error(message) == 1
+    assert registry.normalize("sensors", {"humidity": 61}) == {"humidity": 61.0}
@@ -0,0 +1,33 @@
+"""
+MQTT客户端测试：字段字典确认中告知设备的功能
+"""
+import pytest
+from config import INGEST_CONFIG
+from mqtt_client import MQTTClient
+
+SCHEMA = {"schema_id": "s1", "encoding": "struct", "fields": ["temperature"]}
+
+def schema_ack(client):
+    """处理设备的字段字典并返回回复的确认消息"""
+    published = []
+    client.publish = lambda topic, payload: published.append((topic, payload))
+    client.on_device_schema(dict(SCHEMA), "rpi_001")
+    assert len(published) == 1
+    topic, payload = published[0]
+    assert topic == "device/rpi_001/schema/ack"
+    return payload
+
+def test_single_process_advertises_delta(monkeypatch):
+    monkeypatch.setitem(INGEST_CONFIG, "workers", 0)
+    assert schema_ack(MQTTClient())["features"] == ["delta"]
+
+@pytest.mark.parametrize("delta_enabled", [None, False])
+def test_multi_worker_never_advertises_delta(monkeypatch, delta_enabled):
+    # 多进程接入时Web服务使用默认参数的客户端也会回复确认，不能与接入进程矛盾
+    monkeypatch.setitem(INGEST_CONFIG, "workers", 4)
+    assert "delta" not in schema_ack(MQTTClient(delta_enabled=delta_enabled))["features"]
+
+def test_ingest_worker_disables_delta(monkeypatch):
+    # 通过 --ingest-workers 启动时配置中的进程数可能为0
+    monkeypatch.setitem(INGEST_CONFIG, "workers", 0)
+    assert schema_ack(MQTTClient(delta_enabled=False))["features"] == []
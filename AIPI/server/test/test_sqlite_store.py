@@ -0,0 +1,119 @@
+"""
+SQLite时序存储测试：写入、范围查询、最新值、聚合和保留期清理
+"""
+import pytest
+from sqlite_store import SQLiteStore
+
+HOUR_NS = 3600 * 10 ** 9
+DAY_NS = 24 * HOUR_NS
+# 2024-01-01 00:00:00 UTC
+BASE_NS = 1704067200 * 10 ** 9
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / "ts.db"), partition_hours=1, retention_days=1, prune_interval=10 ** 9)
+    store.last_prune = float("inf")
+    yield store
+    store.close()
+
+def reading(device_id, time_ns, **fields):
+    return device_id, dict(fields, timestamp=time_ns / 1e9)
+
+def test_write_creates_hourly_partitions(store):
+    store.write_records([
+        reading("env_001", BASE_NS, temperature=20.0),
+        reading("env_001", BASE_NS + HOUR_NS, temperature=21.0),
+        reading("env_001", BASE_NS + 2 * HOUR_NS + 1, temperature=22.0)
+    ])
+    assert store.stats()["partitions"] == 3
+    assert store.written == 3
+
+def test_range_query_spans_partitions(store):
+    store.write_records([
+        reading("env_001", BASE_NS + i * HOUR_NS // 2, temperature=20.0 + i, status="ok")
+        for i in range(6)
+    ])
+    store.write_records([reading("env_002", BASE_NS, temperature=99.0)])
+
+    rows = list(store.stream("env_001", BASE_NS + HOUR_NS // 2, BASE_NS + 2 * HOUR_NS, fields=["temperature"]))
+    assert [value for _, _, value in rows] == [21.0, 22.0, 23.0]
+    assert all(field == "temperature" for _, field, _ in rows)
+    assert rows == sorted(rows, key=lambda row: row[0])
+
+    recent = store.query_recent("env_001", BASE_NS, 2)
+    assert [record["temperature"] for record in recent] == [25.0, 24.0]
+    assert recent[0]["status"] == "ok"
+
+def test_latest_keeps_newest_value(store):
+    store.write_records([reading("env_001", BASE_NS + HOUR_NS, temperature=25.0, humidity=60)])
+    # 晚到的旧数据不覆盖最新值
+    store.write_records([reading("env_001", BASE_NS, temperature=10.0)])
+
+    latest = store.query_latest("env_001")
+    assert latest["temperature"] == (25.0, (BASE_NS + HOUR_NS) / 1e9)
+    assert latest["humidity"][0] == 60
+    assert store.query_latest("env_001", fields=["humidity"]).keys() == {"humidity"}
+    assert dict(store.query_latest_batch(["env_001", "env_404"])).keys() == {"env_001"}
+
+@pytest.mark.parametrize("fn, expected", [
+    ("mean", [2.0, 5.0]),
+    ("max", [3.0, 6.0]),
+    ("min", [1.0, 4.0]),
+    ("last", [3.0, 6.0])
+])
+def test_aggregate_windows(store, fn, expected):
+    store.write_records([
+        reading("env_001", BASE_NS + i * 20 * 60 * 10 ** 9, temperature=float(i + 1), status="ok")
+        for i in range(6)
+    ])
+    series = store.query_history("env_001", BASE_NS, BASE_NS + 2 * HOUR_NS, HOUR_NS, fn=fn)
+    # 窗口时间为窗口结束时间（毫秒）
+    assert series["temperature"] == [
+        [(BASE_NS + HOUR_NS) // 10 ** 6, expected[0]],
+        [(BASE_NS + 2 * HOUR_NS) // 10 ** 6, expected[1]]
+    ]
+    # 字符串字段只参与last
+    assert ("status" in series) == (fn == "last")
+
+def test_aggregate_rejects_unknown_function(store):
+    with pytest.raises(ValueError):
+        store.query_history("env_001", BASE_NS, BASE_NS + HOUR_NS, HOUR_NS, fn="median")
+
+def test_frame_pivots_fields(store):
+    store.write_records([
+        ("env_001", {"timestamp": BASE_NS / 1e9, "temperature": 20.0, "humidity": 50.0, "location": "lab"}),
+        ("env_001", {"timestamp": BASE_NS / 1e9 + 60, "temperature": 22.0, "humidity": 54.0})
+    ])
+    frame = store.query_frame(BASE_NS, BASE_NS + HOUR_NS, HOUR_NS)
+    assert len(frame) == 1
+    row = frame.iloc[0]
+    assert (row["temperature"], row["humidity"], row["location"]) == (21.0, 52.0, "lab")
+
+def test_prune_drops_expired_partitions(store):
+    store.write_records([
+        reading("env_001", BASE_NS, temperature=1.0),
+        reading("env_001", BASE_NS + DAY_NS, temperature=2.0)
+    ])
+    assert store.prune(now_ns=BASE_NS + DAY_NS + HOUR_NS) == 1
+    assert store.stats()["partitions"] == 1
+    assert [value for _, _, value in store.stream("env_001", BASE_NS, BASE_NS + 2 * DAY_NS)] == [2.0]
+    assert store.prune(now_ns=BASE_NS + DAY_NS + HOUR_NS) == 0
+
+def test_other_process_partitions_visible(store):
+    other = SQLiteStore(store.path, partition_hours=1, retention_days=1, prune_interval=10 ** 9)
+    other.last_prune = float("inf")
+    try:
+        store.write_records([reading("env_001", BASE_NS, temperature=1.0)])
+        # 另一个连接在打开之后创建的分区
+        other.write_records([reading("env_001", BASE_NS + HOUR_NS, temperature=2.0)])
+        series = store.query_history("env_001", BASE_NS, BASE_NS + 2 * HOUR_NS, HOUR_NS, fn="max")
+        assert [value for _, value in series["temperature"]] == [1.0, 2.0]
+
+        # 另一个连接删除了本连接写入过的分区后，查询和写入都不报错
+        other.prune(now_ns=BASE_NS + DAY_NS + 2 * HOUR_NS)
+        assert store.query_history("env_001", BASE_NS, BASE_NS + 2 * HOUR_NS, HOUR_NS) == {}
+        assert store.query_recent("env_001", BASE_NS, 10) == []
+        store.write_records([reading("env_001", BASE_NS, temperature=3.0)])
+        assert [value for _, _, value in other.stream("env_001", BASE_NS, BASE_NS + HOUR_NS)] == [3.0]
+    finally:
+        other.close()
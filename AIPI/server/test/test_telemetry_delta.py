@@ -0,0 +1,72 @@
+"""
+遥测增量帧测试：编码、合并和丢帧处理
+"""
+from telemetry_delta import DeltaEncoder, DeltaReassembler, SEQ_FIELD, KEYFRAME_FIELD
+
+def frames(count, keyframe_interval=10):
+    """生成一个设备的连续帧，只有cpu每帧变化"""
+    encoder = DeltaEncoder(keyframe_interval=keyframe_interval)
+    snapshots = [
+        {"device_id": "rpi_001", "timestamp": 1700000000.0 + i, "cpu": float(i), "memory_total": 4096}
+        for i in range(count)
+    ]
+    return snapshots, [encoder.encode(dict(snapshot)) for snapshot in snapshots]
+
+def test_delta_frames_omit_unchanged_fields():
+    _, encoded = frames(3)
+    assert encoded[0][KEYFRAME_FIELD] is True
+    assert "memory_total" in encoded[0]
+    assert encoded[1][KEYFRAME_FIELD] is False
+    assert "memory_total" not in encoded[1]
+    assert [frame[SEQ_FIELD] for frame in encoded] == [1, 2, 3]
+
+def test_in_order_frames_reassembled():
+    snapshots, encoded = frames(12, keyframe_interval=5)
+    reassembler = DeltaReassembler()
+    assert [reassembler.apply(frame) for frame in encoded] == snapshots
+    assert reassembler.stats()["gaps"] == 0
+
+def test_gap_outputs_partial_frame_and_requests_keyframe():
+    snapshots, encoded = frames(6)
+    requests = []
+    reassembler = DeltaReassembler(request_keyframe=requests.append)
+    reassembler.apply(encoded[0])
+    reassembler.apply(encoded[1])
+
+    # 第3帧丢失：第4帧只输出自身携带的字段，不使用过期的快照
+    partial = reassembler.apply(encoded[3])
+    assert partial == {"device_id": "rpi_001", "timestamp": snapshots[3]["timestamp"], "cpu": 3.0}
+    assert requests == ["rpi_001"]
+
+    # 等待关键帧期间的增量帧也只输出自身字段，关键帧请求受最短间隔限制
+    assert "memory_total" not in reassembler.apply(encoded[4])
+    assert requests == ["rpi_001"]
+    stats = reassembler.stats()
+    assert (stats["gaps"], stats["keyframe_requests"]) == (2, 1)
+
+def test_keyframe_after_gap_restores_snapshot():
+    encoder = DeltaEncoder(keyframe_interval=100)
+    reassembler = DeltaReassembler(request_keyframe=lambda device_id: encoder.request_keyframe())
+    reassembler.apply(encoder.encode({"device_id": "rpi_001", "cpu": 1.0, "memory_total": 4096}))
+    encoder.encode({"device_id": "rpi_001", "cpu": 2.0, "memory_total": 4096})
+    reassembler.apply(encoder.encode({"device_id": "rpi_001", "cpu": 3.0, "memory_total": 4096}))
+
+    frame = encoder.encode({"device_id": "rpi_001", "cpu": 4.0, "memory_total": 4096})
+    assert frame[KEYFRAME_FIELD] is True
+    assert reassembler.apply(frame) == {"device_id": "rpi_001", "cpu": 4.0, "memory_total": 4096}
+    assert reassembler.apply(encoder.encode({"device_id": "rpi_001", "cpu": 5.0, "memory_total": 4096})) == {
+        "device_id": "rpi_001", "cpu": 5.0, "memory_total": 4096
+    }
+
+def test_stale_and_plain_frames():
+    _, encoded = frames(3)
+    reassembler = DeltaReassembler()
+    for frame in encoded:
+        reassembler.apply(dict(frame))
+    # 重复到达的旧帧不修改快照
+    reassembler.apply(dict(encoded[1]))
+    assert reassembler.stats()["stale"] == 1
+    assert reassembler.devices["rpi_001"][0] == 3
+    # 不带序号的数据原样返回
+    plain = {"device_id": "rpi_002", "cpu": 1.0}
+    assert reassembler.apply(plain) is plain
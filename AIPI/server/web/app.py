@@ -21,10 +21,19 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(os.path.dirname(current_dir))
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
+server_dir = os.path.dirname(current_dir)
+if server_dir not in sys.path:
+    sys.path.insert(0, server_dir)
 
-# 导入数据管理器
+from topic_router import TopicRouter
+from codec import decode_message
+
+# 导入数据管理器，优先使用server目录下的模块
 try:
-    from ai_mqtt_langchain.data_manager import get_data_manager
+    try:
+        from data_manager import get_data_manager
+    except ImportError:
+        from ai_mqtt_langchain.data_manager import get_data_manager
     data_manager = get_data_manager()
     data_manager_available = True
     logger = logging.getLogger("flask_langchain")
@@ -50,6 +59,10 @@ try:
     from routes.devices_routes import devices_bp
     routes_available = True
     print("成功导入本地路由模块")
+    try:
+        from routes.influxdb_routes import influxdb_bp
+    except ImportError as e:
+        print(f"无法导入InfluxDB路由: {e}")
 except ImportError as e:
     print(f"无法导入本地路由: {e}")
     # 如果本地导入失败，尝试从原始位置导入
@@ -156,33 +169,39 @@ def on_disconnect(client, userdata, rc):
         logger.info("尝试重新连接MQTT服务器...")
         try_mqtt_connect()
 
+# MQTT消息路由，设备ID从主题中解析
+topic_router = TopicRouter()
+
+@topic_router.route("device/{device_id}/result")
+def handle_command_result(data, device_id):
+    command_id = data.get("command_id")
+    if command_id in results:
+        results[command_id] = data
+        logger.info(f"收到命令ID {command_id} 的结果")
+
+@topic_router.route("device/{device_id}/status")
+def handle_device_status(data, device_id):
+    logger.info(f"设备状态更新: {data.get('status', 'unknown')}")
+    
+    # 将设备状态数据写入InfluxDB
+    if data_manager_available and "system_info" in data:
+        try:
+            # 提取系统信息数据
+            system_info = data.get("system_info", {})
+            if system_info and isinstance(system_info, dict):
+                # 写入设备数据
+                data_manager.write_device_data(
+                    device_id=device_id,
+                    data=system_info
+                )
+                logger.info(f"已记录设备状态数据到InfluxDB: {device_id}")
+        except Exception as db_error:
+            logger.error(f"写入设备状态到InfluxDB失败: {db_error}")
+
 def on_message(client, userdata, msg):
     try:
-        payload = msg.payload.decode('utf-8')
-        data = json.loads(payload)
-        
-        if msg.topic.endswith("/result"):
-            command_id = data.get("command_id")
-            if command_id in results:
-                results[command_id] = data
-                logger.info(f"收到命令ID {command_id} 的结果")
-        elif msg.topic.endswith("/status"):
-            logger.info(f"设备状态更新: {data.get('status', 'unknown')}")
-            
-            # 将设备状态数据写入InfluxDB
-            if data_manager_available and "system_info" in data:
-                try:
-                    # 提取系统信息数据
-                    system_info = data.get("system_info", {})
-                    if system_info and isinstance(system_info, dict):
-                        # 写入设备数据
-                        data_manager.write_device_data(
-                            device_id=device_id,
-                            data=system_info
-                        )
-                        logger.info(f"已记录设备状态数据到InfluxDB: {device_id}")
-                except Exception as db_error:
-                    logger.error(f"写入设备状态到InfluxDB失败: {db_error}")
+        data = decode_message(msg.topic, msg.payload)
+        topic_router.dispatch(msg.topic, data)
     except Exception as e:
         logger.error(f"处理消息出错: {e}")
 
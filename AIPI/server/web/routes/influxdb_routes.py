@@ -1,5 +1,8 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 import os
+import io
+import csv
+import zlib
 import logging
 import sys
 from typing import Dict, List, Any, Optional, Union
@@ -13,15 +16,45 @@ parent_dir = os.path.dirname(os.path.dirname(current_dir))
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
-# 导入数据管理器
+# 导入数据管理器，优先使用server目录下的模块
 try:
-    from ai_mqtt_langchain.data_manager import get_data_manager
+    try:
+        from data_manager import get_data_manager
+    except ImportError:
+        from ai_mqtt_langchain.data_manager import get_data_manager
     data_manager = get_data_manager()
     data_manager_available = True
 except ImportError as e:
     print(f"无法导入数据管理器: {e}")
     data_manager_available = False
 
+# 导入流式查询
+try:
+    from influx_writer import stream_device_data
+    from codec import encode_json
+    export_available = True
+except ImportError as e:
+    print(f"无法导入InfluxDB流式查询: {e}")
+    export_available = False
+
+# 导出时每次发送给客户端的数据块大小
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def _parse_limit(value):
+    """
+    解析limit查询参数
+    :param value: 查询参数字符串
+    :return: 正整数
+    :raises ValueError: 不是正整数
+    """
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"limit 必须是正整数: {value}")
+    if limit <= 0:
+        raise ValueError(f"limit 必须是正整数: {value}")
+    return limit
+
 # 创建Blueprint
 influxdb_bp = Blueprint('influxdb', __name__, url_prefix='/api/influxdb')
 
@@ -57,9 +90,9 @@ def query_device_data(device_id):
     # 获取查询参数
     measurement = request.args.get('measurement', 'device_data')
     start_time = request.args.get('start', '-1h')
-    limit = int(request.args.get('limit', '100'))
     
     try:
+        limit = _parse_limit(request.args.get('limit', '100'))
         data = data_manager.query_device_data(
             device_id=device_id,
             measurement=measurement,
@@ -74,10 +107,106 @@ def query_device_data(device_id):
             "limit": limit,
             "data": data
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ConnectionError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logger.error(f"查询设备数据出错: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _export_rows(records, export_format):
+    """把查询记录转换为CSV或NDJSON文本块"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == "csv" else None
+    if writer is not None:
+        writer.writerow(["time", "field", "value"])
+    
+    for record_time, field, value in records:
+        if writer is not None:
+            writer.writerow([record_time.isoformat(), field, value])
+        else:
+            buffer.write(encode_json({"time": record_time.isoformat(), "field": field, "value": value}).decode("utf-8"))
+            buffer.write("\n")
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def _gzip_chunks(chunks):
+    """逐块gzip压缩，每块都刷新压缩器，客户端可以边接收边解压"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@influxdb_bp.route('/export/<device_id>', methods=['GET'])
+def export_device_data(device_id):
+    """
+    流式导出设备原始数据
+    查询参数: start/stop（相对时长如-1d、Unix时间戳或ISO 8601时间）、fields（逗号分隔）、
+    format（csv或ndjson）、gzip（客户端支持时默认压缩，gzip=false关闭）
+    数据从InfluxDB边读边发送，内存占用与导出的时间范围无关
+    """
+    if not export_available:
+        return jsonify({"error": "InfluxDB流式查询不可用"}), 503
+    
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ("csv", "ndjson"):
+        return jsonify({"error": f"不支持的导出格式: {export_format}，可选: csv, ndjson"}), 400
+    
+    fields = request.args.get('fields')
+    if fields:
+        fields = [field for field in fields.split(',') if field]
+    
+    use_gzip = (
+        request.args.get('gzip', 'true').lower() != 'false'
+        and 'gzip' in request.headers.get('Accept-Encoding', '')
+    )
+    
+    try:
+        records = stream_device_data(
+            device_id,
+            start=request.args.get('start', '-1h'),
+            stop=request.args.get('stop', 'now'),
+            fields=fields
+        )
+        # 先读取第一条记录，参数或查询错误可以在开始发送前返回错误状态
+        first = next(records, None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"导出设备数据出错: {e}")
+        return jsonify({"error": str(e)}), 500
+    
+    def generate():
+        rows = records if first is None else _chain_first(first, records)
+        chunks = _export_rows(rows, export_format)
+        try:
+            yield from (_gzip_chunks(chunks) if use_gzip else chunks)
+        except Exception as e:
+            logger.error(f"导出设备 {device_id} 数据时中断: {e}")
+    
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    filename = f"{device_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{export_format}"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.headers["X-Accel-Buffering"] = "no"
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+def _chain_first(first, records):
+    """把提前读取的第一条记录放回数据流"""
+    yield first
+    yield from records
+
 @influxdb_bp.route('/data/<device_id>', methods=['POST'])
 def write_device_data(device_id):
     """写入设备数据"""
@@ -168,9 +297,9 @@ def get_device_alerts(device_id):
     
     # 获取查询参数
     start_time = request.args.get('start', '-24h')
-    limit = int(request.args.get('limit', '100'))
     
     try:
+        limit = _parse_limit(request.args.get('limit', '100'))
         data = data_manager.query_device_data(
             device_id=device_id,
             measurement='alerts',
@@ -184,6 +313,10 @@ def get_device_alerts(device_id):
             "limit": limit,
             "alerts": data
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ConnectionError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logger.error(f"获取设备警报出错: {e}")
         return jsonify({"error": str(e)}), 500
@@ -196,9 +329,9 @@ def get_device_commands(device_id):
     
     # 获取查询参数
     start_time = request.args.get('start', '-24h')
-    limit = int(request.args.get('limit', '100'))
     
     try:
+        limit = _parse_limit(request.args.get('limit', '100'))
         data = data_manager.query_device_data(
             device_id=device_id,
             measurement='command_results',
@@ -212,6 +345,10 @@ def get_device_commands(device_id):
             "limit": limit,
             "commands": data
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ConnectionError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logger.error(f"获取设备命令历史出错: {e}")
         return jsonify({"error": str(e)}), 500 
\ No newline at end of file
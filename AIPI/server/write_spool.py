@@ -0,0 +1,532 @@
+"""
+InfluxDB写入缓冲（磁盘预写日志）
+
+InfluxDB不可用时，写不进去的数据点以行协议追加到本地分段文件中，
+恢复后由后台线程按写入顺序、按限定速率重放，重放进度保存在游标文件中，进程重启后继续重放。
+每个进程在缓冲目录下锁定一个独立的槽位目录，多个进程不会重放同一批文件。
+重放线程在本进程的数据重放完后，还会接管没有进程持有锁的其他槽位（例如重启后进程数变少），把其中的数据重放完。
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from collections import deque
+from config import LOG_CONFIG
+from influx_batch_writer import is_retryable
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 配置日志
+logging.basicConfig(
+    level=LOG_CONFIG["level"],
+    format=LOG_CONFIG["format"],
+    filename=LOG_CONFIG.get("filename")
+)
+logger = logging.getLogger("write_spool")
+
+# 每条记录: 4字节小端长度 + UTF-8行协议
+_RECORD_HEADER = struct.Struct("<I")
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".log"
+_CURSOR_FILE = "cursor.json"
+_LOCK_FILE = "lock"
+
+def to_line_protocol(record):
+    """
+    把数据点转换为行协议字节串
+    :param record: Point对象、str或bytes
+    :return: bytes
+    """
+    if isinstance(record, bytes):
+        return record
+    if isinstance(record, str):
+        return record.encode("utf-8")
+    return record.to_line_protocol().encode("utf-8")
+
+class _Segment:
+    """一个分段文件"""
+
+    def __init__(self, seq, path, size=0, records=0):
+        self.seq = seq
+        self.path = path
+        self.size = size
+        self.records = records
+
+def _scan_segment(path):
+    """统计分段文件中完整记录的数量和字节数，末尾不完整的记录（写入时崩溃）被忽略"""
+    records = 0
+    valid_size = 0
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            (length,) = _RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                break
+            records += 1
+            valid_size += _RECORD_HEADER.size + length
+    return records, valid_size
+
+def _try_lock(directory):
+    """
+    以非阻塞方式锁定槽位目录
+    :return: 持有锁的文件对象，已被其他进程锁定时返回None
+    """
+    lock_file = open(os.path.join(directory, _LOCK_FILE), "a")
+    if fcntl is None:
+        # 没有fcntl的平台只使用第一个槽位
+        return lock_file
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+class WriteSpool:
+    """分段追加写入的磁盘缓冲，带容量上限、淘汰策略和限速重放"""
+
+    def __init__(self, directory, replay_fn, segment_max_bytes=16 * 1024 * 1024,
+                 max_total_bytes=1024 * 1024 * 1024, fsync_interval_ms=1000,
+                 eviction="drop_oldest", replay_rate=5000, replay_batch_size=1000,
+                 max_slots=16, orphan_scan_interval=30.0, name="influx"):
+        """
+        :param directory: 缓冲目录，进程在其下锁定一个slot-N子目录
+        :param replay_fn: 重放写入函数，签名为 replay_fn(lines)，lines为行协议字节串列表，失败时抛出异常
+        :param segment_max_bytes: 单个分段文件大小上限，超过后切换到新文件
+        :param max_total_bytes: 所有分段文件的总大小上限
+        :param fsync_interval_ms: 两次fsync的最长间隔（毫秒），期间的追加合并为一次fsync
+        :param eviction: 超过总大小上限时的策略，drop_oldest - 删除最早的分段；reject - 拒绝新数据
+        :param replay_rate: 重放速率上限（数据点/秒）
+        :param replay_batch_size: 每次重放的数据点数
+        :param max_slots: 槽位目录数量上限
+        :param orphan_scan_interval: 检查无主槽位的间隔（秒）
+        :param name: 缓冲名称，用于线程命名和日志
+        """
+        self.base_directory = directory
+        self.directory = None
+        self.replay_fn = replay_fn
+        self.segment_max_bytes = segment_max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.eviction = eviction
+        self.replay_rate = replay_rate
+        self.replay_batch_size = max(1, int(replay_batch_size))
+        self.max_slots = max_slots
+        self.orphan_scan_interval = orphan_scan_interval
+        self.name = name
+
+        self.segments = deque()
+        self.total_bytes = 0
+        self.pending_records = 0
+        # 重放游标：最早分段中已重放的字节偏移和记录数
+        self.cursor_offset = 0
+        self.cursor_records = 0
+
+        self.active_file = None
+        self.dirty = False
+        self.last_fsync = time.monotonic()
+        self.running = False
+        self.replay_thread = None
+        self._lock_file = None
+        # 正在重放的无主槽位
+        self._orphan = None
+        self._next_orphan_scan = 0.0
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+
+        self.counters = {
+            "spooled": 0,
+            "replayed": 0,
+            "evicted": 0,
+            "rejected": 0,
+            "replay_failures": 0,
+            "replay_skipped": 0,
+            "fsyncs": 0
+        }
+        self.last_replay_error = None
+        self.last_replay_at = None
+
+    # ---- 启动和槽位 ----
+
+    def start(self):
+        """
+        锁定槽位目录、加载已有分段并启动重放线程
+        :return: 是否启动成功
+        """
+        with self._cond:
+            if self.running:
+                return True
+            if not self._acquire_slot():
+                logger.warning(f"写入缓冲目录 {self.base_directory} 的槽位都被其他进程占用，本进程不启用写入缓冲")
+                return False
+            self._load_segments()
+            self.running = True
+            self._stop_event.clear()
+
+        self.replay_thread = threading.Thread(target=self._replay_loop, name=f"{self.name}-spool-replay")
+        self.replay_thread.daemon = True
+        self.replay_thread.start()
+        logger.info(f"写入缓冲 {self.directory} 已启动，待重放数据点: {self.pending_records}，"
+                    f"分段数: {len(self.segments)}")
+        return True
+
+    def _acquire_slot(self):
+        """锁定第一个空闲的槽位目录"""
+        for slot in range(self.max_slots):
+            directory = os.path.join(self.base_directory, f"slot-{slot}")
+            os.makedirs(directory, exist_ok=True)
+            lock_file = _try_lock(directory)
+            if lock_file is None:
+                continue
+            self._lock_file = lock_file
+            self.directory = directory
+            return True
+        return False
+
+    def _adopt_orphan(self):
+        """
+        锁定一个没有进程持有的其他槽位
+        :return: 槽位中有待重放数据时返回对应的WriteSpool（只用于重放），否则返回None
+        """
+        if fcntl is None:
+            return None
+        for slot in range(self.max_slots):
+            directory = os.path.join(self.base_directory, f"slot-{slot}")
+            if directory == self.directory or not os.path.isdir(directory):
+                continue
+            lock_file = _try_lock(directory)
+            if lock_file is None:
+                continue
+            orphan = WriteSpool(self.base_directory, self.replay_fn,
+                                replay_batch_size=self.replay_batch_size, name=self.name)
+            orphan.directory = directory
+            orphan._lock_file = lock_file
+            try:
+                orphan._load_segments()
+            except (OSError, ValueError) as e:
+                logger.error(f"读取槽位 {directory} 失败: {str(e)}")
+                orphan._release_slot()
+                continue
+            if orphan.pending_records > 0:
+                logger.info(f"接管无主槽位 {directory}，待重放数据点: {orphan.pending_records}")
+                return orphan
+            orphan._release_slot()
+        return None
+
+    def _release_slot(self):
+        """释放槽位锁"""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _load_segments(self):
+        """扫描槽位目录中的分段文件和重放游标"""
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)
+        )
+        for name in names:
+            path = os.path.join(self.directory, name)
+            seq = int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+            records, size = _scan_segment(path)
+            if size != os.path.getsize(path):
+                # 截掉崩溃时写了一半的记录，之后才能继续追加
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+                logger.warning(f"分段文件 {name} 末尾有不完整的记录，已截断")
+            self.segments.append(_Segment(seq, path, size, records))
+            self.total_bytes += size
+            self.pending_records += records
+
+        cursor = self._read_cursor()
+        if cursor and self.segments and cursor.get("segment") == self.segments[0].seq:
+            offset = cursor.get("offset", 0)
+            replayed = min(cursor.get("records", 0), self.segments[0].records)
+            if 0 <= offset <= self.segments[0].size:
+                self.cursor_offset = offset
+                self.cursor_records = replayed
+                self.pending_records -= replayed
+
+    def _read_cursor(self):
+        try:
+            with open(os.path.join(self.directory, _CURSOR_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_cursor(self, segment, offset, records):
+        path = os.path.join(self.directory, _CURSOR_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"segment": segment.seq, "offset": offset, "records": records}, f)
+        os.replace(tmp_path, path)
+
+    # ---- 追加写入 ----
+
+    def append(self, records):
+        """
+        把数据点追加到缓冲
+        :param records: 数据点列表（Point、行协议str或bytes）
+        :return: 是否已写入缓冲
+        """
+        if not self.running:
+            return False
+        lines = [to_line_protocol(record) for record in records]
+        data = b"".join(_RECORD_HEADER.pack(len(line)) + line for line in lines)
+
+        with self._cond:
+            if not self._make_room(len(data)):
+                self.counters["rejected"] += len(lines)
+                return False
+
+            segment = self._active_segment(len(data))
+            self.active_file.write(data)
+            segment.size += len(data)
+            segment.records += len(lines)
+            self.total_bytes += len(data)
+            self.pending_records += len(lines)
+            self.counters["spooled"] += len(lines)
+            self.dirty = True
+
+            if time.monotonic() - self.last_fsync >= self.fsync_interval:
+                self._fsync()
+            self._cond.notify_all()
+        return True
+
+    def _make_room(self, size):
+        """按淘汰策略为新数据腾出空间"""
+        while self.total_bytes + size > self.max_total_bytes:
+            if self.eviction != "drop_oldest" or len(self.segments) <= 1:
+                return False
+            self._evict_oldest()
+        return True
+
+    def _evict_oldest(self):
+        """删除最早的分段，其中未重放的数据点计入evicted"""
+        segment = self.segments.popleft()
+        remaining = segment.records - self.cursor_records
+        self.cursor_offset = 0
+        self.cursor_records = 0
+        self.total_bytes -= segment.size
+        self.pending_records -= remaining
+        self.counters["evicted"] += remaining
+        self._remove_file(segment.path)
+        logger.warning(f"写入缓冲超过容量上限，已删除最早的分段，丢弃数据点: {remaining}")
+
+    def _active_segment(self, size):
+        """获取可追加的分段，当前分段写满时切换到新分段"""
+        if self.segments and self.active_file is not None:
+            segment = self.segments[-1]
+            if segment.size + size <= self.segment_max_bytes or segment.size == 0:
+                return segment
+            self._close_active()
+        elif self.segments:
+            # 启动后第一次追加：接着写最后一个分段
+            segment = self.segments[-1]
+            if segment.size + size <= self.segment_max_bytes:
+                self.active_file = open(segment.path, "ab")
+                return segment
+
+        seq = self.segments[-1].seq + 1 if self.segments else 1
+        path = os.path.join(self.directory, f"{_SEGMENT_PREFIX}{seq:010d}{_SEGMENT_SUFFIX}")
+        segment = _Segment(seq, path)
+        self.segments.append(segment)
+        self.active_file = open(path, "ab")
+        return segment
+
+    def _close_active(self):
+        if self.active_file is not None:
+            self._fsync()
+            self.active_file.close()
+            self.active_file = None
+
+    def _fsync(self):
+        if self.active_file is not None and self.dirty:
+            self.active_file.flush()
+            os.fsync(self.active_file.fileno())
+            self.counters["fsyncs"] += 1
+        self.dirty = False
+        self.last_fsync = time.monotonic()
+
+    # ---- 重放 ----
+
+    def _read_batch(self):
+        """从游标处读取下一批记录，返回(分段, 记录列表, 结束偏移)"""
+        with self._cond:
+            if not self.segments:
+                return None, [], 0
+            segment = self.segments[0]
+            if self.active_file is not None and segment is self.segments[-1]:
+                # 读取当前追加中的分段前先把缓冲写入文件
+                self.active_file.flush()
+            start = self.cursor_offset
+            end_limit = segment.size
+
+        lines = []
+        offset = start
+        with open(segment.path, "rb") as f:
+            f.seek(offset)
+            while len(lines) < self.replay_batch_size and offset < end_limit:
+                header = f.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                (length,) = _RECORD_HEADER.unpack(header)
+                line = f.read(length)
+                if len(line) < length:
+                    break
+                lines.append(line)
+                offset += _RECORD_HEADER.size + length
+        return segment, lines, offset
+
+    def _advance(self, segment, offset, count):
+        """重放成功后推进游标，重放完的分段被删除"""
+        with self._cond:
+            if not self.segments or self.segments[0] is not segment:
+                # 分段在重放期间被淘汰
+                return
+            self.pending_records -= count
+            self.cursor_offset = offset
+            self.cursor_records += count
+            if offset >= segment.size:
+                if segment is self.segments[-1]:
+                    # 当前追加中的分段已全部重放，关闭后删除，下次追加时新建分段
+                    self._close_active()
+                self.segments.popleft()
+                self.total_bytes -= segment.size
+                self.pending_records -= segment.records - self.cursor_records
+                self.cursor_offset = 0
+                self.cursor_records = 0
+                self._remove_file(segment.path)
+                self._remove_file(os.path.join(self.directory, _CURSOR_FILE))
+            else:
+                self._write_cursor(segment, offset, self.cursor_records)
+
+    def _replay_batch(self, spool):
+        """
+        重放一个缓冲（本进程的或接管的无主槽位）游标处的一批数据
+        :param spool: 要重放的WriteSpool
+        :return: 处理的数据点数
+        :raises Exception: 可重试的写入错误
+        """
+        segment, lines, offset = spool._read_batch()
+        if not lines:
+            if segment is not None:
+                # 游标之后没有可读的完整记录，跳过分段剩余部分
+                logger.error(f"分段文件 {segment.path} 中有无法读取的记录，已跳过")
+                spool._advance(segment, segment.size, 0)
+            return 0
+
+        try:
+            self.replay_fn(lines)
+        except Exception as e:
+            self.counters["replay_failures"] += 1
+            self.last_replay_error = str(e)
+            if is_retryable(e):
+                raise
+            # 数据本身被拒绝，跳过这一批，避免阻塞后面的数据
+            logger.error(f"重放数据被InfluxDB拒绝，跳过 {len(lines)} 个数据点: {str(e)}")
+            self.counters["replay_skipped"] += len(lines)
+            spool._advance(segment, offset, len(lines))
+            return len(lines)
+
+        self.counters["replayed"] += len(lines)
+        self.last_replay_at = time.time()
+        spool._advance(segment, offset, len(lines))
+        return len(lines)
+
+    def _next_replay_source(self, now):
+        """选择要重放的缓冲：优先本进程的数据，其次是接管的无主槽位"""
+        if self.pending_records > 0:
+            return self
+        if self._orphan is not None and self._orphan.pending_records <= 0:
+            logger.info(f"无主槽位 {self._orphan.directory} 已重放完")
+            self._orphan._release_slot()
+            self._orphan = None
+        if self._orphan is None and now >= self._next_orphan_scan:
+            self._next_orphan_scan = now + self.orphan_scan_interval
+            self._orphan = self._adopt_orphan()
+        return self._orphan
+
+    def _replay_loop(self):
+        """重放线程：按速率上限重放缓冲中的数据，失败时指数退避"""
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            with self._cond:
+                if self.dirty and time.monotonic() - self.last_fsync >= self.fsync_interval:
+                    self._fsync()
+            spool = self._next_replay_source(time.monotonic()) if self.replay_fn is not None else None
+            if spool is None:
+                with self._cond:
+                    if self.pending_records <= 0 and not self._stop_event.is_set():
+                        self._cond.wait(self.fsync_interval)
+                continue
+
+            started_at = time.monotonic()
+            try:
+                count = self._replay_batch(spool)
+            except Exception as e:
+                logger.warning(f"重放缓冲数据失败，{backoff:.0f}秒后重试: {str(e)}")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+                continue
+            backoff = 1.0
+
+            # 限速：每批至少间隔 批大小/速率 秒
+            if self.replay_rate and count:
+                delay = count / self.replay_rate - (time.monotonic() - started_at)
+                if delay > 0:
+                    self._stop_event.wait(delay)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # ---- 关闭和指标 ----
+
+    def close(self, timeout=5.0):
+        """
+        停止重放线程，把已追加的数据写入磁盘
+        :param timeout: 等待重放线程退出的最长时间（秒）
+        """
+        with self._cond:
+            if not self.running:
+                return
+            self.running = False
+            self._stop_event.set()
+            self._cond.notify_all()
+        if self.replay_thread:
+            self.replay_thread.join(timeout=timeout)
+        with self._cond:
+            self._close_active()
+        if self._orphan is not None:
+            self._orphan._release_slot()
+            self._orphan = None
+        self._release_slot()
+        logger.info(f"写入缓冲 {self.directory} 已关闭，待重放数据点: {self.pending_records}")
+
+    def get_metrics(self):
+        """获取缓冲大小、待重放数量和重放进度"""
+        orphan = self._orphan
+        with self._cond:
+            return {
+                "directory": self.directory,
+                "segments": len(self.segments),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_total_bytes,
+                "pending": self.pending_records,
+                "orphan_pending": orphan.pending_records if orphan is not None else 0,
+                "counters": dict(self.counters),
+                "last_replay_at": self.last_replay_at,
+                "last_replay_error": self.last_replay_error
+            }